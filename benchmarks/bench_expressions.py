@@ -0,0 +1,95 @@
+"""
+Micro-benchmark of the expression engine used by the split (match_mode "expression")
+and set_variables blocks.
+
+    python -m benchmarks.bench_expressions [iterations]
+
+For each sample expression it reports the compile time (paid once, when the flow is
+loaded) and the evaluation time per message, next to a hand-written python lambda doing
+the same thing, which is the floor for any evaluator. The last cases run a whole
+expression split block, with the matching condition first and last, next to an exact
+match split (the cost of the block run itself).
+"""
+import sys
+import timeit
+
+from blocks.split_based_on_variable_block import SplitVariableBlock
+from expressions import compile_expression
+
+SCOPE = {
+    "score": "0.91",
+    "intent": "sales",
+    "answer": "  Sim ",
+    "order": {"items": [1, 2, 3], "total": 250.0},
+    "customer": {"vip": False, "name": "Ana"},
+    "price": 10,
+    "quantity": 3,
+    "discount": 0.1,
+}
+
+# expression -> hand-written python equivalent
+SAMPLES = {
+    "score > 0.8 and intent == 'sales'":
+        lambda scope: float(scope["score"]) > 0.8 and scope["intent"] == "sales",
+    "len(order.items) >= 3 or customer.vip":
+        lambda scope: len(scope["order"]["items"]) >= 3 or scope["customer"]["vip"],
+    "lower(strip(answer)) in ['yes', 'sim', 'y']":
+        lambda scope: scope["answer"].strip().lower() in ["yes", "sim", "y"],
+    "price * quantity * (1 - discount)":
+        lambda scope: scope["price"] * scope["quantity"] * (1 - scope["discount"]),
+    "'premium' if order.total > 1000 else 'standard'":
+        lambda scope: "premium" if scope["order"]["total"] > 1000 else "standard",
+}
+
+
+def split_block(conditions: int, matching_position: int) -> SplitVariableBlock:
+    """An expression split with `conditions` branches where only one matches"""
+
+    branches = {f"intent == 'other_{i}'": f"branch_{i}" for i in range(conditions)}
+    keys = list(branches)
+    keys[matching_position] = "score > 0.8 and intent == 'sales'"
+    branches = {key: f"branch_{i}" for i, key in enumerate(keys)}
+    branches["default"] = "default"
+
+    block = SplitVariableBlock(name_in_flow="split", match_mode="expression", branches=branches)
+    block.variables = SCOPE
+    return block
+
+
+def main(iterations: int = 100000):
+    results = {}
+    print(f"{'expression':<50}{'compile us':>12}{'eval ns':>10}{'python ns':>11}")
+    for source, python in SAMPLES.items():
+        compile_seconds = timeit.timeit(lambda: compile_expression(source), number=1000) / 1000
+        expression = compile_expression(source)
+        assert expression.evaluate(SCOPE) == python(SCOPE), source
+
+        evaluate_seconds = timeit.timeit(lambda: expression.evaluate(SCOPE), number=iterations) / iterations
+        python_seconds = timeit.timeit(lambda: python(SCOPE), number=iterations) / iterations
+        results[source] = {
+            "compile_us": compile_seconds * 1e6,
+            "eval_ns": evaluate_seconds * 1e9,
+            "python_ns": python_seconds * 1e9,
+        }
+        print(f"{source:<50}{compile_seconds * 1e6:>12.1f}{evaluate_seconds * 1e9:>10.0f}{python_seconds * 1e9:>11.0f}")
+
+    print()
+    exact = SplitVariableBlock(name_in_flow="split", variable="intent", branches={"sales": "sales", "default": "default"})
+    exact.variables = SCOPE
+    seconds = timeit.timeit(lambda: exact.run_block(None), number=iterations // 10) / (iterations // 10)
+    results["split, exact match"] = seconds * 1e6
+    print(f"{'split, exact match':<50}{seconds * 1e6:>8.2f} us/run")
+    for conditions in (1, 10, 50):
+        for position, label in ((0, "first"), (conditions - 1, "last")):
+            block = split_block(conditions, position)
+            seconds = timeit.timeit(lambda: block.run_block(None), number=iterations // 10) / (iterations // 10)
+            name = f"split, {conditions} conditions, match {label}"
+            results[name] = seconds * 1e6
+            print(f"{name:<50}{seconds * 1e6:>8.2f} us/run")
+            if conditions == 1:
+                break
+    return results
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
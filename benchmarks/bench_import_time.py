@@ -0,0 +1,116 @@
+"""
+Cold start of the package: import time and the modules a mock-only flow loads.
+
+    python -m benchmarks.bench_import_time [--runs 7] [--budget-ms 400]
+
+Run it from the repository root. Each run is a fresh interpreter:
+- `python -X importtime -c "import flows"`: the cumulative import time of flows
+  (median of the runs) and its slowest direct imports
+- a mock-channel flow is created and run, then the script checks that none of the
+  LAZY_MODULES was imported. Twilio, requests, the settings (which need the twilio
+  environment variables), asyncio and sqlite3 must only load when a flow uses them.
+
+Exits with status 1 when the median is over the budget or a lazy module was loaded,
+so it can run in CI.
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+LAZY_MODULES = ("twilio", "requests", "urllib3", "settings", "pydantic_settings", "asyncio", "sqlite3")
+
+MOCK_FLOW = """
+import contextlib, io, json, sys
+from flows import BasicFlow
+from schemas import MessageChannels
+
+with contextlib.redirect_stdout(io.StringIO()):
+    flow = BasicFlow(
+        flow_file="support_example_flow.json",
+        flow_name="cold_start",
+        curr_channel=MessageChannels.mock,
+        from_="whatsapp:+5511999990000",
+        to="whatsapp:+5511999990001",
+    )
+    flow.run_flow()
+    flow.run_flow("2")
+
+print(json.dumps(sorted(name for name in sys.modules if name.split(".")[0] in %r)))
+"""
+
+
+def import_times(module: str) -> list:
+    """(name, cumulative microseconds, depth) of every import, in the -X importtime order"""
+
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, check=True,
+    )
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # nesting is shown with 2 spaces per level
+        depth = (len(name) - len(name.lstrip())) // 2
+        times.append((name.strip(), int(cumulative), depth))
+    return times
+
+
+def direct_imports(times: list, module: str) -> list:
+    """The imports done by the module itself. They are listed right before it, one level deeper"""
+
+    position = next(i for i, (name, _, _) in enumerate(times) if name == module)
+    depth = times[position][2]
+    children = []
+    for name, cumulative, child_depth in reversed(times[:position]):
+        if child_depth <= depth:
+            break
+        if child_depth == depth + 1:
+            children.append((name, cumulative))
+    return children
+
+
+def module_time(times: list, module: str) -> int:
+    return next(cumulative for name, cumulative, _ in times if name == module)
+
+
+def loaded_lazy_modules() -> list:
+    result = subprocess.run(
+        [sys.executable, "-c", MOCK_FLOW % (LAZY_MODULES,)],
+        capture_output=True, text=True, check=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure the cold start of the package")
+    parser.add_argument("--module", default="flows")
+    parser.add_argument("--runs", type=int, default=7)
+    parser.add_argument("--budget-ms", type=float, default=400)
+    args = parser.parse_args(argv)
+
+    runs = [import_times(args.module) for _ in range(args.runs)]
+    total_ms = statistics.median(module_time(times, args.module) for times in runs) / 1000
+
+    # slowest direct imports of the module, from the median run
+    median_run = sorted(runs, key=lambda times: module_time(times, args.module))[len(runs) // 2]
+    children = direct_imports(median_run, args.module)
+
+    print(f"import {args.module}: {total_ms:.1f} ms (median of {args.runs}, budget {args.budget_ms:.0f} ms)")
+    for name, cumulative in sorted(children, key=lambda child: -child[1])[:10]:
+        print(f"  {name:<40}{cumulative / 1000:>8.1f} ms")
+
+    loaded = loaded_lazy_modules()
+    print(f"lazy modules loaded by a mock flow: {', '.join(loaded) if loaded else 'none'}")
+
+    ok = total_ms <= args.budget_ms and not loaded
+    if not ok:
+        print("FAILED")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,69 @@
+"""
+Memory held by live conversations.
+
+    python -m benchmarks.bench_memory [conversations]
+
+Run it from the repository root. It keeps `conversations` flows alive, each one
+waiting for the user answer (after its first run_flow), and prints the memory per
+conversation measured with tracemalloc, plus the estimate for 500k open conversations.
+"""
+import contextlib
+import gc
+import io
+import sys
+import tracemalloc
+
+from benchmarks import synthetic
+from flows import BasicFlow
+from schemas import MessageChannels
+
+OPEN_CONVERSATIONS = 500_000
+
+
+def measure(flow_file: str, conversations: int) -> float:
+    """Bytes held by each live conversation of the flow"""
+
+    def new_flow(index):
+        flow = BasicFlow(
+            flow_file=flow_file,
+            flow_name="bench",
+            curr_channel=MessageChannels.mock,
+            from_="whatsapp:+5511999990000",
+            to=f"whatsapp:+55119{index:08d}",
+        )
+        flow.run_flow()
+        return flow
+
+    new_flow(0)  # compile the flow template before measuring
+    gc.collect()
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    live = [new_flow(i) for i in range(conversations)]
+    gc.collect()
+    current = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    del live
+    return (current - baseline) / conversations
+
+
+def main(conversations: int = 2000):
+    results = {}
+    with synthetic.flow_dir() as directory, contextlib.redirect_stdout(io.StringIO()):
+        flows = {
+            "support_example_flow.json": "support_example_flow.json",
+            "linear, 20 blocks": synthetic.write_flow(directory, "linear", synthetic.linear_flow(20)[0]),
+            "wide split, 20 branches": synthetic.write_flow(directory, "wide_split", synthetic.wide_split_flow(20)[0]),
+            "set_variables, 20 blocks": synthetic.write_flow(directory, "set_variables", synthetic.set_variables_flow(20)[0]),
+        }
+        for name, flow_file in flows.items():
+            results[name] = measure(flow_file, conversations)
+
+    for name, size in results.items():
+        total = size * OPEN_CONVERSATIONS / 1024 ** 3
+        print(f"{name:<28}{size / 1024:>10.2f} KB/conversation{total:>10.2f} GB for 500k")
+    return results
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
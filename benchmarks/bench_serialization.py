@@ -0,0 +1,110 @@
+"""
+Compare the size and speed of the flow state formats.
+
+    python -m benchmarks.bench_serialization [conversations]
+
+Run it from the repository root. For each format it prints the average bytes per
+conversation and the encode/decode time per conversation:
+- full model dump: the pydantic dump of the BasicFlow fields and of every block (the
+  whole flow json with the block states). Decoding validates the flow and every
+  block again, like a conversation restored from its models
+- snapshot json: json of flow.snapshot() (decode = BasicFlow.from_snapshot)
+- compact msgpack: flow_serialization.dumps_flow / loads_flow
+"""
+import contextlib
+import io
+import json
+import sys
+import time
+
+from flow_serialization import dumps_flow, loads_flow
+from flows import BasicFlow
+from schemas import MessageChannels
+
+
+def build_conversations(count: int) -> list:
+    """Conversations spread over the stages of the example flows"""
+
+    flows = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for i in range(count):
+            flow = BasicFlow(
+                flow_file="support_example_flow.json" if i % 2 else "flow1.json",
+                flow_name="bench",
+                curr_channel=MessageChannels.mock,
+                from_="whatsapp:+5511999990000",
+                to=f"whatsapp:+55119{i:08d}",
+            )
+            stage = i % 3
+            if stage >= 1:
+                flow.run_flow()
+            if stage >= 2 and flow.flow_file == "support_example_flow.json":
+                flow.run_flow("I need help with my order")
+            flows.append(flow)
+    return flows
+
+
+# block class name -> class, to validate the dumped blocks again
+_BLOCK_CLASSES = {}
+
+
+def dump_models(flow: BasicFlow) -> bytes:
+    """The flow fields and all its blocks, with their configuration and state"""
+
+    blocks = []
+    for block in flow.blocks:
+        _BLOCK_CLASSES[type(block).__name__] = type(block)
+        blocks.append([type(block).__name__, block.model_dump()])
+    record = {"flow": flow.model_dump(mode="json"), "blocks": blocks}
+    # default=str: the exceptions kept by the failed http blocks
+    return json.dumps(record, separators=(",", ":"), default=str).encode()
+
+
+def load_models(data: bytes) -> tuple:
+    record = json.loads(data)
+    blocks = [_BLOCK_CLASSES[name].model_validate(fields) for name, fields in record["blocks"]]
+    return BasicFlow.model_validate(record["flow"]), blocks
+
+
+def measure(flows: list, encode, decode) -> dict:
+    start = time.perf_counter()
+    encoded = [encode(flow) for flow in flows]
+    encode_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for data in encoded:
+        decode(data)
+    decode_time = time.perf_counter() - start
+
+    return {
+        "bytes_per_conversation": sum(len(data) for data in encoded) / len(flows),
+        "encode_us": encode_time / len(flows) * 1e6,
+        "decode_us": decode_time / len(flows) * 1e6,
+    }
+
+
+def main(count: int = 1000):
+    flows = build_conversations(count)
+
+    results = {
+        "full model dump": measure(flows, dump_models, load_models),
+        "snapshot json": measure(
+            flows,
+            lambda flow: json.dumps(flow.snapshot(), separators=(",", ":")).encode(),
+            lambda data: BasicFlow.from_snapshot(json.loads(data)),
+        ),
+        "compact msgpack": measure(flows, dumps_flow, loads_flow),
+    }
+
+    print(f"{count} conversations")
+    print(f"{'format':<18}{'bytes/conv':>12}{'encode us':>12}{'decode us':>12}")
+    for name, result in results.items():
+        print(
+            f"{name:<18}{result['bytes_per_conversation']:>12.0f}"
+            f"{result['encode_us']:>12.1f}{result['decode_us']:>12.1f}"
+        )
+    return results
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
@@ -0,0 +1,89 @@
+"""
+Micro-benchmark of the template rendering used by the set_variables and http_request blocks.
+
+    python -m benchmarks.bench_templates [iterations]
+
+Compares the compiled templates (templates.py) with parsing the templates on every run,
+which is what the blocks did before: split-based parsing of '{{block.value.key}}' and a
+recursive str.format walk over headers/options/body.
+"""
+import copy
+import sys
+import timeit
+
+from templates import compile_format_template, compile_reference_template
+
+VARIABLES = {
+    "x": "{{http_call.outbound}}",
+    "user_id": "{{http_call.outbound.userId}}",
+    "answer": "{{ask.inbound}}",
+    "static": 42,
+    "label": "premium",
+}
+
+REQUEST = {
+    "headers": {"Content-Type": "application/json", "Authorization": "Bearer {token}"},
+    "options": {"method": "POST", "url": "https://api.example.com/users/{user_id}/orders"},
+    "body": {"user": {"id": "{user_id}", "answer": "{answer}"}, "source": "whatsapp"},
+}
+
+FLOW_VARIABLES = {"token": "abc123", "user_id": 7, "answer": "2"}
+
+BLOCK_VALUES = {
+    ("http_call", "outbound"): {"userId": 7, "title": "order"},
+    ("ask", "inbound"): "2",
+}
+
+
+def lookup(block_name, attribute):
+    return BLOCK_VALUES.get((block_name, attribute))
+
+
+def parse_every_run_variables():
+    """The split-based parsing done on every run before the templates were compiled"""
+    variables = VARIABLES.copy()
+    for key, value in variables.items():
+        value = str(value)
+        if "{{" in value and "}}" in value:
+            text_inside = value.split("{{")[-1].split("}}")[0]
+            parts = text_inside.split(".")
+            dict_key = parts[2] if len(parts) == 3 else None
+            variables[key] = lookup(parts[0], parts[1])
+            if dict_key:
+                variables[key] = variables[key][dict_key]
+    return variables
+
+
+def format_every_run(dict_: dict, variables: dict):
+    """The recursive str.format walk done on every run (on a copy, it used to mutate the block)"""
+    for key, value in dict_.items():
+        if isinstance(value, str):
+            dict_[key] = value.format(**variables)
+        elif isinstance(value, dict):
+            dict_[key] = format_every_run(value, variables)
+    return dict_
+
+
+def main(iterations: int = 100000):
+    compiled_variables = {key: compile_reference_template(value) for key, value in VARIABLES.items()}
+    compiled_request = compile_format_template(REQUEST)
+
+    cases = {
+        "set_variables, parse every run": parse_every_run_variables,
+        "set_variables, compiled": lambda: {
+            key: template.render(lookup) for key, template in compiled_variables.items()
+        },
+        "http format, parse every run": lambda: format_every_run(copy.deepcopy(REQUEST), FLOW_VARIABLES),
+        "http format, compiled": lambda: compiled_request.render(FLOW_VARIABLES),
+    }
+
+    results = {}
+    for name, case in cases.items():
+        seconds = timeit.timeit(case, number=iterations)
+        results[name] = seconds / iterations * 1e6
+        print(f"{name:<34}{results[name]:>8.2f} us/run")
+    return results
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,195 @@
+"""
+Benchmark suite of the flow engine.
+
+    python -m benchmarks.run_benchmarks [--size 20] [--conversations 500] [--output results.json] [--compare old.json]
+
+Run it from the repository root. It generates synthetic flows (benchmarks/synthetic.py)
+and runs whole conversations (run_flow() + run_flow(answer)) through BasicFlow with the
+mock channel. The http scenario calls a local stub server. For each scenario it reports:
+- conversations_per_second: conversations run one after the other, construction included
+- construction_us: time to build a BasicFlow from the (already compiled) flow file
+- step_p50_us / step_p99_us: latency of the block runs, taken with an instrumentation hook
+- memory_per_conversation_kb: memory held by each live conversation after its first step
+- peak_memory_kb: tracemalloc peak while building those conversations
+
+The results are saved as JSON with the git commit, so two versions can be compared
+with --compare.
+"""
+import argparse
+import contextlib
+import io
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from benchmarks import synthetic
+from flows import BasicFlow
+from instrumentation import add_hook, remove_hook
+from schemas import MessageChannels
+
+SCENARIOS = ("linear", "wide_split", "set_variables", "http")
+
+# metrics where a bigger value is better, for --compare
+HIGHER_IS_BETTER = {"conversations_per_second"}
+
+
+class StepTimes:
+    """Instrumentation hook that keeps the duration of every block run"""
+
+    def __init__(self):
+        self.durations = []
+
+    def on_block_start(self, flow, block, action):
+        pass
+
+    def on_block_end(self, flow, block, action, duration, error=None):
+        self.durations.append(duration)
+
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+def new_flow(flow_file: str, index: int) -> BasicFlow:
+    return BasicFlow(
+        flow_file=flow_file,
+        flow_name="bench",
+        curr_channel=MessageChannels.mock,
+        from_="whatsapp:+5511999990000",
+        to=f"whatsapp:+55119{index:08d}",
+    )
+
+
+def run_scenario(flow_file: str, answer: str, conversations: int, live_conversations: int) -> dict:
+    # warm up the flow registry and the http connection pool
+    warmup = new_flow(flow_file, 0)
+    warmup.run_flow()
+    warmup.run_flow(answer)
+
+    start = time.perf_counter()
+    for i in range(conversations):
+        new_flow(flow_file, i)
+    construction_time = time.perf_counter() - start
+
+    steps = StepTimes()
+    add_hook(steps)
+    try:
+        start = time.perf_counter()
+        for i in range(conversations):
+            flow = new_flow(flow_file, i)
+            flow.run_flow()
+            flow.run_flow(answer)
+        elapsed = time.perf_counter() - start
+    finally:
+        remove_hook(steps)
+
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    live = []
+    for i in range(live_conversations):
+        flow = new_flow(flow_file, i)
+        flow.run_flow()
+        live.append(flow)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "conversations_per_second": conversations / elapsed,
+        "construction_us": construction_time / conversations * 1e6,
+        "step_p50_us": percentile(steps.durations, 0.5) * 1e6,
+        "step_p99_us": percentile(steps.durations, 0.99) * 1e6,
+        "steps_per_conversation": len(steps.durations) / conversations,
+        "memory_per_conversation_kb": (current - baseline) / live_conversations / 1024,
+        "peak_memory_kb": (peak - baseline) / 1024,
+    }
+
+
+def run(scenarios=SCENARIOS, size: int = 20, conversations: int = 500, live_conversations: int = 200) -> dict:
+    results = {}
+
+    with synthetic.flow_dir() as directory, synthetic.StubHTTPServer() as server, contextlib.redirect_stdout(io.StringIO()):
+        generators = {
+            "linear": lambda: synthetic.linear_flow(size),
+            "wide_split": lambda: synthetic.wide_split_flow(size),
+            "set_variables": lambda: synthetic.set_variables_flow(size),
+            "http": lambda: synthetic.http_flow(max(size // 4, 1), server.url),
+        }
+        for name in scenarios:
+            flow, answer = generators[name]()
+            flow_file = synthetic.write_flow(directory, name, flow)
+            # the http scenario is much slower, keep its run short
+            count = conversations if name != "http" else max(conversations // 5, 1)
+            results[name] = run_scenario(flow_file, answer, count, live_conversations)
+            results[name]["blocks"] = len(flow)
+
+    return {
+        "meta": {
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "size": size,
+            "conversations": conversations,
+        },
+        "results": results,
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(report: dict, baseline: dict = None):
+    base_results = baseline["results"] if baseline else {}
+    for scenario, metrics in report["results"].items():
+        print(f"{scenario} ({metrics['blocks']} blocks)")
+        for metric, value in metrics.items():
+            if metric == "blocks":
+                continue
+            line = f"  {metric:<28}{value:>12.2f}"
+            old = base_results.get(scenario, {}).get(metric)
+            if old:
+                change = (value - old) / old * 100
+                better = change > 0 if metric in HIGHER_IS_BETTER else change < 0
+                label = "" if abs(change) < 0.05 else ("better" if better else "worse")
+                line += f"  {change:+7.1f}% {label}"
+            print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the flow engine with synthetic flows")
+    parser.add_argument("--size", type=int, default=20, help="blocks (or branches) of the synthetic flows")
+    parser.add_argument("--conversations", type=int, default=500)
+    parser.add_argument("--live", type=int, default=200, help="live conversations for the memory measure")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--output", help="save the results to this json file")
+    parser.add_argument("--compare", help="json file of a previous run to compare with")
+    args = parser.parse_args(argv)
+
+    report = run(args.scenarios, args.size, args.conversations, args.live)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+    print_results(report, baseline)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+    return report
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
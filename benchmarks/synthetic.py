@@ -0,0 +1,190 @@
+"""
+Synthetic flows and a stub http server for the benchmarks.
+
+Every generator returns (flow_definition, answer): the flow dict, in the same format
+as the files in ./flows, and the reply the benchmark sends to its send_and_reply block.
+All the flows start with a send_and_reply block, so one conversation is
+run_flow() + run_flow(answer).
+"""
+import json
+import os
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def linear_flow(size: int):
+    """A chain of `size` message blocks after the first question"""
+
+    flow = {
+        "ask": {
+            "block_type": "send_and_reply",
+            "sending_content": "Hi! What is your name?",
+            "next_block_name": "step_0",
+        }
+    }
+    for i in range(size):
+        flow[f"step_{i}"] = {
+            "block_type": "single_message",
+            "sending_content": f"Step {i} of {size}",
+            "next_block_name": f"step_{i + 1}",
+            "is_final_block": i == size - 1,
+        }
+    return flow, "John"
+
+
+def wide_split_flow(size: int):
+    """A split with `size` branches on the answer of the first question"""
+
+    branches = {str(i): f"branch_{i}" for i in range(size)}
+    branches["default"] = "branch_0"
+    branches["on_error"] = "branch_0"
+
+    flow = {
+        "ask": {
+            "block_type": "send_and_reply",
+            "sending_content": f"Choose an option from 0 to {size - 1}",
+            "next_block_name": "set_answer",
+        },
+        "set_answer": {
+            "block_type": "set_variables",
+            "next_block_name": "split",
+            "variables": {"answer": "{{ask.inbound}}"},
+        },
+        "split": {
+            "block_type": "split_variable",
+            "variable": "answer",
+            "branches": branches,
+        },
+    }
+    for i in range(size):
+        flow[f"branch_{i}"] = {
+            "block_type": "single_message",
+            "sending_content": f"You chose {i}",
+            "next_block_name": "end",
+            "is_final_block": True,
+        }
+    return flow, str(size - 1)
+
+
+def set_variables_flow(size: int, variables_per_block: int = 10):
+    """`size` set_variables blocks, each one reading the answer and the block before it"""
+
+    flow = {
+        "ask": {
+            "block_type": "send_and_reply",
+            "sending_content": "Hi! What is your name?",
+            "next_block_name": "vars_0",
+        }
+    }
+    previous = "ask"
+    for i in range(size):
+        variables = {f"v{i}_{j}": "{{ask.inbound}}" for j in range(variables_per_block - 1)}
+        variables[f"v{i}_prev"] = f"{{{{{previous}.outbound}}}}"
+        flow[f"vars_{i}"] = {
+            "block_type": "set_variables",
+            "next_block_name": f"vars_{i + 1}" if i < size - 1 else "done",
+            "variables": variables,
+        }
+        previous = f"vars_{i}"
+    flow["done"] = {
+        "block_type": "single_message",
+        "sending_content": "Done",
+        "next_block_name": "end",
+        "is_final_block": True,
+    }
+    return flow, "John"
+
+
+def http_flow(size: int, base_url: str):
+    """`size` http requests to the stub server, each one followed by a set_variables"""
+
+    flow = {
+        "ask": {
+            "block_type": "send_and_reply",
+            "sending_content": "What is your user id?",
+            "next_block_name": "save_id",
+        },
+        "save_id": {
+            "block_type": "set_variables",
+            "next_block_name": "call_0",
+            "variables": {"user_id": "{{ask.inbound}}"},
+        },
+    }
+    for i in range(size):
+        flow[f"call_{i}"] = {
+            "block_type": "http_request",
+            "next_block_name": f"read_{i}",
+            "options": {"method": "POST", "url": f"{base_url}/users/{{user_id}}/step/{i}", "timeout": 5},
+            "body": {"user_id": "{user_id}", "step": i},
+        }
+        flow[f"read_{i}"] = {
+            "block_type": "set_variables",
+            "next_block_name": f"call_{i + 1}" if i < size - 1 else "done",
+            "variables": {f"status_{i}": f"{{{{call_{i}.outbound.status}}}}"},
+        }
+    flow["done"] = {
+        "block_type": "single_message",
+        "sending_content": "Done",
+        "next_block_name": "end",
+        "is_final_block": True,
+    }
+    return flow, "7"
+
+
+def write_flow(directory: str, name: str, flow: dict) -> str:
+    """Write the flow to the directory and return its absolute path"""
+
+    path = os.path.abspath(os.path.join(directory, f"{name}.json"))
+    with open(path, "w") as file:
+        json.dump(flow, file)
+    return path
+
+
+def flow_dir() -> tempfile.TemporaryDirectory:
+    """A temporary directory for the flow files of a run, removed when the with block exits"""
+    return tempfile.TemporaryDirectory(prefix="flow_bench_")
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            self.rfile.read(length)
+
+        body = json.dumps({"status": "ok", "path": self.path}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_POST = do_GET
+
+
+class StubHTTPServer:
+    """A local json server running in a thread. Use it as a context manager"""
+
+    def __init__(self):
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _StubHandler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
@@ -1,8 +1,9 @@
-from typing import Optional, List
+from typing import Callable, Optional, List
 
-from pydantic import AliasChoices, BaseModel, Field
+from pydantic import AliasChoices, BaseModel, Field, PrivateAttr
 
-from schemas import BlockStatus, MessageChannels
+from message_channels.channels_factory import get_channel
+from schemas import BlockStatus, DeliveryResult, Message, MessageChannels
 
 class BasicBlock(BaseModel):
     """A basic block in a flow"""
@@ -27,6 +28,17 @@ class BasicBlock(BaseModel):
         """
         pass
 
+    async def arun_block(self, event=None):
+        """
+        Run the block inside an event loop. Blocks that wait on the network
+        override it; the others just run synchronously.
+        """
+        return self.run_block(event)
+
+    async def acontinue_block(self, event=None):
+        """Continue running the block inside an event loop"""
+        return self.continue_block(event)
+
     def reset_block(self):
         """Reset the block to its initial state"""
         pass
@@ -37,6 +49,106 @@ class BaseMessageBlock(BasicBlock):
     messaging_channel: MessageChannels
     to: str
     from_: str = Field(..., validation_alias=AliasChoices('from_', 'from'))
+    delivery_status: Optional[str] = None # queued, sent or failed when sending through the outbound dispatcher
+    # text already sent in chunks by a streamed http block. Kept in the block state, so a
+    # conversation saved between the stream and the block doesn't send it again
+    streamed_content: Optional[str] = None
+
+    # called with the DeliveryResult of the message queued on the outbound dispatcher
+    _delivery_listeners: Optional[list] = PrivateAttr(default=None)
+
+    async def asend(self, message: Message):
+        """
+        Send a message inside an event loop. If an outbound dispatcher is set the message
+        is queued on it and the delivery result is reported back to the block later.
+        """
+
+        from dispatcher import get_dispatcher
+
+        dispatcher = get_dispatcher()
+        if dispatcher is None:
+            channel = get_channel(self.messaging_channel)
+            await channel.asend_message(message)
+            return
+
+        self.delivery_status = "queued"
+        await dispatcher.submit(self.messaging_channel, message, on_result=self.set_delivery_result)
+
+    def send_chunk(self, content: str):
+        """
+        Send part of a streamed answer (see streaming.py). The chunks are kept and,
+        when the flow runs the block, it doesn't send its own message again.
+        """
+
+        message = Message(to=self.to, from_=self.from_, content=content.strip())
+        get_channel(self.messaging_channel).send_message(message)
+        self._add_streamed(content)
+
+    async def asend_chunk(self, content: str):
+        """
+        Send part of a streamed answer inside an event loop. With an outbound dispatcher the
+        chunk goes through its queue and rate limits, and the next chunk waits for its delivery
+        so the user gets them in order
+        """
+
+        from dispatcher import get_dispatcher
+
+        message = Message(to=self.to, from_=self.from_, content=content.strip())
+        dispatcher = get_dispatcher()
+        if dispatcher is None:
+            await get_channel(self.messaging_channel).asend_message(message)
+        else:
+            self.set_delivery_result(await dispatcher.send(self.messaging_channel, message))
+        self._add_streamed(content)
+
+    def chunk_sender(self, loop=None) -> Callable[[str], None]:
+        """
+        The chunk sink of a streamed http block. The http block reads the stream in a worker
+        thread when the flow runs in an event loop: its chunks are sent by asend_chunk on that loop
+        """
+
+        if loop is None:
+            return self.send_chunk
+
+        import asyncio
+
+        def send(content: str):
+            asyncio.run_coroutine_threadsafe(self.asend_chunk(content), loop).result()
+        return send
+
+    def _add_streamed(self, content: str):
+        self.streamed_content = (self.streamed_content or "") + content
+
+    def mark_delivered(self, content: str):
+        """
+        The message of the block was already delivered (before a crash, see journal.py).
+        Running the block uses the content without sending it again, like a streamed answer
+        """
+        self.streamed_content = content
+
+    def pop_streamed_content(self) -> Optional[str]:
+        """Return the text already streamed (or delivered) by the block, if any, and clear it"""
+
+        if not self.streamed_content:
+            return None
+        content = self.streamed_content.strip()
+        self.streamed_content = None
+        return content
+
+    def set_delivery_result(self, result: DeliveryResult):
+        """Called by the outbound dispatcher once the message was delivered (or failed)"""
+        self.delivery_status = "sent" if result.success else "failed"
+        listeners, self._delivery_listeners = self._delivery_listeners, None
+        for listener in listeners or ():
+            listener(result)
+
+    def on_delivery(self, listener: Callable[[DeliveryResult], None]):
+        """Call the listener with the delivery result of the message queued on the dispatcher"""
+
+        # a new list per block: the copies of a prototype share its private values
+        if self._delivery_listeners is None:
+            self._delivery_listeners = []
+        self._delivery_listeners.append(listener)
 
 
 
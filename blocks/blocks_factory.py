@@ -25,6 +25,10 @@ def get_block(block_infos: dict):
         from blocks.split_based_on_variable_block import SplitVariableBlock
         return SplitVariableBlock(**block_infos)
 
+    if block_type == BlockTypes.parallel_http:
+        from blocks.parallel_http_block import ParallelHTTPBlock
+        return ParallelHTTPBlock(**block_infos)
+
     raise ValueError(f'{block_type} is not a valid block type.')
     
 
@@ -1,54 +1,177 @@
-import requests
+import logging
+from typing import Callable, Optional
+
+from pydantic import PrivateAttr
 
 from blocks.basicBlock import BasicBlock
+from http_cache import DEFAULT_DISK_PATH, DEFAULT_MAX_ENTRIES, DEFAULT_TTL, get_response_cache
+from http_client import (
+    DEFAULT_BACKOFF_FACTOR,
+    DEFAULT_MAX_CONNECTIONS,
+    DEFAULT_RETRIES,
+    DEFAULT_TIMEOUT,
+    http_pool,
+)
 from schemas import BlockStatus
+from streaming import DEFAULT_MAX_CHARS, DEFAULT_MIN_CHARS, TextChunker, iter_stream_text
+from templates import compile_format_template
 
 class HTTPBlock(BasicBlock):
     headers: dict = {}
     options: dict = {}
     body: dict = {}
     variables: dict = {} #variables that comes from the flow. Usefull for dynamic values on API routes or body
+    cache: dict = {} #response cache settings. Empty means the responses are not cached. See http_cache.py
+    stream: dict = {} #streaming settings. Empty means the whole response is read at once. See streaming.py
+
+    # headers, options and body compiled once. Rendering them never changes the block values
+    _headers_template = PrivateAttr(default=None)
+    _options_template = PrivateAttr(default=None)
+    _body_template = PrivateAttr(default=None)
+    # receives the chunks of a streamed response, set by the flow from stream["forward_to"]
+    _chunk_sink: Optional[Callable[[str], None]] = PrivateAttr(default=None)
+
+    def __init__(self, **data):
+        super().__init__(**data)
+        self._headers_template = compile_format_template(self.headers)
+        self._options_template = compile_format_template(self.options)
+        self._body_template = compile_format_template(self.body)
 
     def run_block(self, event: dict):
         
         if self.status == BlockStatus.ready:
+            request = self.build_request()
+            response = self.send_request(request)
+            return self.set_response(response)
+
+    async def arun_block(self, event: dict):
+        """Run the request in a worker thread so the event loop keeps serving other flows"""
+        import asyncio
+
+        if self.status == BlockStatus.ready:
+            request = self.build_request()
+            response = await asyncio.to_thread(self.send_request, request)
+            return self.set_response(response)
+
+    def build_request(self, variables: Optional[dict] = None) -> dict:
+        """
+        Format the block values with the flow variables (or the given ones) and
+        return the request arguments
+        """
+
+        if variables is None:
+            variables = self.variables
+        headers = self._headers_template.render(variables)
+        options = self._options_template.render(variables)
+        body = self._body_template.render(variables)
+
+        #print(f"formatted headers: {headers}")
+        #print(f"formatted options: {options}")
+        #print(f"formatted body: {body}")
+
+        return {
+            "method": options.get("method", "GET"),
+            "url": options.get("url", ""),
+            "headers": headers,
+            "json": body,
+            "timeout": options.get("timeout", DEFAULT_TIMEOUT),
+            "retries": options.get("retries", DEFAULT_RETRIES),
+            "backoff_factor": options.get("backoff_factor", DEFAULT_BACKOFF_FACTOR),
+            "max_connections": options.get("max_connections", DEFAULT_MAX_CONNECTIONS),
+        }
+
+    def send_request(self, request: dict):
+        """
+        Send the request through the shared connection pool.
+        Returns the json response, or the exception if the request failed
+        """
+
+        if self.stream:
+            return self.stream_request(request)
+
+        cache = self.get_cache()
+        if cache is not None:
+            hit, response = cache.get(request)
+            if hit:
+                return response
+
+        successful = False
+        try:
+            http_response = http_pool.request(**request)
+            successful = http_response.ok
+            response = http_response.json()
+        except Exception as e:
+            response = e
 
-            self.headers = self.format_dict(self.headers, self.variables)
-            self.options = self.format_dict(self.options, self.variables)
-            self.body = self.format_dict(self.body, self.variables)
-
-            #print(f"formatted headers: {self.headers}")
-            #print(f"formatted options: {self.options}")
-            #print(f"formatted body: {self.body}")
-            
-
-            try:
-                response = requests.request(
-                    method=self.options.get("method", "GET"),
-                    url=self.options.get("url", ""),
-                    headers=self.headers,
-                    json=self.body
+        # error bodies (a 503 page in json) are returned but not cached, the next request tries again
+        if cache is not None and successful and not isinstance(response, Exception):
+            cache.set(request, response, self.cache.get("ttl", DEFAULT_TTL))
+
+        return response
+
+    def set_chunk_sink(self, sink: Optional[Callable[[str], None]]):
+        """Set the function that receives the chunks of a streamed response"""
+        self._chunk_sink = sink
+
+    def stream_request(self, request: dict):
+        """
+        Send the request and read the response while it arrives, forwarding the text in
+        chunks to the chunk sink. Returns the full text, or the exception if the request failed
+        """
+
+        chunker = TextChunker(
+            chunk_by=self.stream.get("chunk_by", "sentence"),
+            min_chars=self.stream.get("min_chars", DEFAULT_MIN_CHARS),
+            max_chars=self.stream.get("max_chars", DEFAULT_MAX_CHARS),
+        )
+        full_text = []
+
+        try:
+            with http_pool.request(**request, stream=True) as response:
+                response.raise_for_status()
+                texts = iter_stream_text(
+                    response,
+                    format=self.stream.get("format", "sse"),
+                    content_path=self.stream.get("content_path"),
                 )
-                response = response.json()
-            except Exception as e:
-                response = e
-            
-
-            self.status = BlockStatus.success
-            self.outbound = response
-            self.run_next_block = True
-
-            return {
-                "next_block_name": self.next_block_name,
-                "run_next_block": self.run_next_block,
-            }
-
-    def format_dict(self, dict_: dict, variables: dict):
-        #print(f'received variables: {variables}')
-        #print(f"received dict: {dict_}")
-        for key, value in dict_.items():
-            if isinstance(value, str):
-                dict_[key] = value.format(**variables)
-            elif isinstance(value, dict):
-                dict_[key] = self.format_dict(value, variables)
-        return dict_
\ No newline at end of file
+                for text in texts:
+                    full_text.append(text)
+                    for chunk in chunker.feed(text):
+                        self.forward_chunk(chunk)
+
+            last_chunk = chunker.flush()
+            if last_chunk is not None:
+                self.forward_chunk(last_chunk)
+        except Exception as e:
+            logging.error(f"Error streaming response of block {self.name_in_flow}: {e}")
+            return e
+
+        return "".join(full_text)
+
+    def forward_chunk(self, chunk: str):
+        if self._chunk_sink is not None:
+            self._chunk_sink(chunk)
+
+    def get_cache(self):
+        """Return the response cache of the block, or None if caching is disabled"""
+
+        if not self.cache:
+            return None
+
+        return get_response_cache(
+            backend=self.cache.get("backend", "memory"),
+            max_entries=self.cache.get("max_entries", DEFAULT_MAX_ENTRIES),
+            path=self.cache.get("path", DEFAULT_DISK_PATH),
+        )
+
+    def set_response(self, response):
+        """Store the response and update the status of the block"""
+
+        self.status = BlockStatus.success
+        self.outbound = response
+        self.run_next_block = True
+
+        return {
+            "next_block_name": self.next_block_name,
+            "run_next_block": self.run_next_block,
+        }
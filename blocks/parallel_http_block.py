@@ -0,0 +1,233 @@
+import logging
+import threading
+import time
+from typing import Optional
+
+from pydantic import PrivateAttr
+
+from blocks.basicBlock import BasicBlock
+from blocks.http_request_block import HTTPBlock
+from schemas import BlockStatus
+
+"""
+The ParallelHTTPBlock sends several independent http requests at the same time and
+waits for them according to a policy. Each request accepts the same fields as an
+http_request block (options, headers, body, cache):
+
+"lookups": {
+    "block_type": "parallel_http",
+    "next_block_name": "set_results",
+    "timeout": 5,
+    "policy": "all",
+    "on_error": "lookup_failed",
+    "requests": {
+        "crm": {"options": {"method": "GET", "url": "https://crm.example.com/contacts/{phone}"}},
+        "orders": {"options": {"method": "GET", "url": "https://shop.example.com/orders?phone={phone}"}}
+    }
+}
+
+Policies:
+- all: every request must succeed
+- any: the block continues as soon as one request succeeds
+- quorum: the block continues as soon as `quorum` requests succeed
+
+The outbound is a dict with the response of each request, so the next blocks can use
+"{{lookups.outbound.crm.name}}". Requests that failed hold the exception and the ones
+that didn't finish before the timeout hold None. When the policy is not met the block
+goes to `on_error`, or to `next_block_name` if on_error is not set.
+
+The requests the block stops waiting for (after the timeout, or once the policy is
+decided) are not left to take over the shared thread pool: the ones that didn't start
+yet are cancelled, the http timeout of each request is at most the block timeout, and
+`max_in_flight` caps the requests of the block running at the same time across all the
+conversations (default: half of the pool, or the number of requests if it's larger).
+A request over the cap fails right away instead of waiting for a worker.
+"""
+
+POLICIES = ("all", "any", "quorum")
+
+MAX_WORKERS = 32
+DEFAULT_MAX_IN_FLIGHT = MAX_WORKERS // 2
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """The thread pool shared by the parallel http blocks, created on first use"""
+
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                from concurrent.futures import ThreadPoolExecutor
+                _executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="parallel_http")
+    return _executor
+
+
+class ParallelHTTPBlock(BasicBlock):
+    """A block that sends several http requests concurrently"""
+
+    requests: dict = {}
+    variables: dict = {} #variables that comes from the flow. Usefull for dynamic values on API routes or body
+    timeout: Optional[float] = None #seconds to wait for the requests. None waits until the policy is decided
+    policy: str = "all"
+    quorum: Optional[int] = None
+    on_error: Optional[str] = None
+    max_in_flight: Optional[int] = None #requests of this block running at the same time, in all the conversations
+
+    _requests: dict = PrivateAttr(default_factory=dict)
+    _success_block_name: Optional[str] = PrivateAttr(default=None)
+    # created once per prototype and shared by its copies, so it counts every conversation
+    _in_flight: Optional[threading.BoundedSemaphore] = PrivateAttr(default=None)
+
+    def __init__(self, **data):
+        super().__init__(**data)
+
+        if self.policy not in POLICIES:
+            raise ValueError(f"{self.policy} is not a valid policy. Use one of {POLICIES}")
+        if self.policy == "quorum" and not self.quorum:
+            raise ValueError("The quorum policy needs a 'quorum' value")
+        if self.policy == "quorum" and not 1 <= self.quorum <= len(self.requests):
+            raise ValueError(f"The quorum must be between 1 and the number of requests ({len(self.requests)}), got {self.quorum}")
+        if self.max_in_flight is not None and self.max_in_flight < len(self.requests):
+            raise ValueError(f"max_in_flight must be at least the number of requests ({len(self.requests)})")
+
+        self._success_block_name = self.next_block_name
+
+        # each request is compiled once as an http block
+        self._requests = {
+            name: HTTPBlock(
+                name_in_flow=f"{self.name_in_flow}.{name}",
+                next_block_name=self.next_block_name,
+                **definition,
+            )
+            for name, definition in self.requests.items()
+        }
+        self._in_flight = threading.BoundedSemaphore(
+            self.max_in_flight or max(DEFAULT_MAX_IN_FLIGHT, len(self._requests))
+        )
+
+    def run_block(self, event=None):
+        """Send the requests in worker threads and wait for them"""
+
+        from concurrent.futures import FIRST_COMPLETED, wait
+
+        if self.status != BlockStatus.ready:
+            return None
+
+        results = dict.fromkeys(self._requests)
+        futures = {}
+        for name, future in self._submit(results):
+            futures[future] = name
+
+        deadline = self._deadline()
+        pending = set(futures)
+        while pending and not self._is_decided(results):
+            done, pending = wait(pending, timeout=self._remaining(deadline), return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                results[futures[future]] = future.result()
+
+        for future in pending:
+            future.cancel()
+        return self.set_results(results)
+
+    async def arun_block(self, event=None):
+        """Send the requests concurrently without blocking the event loop"""
+
+        import asyncio
+
+        if self.status != BlockStatus.ready:
+            return None
+
+        results = dict.fromkeys(self._requests)
+        tasks = {}
+        for name, future in self._submit(results):
+            tasks[asyncio.wrap_future(future)] = name
+
+        deadline = self._deadline()
+        pending = set(tasks)
+        while pending and not self._is_decided(results):
+            done, pending = await asyncio.wait(pending, timeout=self._remaining(deadline), return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                break
+            for task in done:
+                results[tasks[task]] = task.result()
+
+        for task in pending:
+            task.cancel()
+        return self.set_results(results)
+
+    def _submit(self, results: dict):
+        """
+        Submit the requests to the shared pool and yield (name, future). The requests over
+        max_in_flight aren't sent: their result is the error
+        """
+
+        executor = get_executor()
+        in_flight = self._in_flight
+        for name, request in self._requests.items():
+            if not in_flight.acquire(blocking=False):
+                results[name] = RuntimeError(f"block {self.name_in_flow}: too many requests in flight")
+                continue
+            arguments = request.build_request(self.variables)
+            if self.timeout is not None:
+                # a request the block stopped waiting for doesn't hold a worker much longer
+                arguments["timeout"] = min(arguments["timeout"] or self.timeout, self.timeout)
+            try:
+                future = executor.submit(request.send_request, arguments)
+            except BaseException:
+                in_flight.release()
+                raise
+            future.add_done_callback(lambda _, release=in_flight.release: release())
+            yield name, future
+
+    def _deadline(self) -> Optional[float]:
+        return time.monotonic() + self.timeout if self.timeout is not None else None
+
+    def _remaining(self, deadline: Optional[float]) -> Optional[float]:
+        return max(deadline - time.monotonic(), 0) if deadline is not None else None
+
+    def _needed(self) -> int:
+        """Number of successful requests needed by the policy"""
+        if self.policy == "all":
+            return len(self._requests)
+        if self.policy == "any":
+            return min(1, len(self._requests))
+        return self.quorum
+
+    def _is_decided(self, results: dict) -> bool:
+        """Whether the policy is already met, or can't be met anymore"""
+
+        succeeded = sum(1 for value in results.values() if _is_success(value))
+        failed = sum(1 for value in results.values() if isinstance(value, Exception))
+        needed = self._needed()
+        return succeeded >= needed or len(results) - failed < needed
+
+    def set_results(self, results: dict):
+        """Store the responses and choose the next block according to the policy"""
+
+        succeeded = sum(1 for value in results.values() if _is_success(value))
+        self.outbound = results
+        self.run_next_block = True
+
+        if succeeded >= self._needed() or self.on_error is None:
+            if succeeded < self._needed():
+                logging.warning(f"block {self.name_in_flow}: policy {self.policy} not met. Continuing")
+            self.status = BlockStatus.success
+            self.next_block_name = self._success_block_name
+        else:
+            logging.warning(f"block {self.name_in_flow}: policy {self.policy} not met. Going to {self.on_error}")
+            self.status = BlockStatus.failed
+            self.next_block_name = self.on_error
+
+        return {
+            "next_block_name": self.next_block_name,
+            "run_next_block": self.run_next_block,
+        }
+
+
+def _is_success(value) -> bool:
+    return value is not None and not isinstance(value, Exception)
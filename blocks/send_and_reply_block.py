@@ -12,37 +12,64 @@ from schemas import BlockStatus, Message, MessageChannels
 class SendReplyBlock(BaseMessageBlock):
     """A block that sends a message and waits for a reply"""
 
-    message: Optional[Message] = None
-
-    def __init__(self, **data):
-        super().__init__(**data)
-        self.message = Message(
-            to=self.to,
-            from_=self.from_,
-            content=self.sending_content,
-        )
-        
+    reply_timeout: Optional[float] = None # seconds to wait for the reply. None waits forever
+    on_timeout: Optional[str] = None # block that runs when the reply doesn't arrive in time
 
     def run_block(self, event=None):
         """Send the message and update the status of the block"""
 
-        logging.debug(f"received event inside send_reply_block: {event}")
-        self.message.content = self.sending_content
+        message = self.prepare_message(event)
 
-        if isinstance(event, Message):
-            self.message = event
+        streamed_content = self.pop_streamed_content()
+        if streamed_content is not None:
+            # the answer was already sent in chunks by a streamed http block
+            message.content = streamed_content
+        else:
+            # if self.status == BlockStatus.ready:
+            channel = get_channel(self.messaging_channel)
+            channel.send_message(message)
+
+        return self.message_sent(message)
+
+        # else:
+        #     logging.info(
+        #         "This block has already started or been executed. Not running again."
+        #     )
+
+    async def arun_block(self, event=None):
+        """Send the message without blocking the event loop"""
+
+        message = self.prepare_message(event)
+
+        streamed_content = self.pop_streamed_content()
+        if streamed_content is not None:
+            message.content = streamed_content
+        else:
+            await self.asend(message)
+
+        return self.message_sent(message)
+
+    def prepare_message(self, event=None) -> Message:
+        """Build the message to be sent"""
 
-        if self.message is None:
-            raise MissingFieldException("message")
+        logging.debug("received event inside send_reply_block: %s", event)
 
         if self.messaging_channel is None:
             raise MissingFieldException("messaging_channel")
 
-        # if self.status == BlockStatus.ready:
-        channel = get_channel(self.messaging_channel)
-        channel.send_message(self.message)
+        if isinstance(event, Message):
+            return event
 
-        self.outbound = self.message.content
+        return Message(
+            to=self.to,
+            from_=self.from_,
+            content=self.sending_content,
+        )
+
+    def message_sent(self, message: Message):
+        """Update the status of the block after the message was sent. The block waits for a reply"""
+
+        self.outbound = message.content
         self.status = BlockStatus.running
 
         return {
@@ -50,21 +77,13 @@ class SendReplyBlock(BaseMessageBlock):
             "run_next_block": False,
         }
 
-        # else:
-        #     logging.info(
-        #         "This block has already started or been executed. Not running again."
-        #     )
-
     def continue_block(self, event=None):
         """Continue to the next block"""
 
-        if event is not None:
-            #print(f"getting user response")
-            self.message.content = str(event)
-
         if self.status == BlockStatus.running:
             self.status = BlockStatus.success
-            self.inbound = self.message.content
+            # without an event the block keeps the content it sent, like before
+            self.inbound = str(event) if event is not None else self.outbound
             self.run_next_block = True
 
             return {
@@ -77,6 +96,21 @@ class SendReplyBlock(BaseMessageBlock):
                 "This block has not been executed yet. Run the block before continuing."
             )
 
+    def timeout_block(self):
+        """
+        Stop waiting for the reply. The flow goes to the on_timeout block,
+        or expires if the block doesn't have one. next_block_name is kept: the
+        block may be asked again and its reply goes where it always did
+        """
+
+        self.status = BlockStatus.failed
+        self.run_next_block = self.on_timeout is not None
+
+        return {
+            "next_block_name": self.on_timeout,
+            "run_next_block": self.run_next_block,
+        }
+
     def reset_block(self):
         """Reset the block to its initial state"""
         self.status = BlockStatus.ready
@@ -95,5 +129,4 @@ if __name__ == "__main__":
         next_block="segundo_bloco",
     )
     block.run_block()
-    block.message.content = "essa seria a resposta teste do usuário"
-    block.continue_block()
+    block.continue_block("essa seria a resposta teste do usuário")
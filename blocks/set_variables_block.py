@@ -1,10 +1,13 @@
-import ast
 import logging
 
-from typing import Any, Dict
+from typing import Any, Dict, Optional
+
+from pydantic import Field, PrivateAttr
 
 from blocks.basicBlock import BasicBlock
+from expressions import Expression
 from schemas import BlockStatus
+from templates import compile_reference_template
 
 """
 The SetVariablesBlock is a block that sets variables to be used in the flow.
@@ -19,9 +22,24 @@ You can also use the inbound/outbound values of other blocks by using the follow
 
 To break down the value from another block into a dictionary, you can use the following syntax:
 The outbound value will be converted to a dictionary, and the subvalue will be extracted from it.
+Paths can have any depth, index lists and have a default value for when the path doesn't exist:
+"variables": {
+                "x": "{{block_name.outbound.subvalue}}",
+                "answer": "{{llm_call.outbound.choices[0].message.content}}",
+                "city": "{{cep_lookup.outbound.localidade|unknown}}",
+                "greeting": "Hello {{ask_name.inbound}}!"
+            }
+
+Values written as "{{= expr }}" are expressions (see expressions.py). Their names are
+the variables set before in the same block, then the flow variables, then the blocks
+that already ran:
 "variables": {
-                "x": "{{block_name.outbound.subvalue}}"
+                "total": "{{= price * quantity }}",
+                "tier": "{{= 'premium' if total > 1000 else 'standard' }}",
+                "answer": "{{= lower(strip(ask.inbound)) }}"
             }
+
+The references and expressions are compiled once, when the block is created (see templates.py).
 """
 
 
@@ -30,19 +48,25 @@ class SetVariablesBlock(BasicBlock):
     
     original_variables: dict = {}
     variables: dict = {}
-    blocks: list = []
+    blocks: dict = Field(default={}, exclude=True) # name -> block (or its state), for the blocks that already ran successfully
+
+    _templates: dict = PrivateAttr(default_factory=dict)
 
     def __init__(self, **data: Any) -> None:
         super().__init__(**data)
         self.original_variables = self.variables.copy()
+        self._templates = {
+            key: compile_reference_template(value)
+            for key, value in self.original_variables.items()
+        }
 
     def run_block(self, data: Dict[str, Any]) -> Dict[str, Any]:
 
-        self.variables = self.update_dinamic_values()
+        self.variables = self.update_dinamic_values(data)
 
         if self.variables is not None:
             for field, value in self.variables.items():
-                logging.debug(f"Setting variable {field} to {value}")
+                logging.debug("Setting variable %s to %s", field, value)
                 data[field] = value
 
         self.status = BlockStatus.success
@@ -55,58 +79,52 @@ class SetVariablesBlock(BasicBlock):
     
     def get_block_value(self, block_name, boundarie_type: str):
         """Get the value of a variable in a block. boundarie_type needs to be 'inbound' or 'outbound'"""
-        for block in self.blocks:
-            logging.debug(f"block name: {block.name_in_flow}")
-            if block.name_in_flow == block_name:
-                logging.debug(f"block found: {block.name_in_flow}")
-                atribute_value = getattr(block, boundarie_type)
-                if atribute_value:
-                    return atribute_value
-                else:
-                    logging.debug(f"block {block_name} has no {boundarie_type} value")
-                    return ""
-            
-        return None
+        block = self.blocks.get(block_name)
+        if block is None:
+            return None
+
+        logging.debug("block found: %s", block_name)
+        atribute_value = getattr(block, boundarie_type)
+        if atribute_value:
+            return atribute_value
+        else:
+            logging.debug("block %s has no %s value", block_name, boundarie_type)
+            return ""
     
-    def get_query_info(self, variable_str: str):
+    def update_dinamic_values(self, flow_variables: Optional[dict] = None):
         """
-        Gets the block_name and value to be extracted based on a formatted string
-        INPUTS:
-            variable_str: a string formatted as '{{block_name.value}}'
-
-        OUTPUTS:
-            block_name: the name of the block
-            value: the value to be extracted from the block
+        Renders all values inside self.variables that reference other blocks, like '{{block_name.value}}',
+        and evaluates the expressions
         """
+        variables = {}
+        scope = None
+        for key, template in self._templates.items():
+            if isinstance(template, Expression):
+                if scope is None:
+                    scope = _ExpressionScope(variables, flow_variables or {}, self.blocks)
+                variables[key] = template.evaluate(scope)
+            else:
+                variables[key] = template.render(self.get_block_value)
+        self.variables = variables
+        return self.variables
 
-        text_inside = variable_str.split("{{")[-1].split("}}")[0]
 
-        if len(text_inside.split(".")) == 2:
-            block_name, value = text_inside.split(".")
-            dict_key = None
-        elif len(text_inside.split(".")) == 3:
-            block_name, value, dict_key = text_inside.split(".")
+class _ExpressionScope:
+    """The names of the expressions: the values already set by the block, the flow variables and the blocks"""
 
-        return block_name, value, dict_key
+    __slots__ = ("values", "flow_variables", "blocks")
 
-    
-    def update_dinamic_values(self):
-        """
-        Updates all values inside self.variables that are formatted as '{{block_name.value}}'
-        """
-        self.variables = self.original_variables.copy()
-        if self.variables is not None:
-            for key, value in self.variables.items():
-                value = str(value)
-                if '{{' in value and '}}' in value:
-                    logging.debug(f"updating value: {value}")
-                    block_name, boundarie_type, dict_value = self.get_query_info(value)
-                    self.variables[key] = self.get_block_value(block_name, boundarie_type)
-                    if dict_value:
-                        logging.debug(f"retrieving value from dictionary: {dict_value}")
-                        self.variables[key] = self.variables[key][dict_value]
+    def __init__(self, values: dict, flow_variables: dict, blocks):
+        self.values = values
+        self.flow_variables = flow_variables
+        self.blocks = blocks
 
-        return self.variables
+    def get(self, name):
+        if name in self.values:
+            return self.values[name]
+        if name in self.flow_variables:
+            return self.flow_variables[name]
+        return self.blocks.get(name)
     
 
 if __name__ == "__main__":
@@ -12,29 +12,54 @@ from schemas import BlockStatus, Message, MessageChannels
 class SingleMessageBlock(BaseMessageBlock):
     """A block that sends a single message to the recipient. It does not wait for a response."""
 
-    message: Optional[Message] = None
-
-    def __init__(self, **data):
-        super().__init__(**data)
-
-        
     def run_block(self, event=None):
         """Send the message and update the status of the block"""
 
+        message = self.prepare_message()
+
+        streamed_content = self.pop_streamed_content()
+        if streamed_content is not None:
+            # the answer was already sent in chunks by a streamed http block
+            message.content = streamed_content
+        else:
+            # if self.status == BlockStatus.ready:
+            channel = get_channel(self.messaging_channel)
+            channel.send_message(message)
+
+        return self.message_sent(message)
+
+        # else:
+        #     logging.info("This block has already been executed. Not running again.")
+
+    async def arun_block(self, event=None):
+        """Send the message without blocking the event loop"""
+
+        message = self.prepare_message()
+
+        streamed_content = self.pop_streamed_content()
+        if streamed_content is not None:
+            message.content = streamed_content
+        else:
+            await self.asend(message)
+
+        return self.message_sent(message)
+
+    def prepare_message(self) -> Message:
+        """Build the message to be sent"""
+
         if self.messaging_channel is None:
             raise MissingFieldException("messaging_channel")
 
-        # if self.status == BlockStatus.ready:
-
-        self.message = Message(
+        return Message(
             to=self.to,
             from_=self.from_,
             content=self.sending_content,
         )
 
-        channel = get_channel(self.messaging_channel)
-        channel.send_message(self.message)
-        self.outbound = self.message.content
+    def message_sent(self, message: Message):
+        """Update the status of the block after the message was sent"""
+
+        self.outbound = message.content
         self.status = BlockStatus.success
         self.run_next_block = True
 
@@ -43,9 +68,6 @@ class SingleMessageBlock(BaseMessageBlock):
             "run_next_block": self.run_next_block,
         }
 
-        # else:
-        #     logging.info("This block has already been executed. Not running again.")
-
     def continue_block(self, event=None):
         """Continue to the next block"""
         logging.info("This block has no method continue_block()")
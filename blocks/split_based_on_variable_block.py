@@ -1,9 +1,11 @@
 import logging
+import re
 from typing import Any, Optional
 
-from pydantic import Field
+from pydantic import Field, PrivateAttr
 
 from blocks.basicBlock import BasicBlock
+from expressions import compile_expression
 from schemas import BlockStatus
 
 """
@@ -19,34 +21,112 @@ You can set the variable to be used in the flow just by declaring
     }
 }
 The branches are the possible values of the variable and the block that will be executed if the condition is met.
+If the variable doesn't exist, the flow goes to the on_error branch.
+
+The "match_mode" field changes how the branch keys are compared with the variable:
+- exact (default): the variable, as a string, is equal to the key
+- normalized: same as exact, ignoring case and extra whitespace ("  Sales " matches "sales")
+- regex: the key is a regular expression searched in the variable ("^(yes|sim)$")
+- range: the key is a numeric range "min..max", min included and max excluded.
+  Either side can be left open: "..18", "18..65", "65.."
+- expression: the key is a condition over the flow variables (see expressions.py), and
+  "variable" isn't needed. The first true condition, in the order of the file, wins:
+    "branches": {
+        "score > 0.8 and intent == 'sales'": "hot_lead",
+        "len(order.items) >= 3 or customer.vip": "priority",
+        "lower(answer) in ['no', 'nao']": "goodbye",
+        "default": "menu"
+    }
+  An invalid condition fails when the flow is loaded; an error while evaluating one
+  follows the on_error branch.
+
+The branches are compiled into a dict index when the block is created, so exact and
+normalized matches take the same time for any number of branches. In regex and range
+modes an exact key match is still tried first. Expressions are compiled into closures
+once too, so a branch costs one call per message.
 """
 
+MATCH_MODES = ("exact", "normalized", "regex", "range", "expression")
+SPECIAL_BRANCHES = ("default", "on_error")
+
+
+def normalize(value: str) -> str:
+    return " ".join(value.split()).casefold()
+
+
+def parse_range(key: str):
+    """Parse 'min..max' into (min, max). Open sides are None"""
+
+    low, separator, high = key.partition("..")
+    if not separator:
+        raise ValueError(f"Invalid range '{key}'. Expected 'min..max'")
+    return (
+        float(low) if low.strip() else None,
+        float(high) if high.strip() else None,
+    )
+
 
 class SplitVariableBlock(BasicBlock):
     """A block that splits the flow based on a variable"""
 
-    variable: str
+    variable: Optional[str] = None
     variables: dict = {}
     branches: dict
+    match_mode: str = "exact"
     next_block_name: Optional[str] = None
 
+    # branch index compiled once: exact (or normalized) key -> block, and the regex/range branches
+    _index: dict = PrivateAttr(default_factory=dict)
+    _patterns: list = PrivateAttr(default_factory=list)
+    _ranges: list = PrivateAttr(default_factory=list)
+    _conditions: list = PrivateAttr(default_factory=list)
+
+    def __init__(self, **data):
+        super().__init__(**data)
+
+        if self.match_mode not in MATCH_MODES:
+            raise ValueError(f"{self.match_mode} is not a valid match_mode. Use one of {MATCH_MODES}")
+
+        if self.match_mode == "expression":
+            self._conditions = [
+                (compile_expression(str(condition)), block_name)
+                for condition, block_name in self.branches.items()
+                if condition not in SPECIAL_BRANCHES
+            ]
+            return
+        if self.variable is None:
+            raise ValueError(f"The '{self.match_mode}' match_mode needs a variable")
+
+        for condition, block_name in self.branches.items():
+            if condition in SPECIAL_BRANCHES:
+                continue
+
+            key = str(condition)
+            if self.match_mode == "normalized":
+                key = normalize(key)
+            self._index.setdefault(key, block_name)
+
+            if self.match_mode == "regex":
+                self._patterns.append((re.compile(condition), block_name))
+            elif self.match_mode == "range":
+                low, high = parse_range(key)
+                self._ranges.append((low, high, block_name))
 
     def run_block(self, event):
         """
         Run the block
         """
-        logging.debug(f"running split block with variable {self.variable}")
-        logging.debug(f"variables: {self.variables}")
-        logging.debug(f"variable value: {self.variables[self.variable]}")
+        logging.debug("running split block with variable %s", self.variable)
         try:
-            for condition in self.branches.keys():
-                logging.debug(f"checking for condition {condition}")
-                if str(self.variables[self.variable]) == str(condition):
-                    logging.debug(f"Condition {condition} met for variable {self.variable}")
-                    self.next_block_name = self.branches[condition]
-                    break
+            if self.match_mode == "expression":
+                self.next_block_name = self.match_condition(self.variables)
+            else:
+                value = self.variables[self.variable]
+                logging.debug("variable value: %s", value)
+                self.next_block_name = self.match_branch(value)
+
             if self.next_block_name is None:
-                logging.debug(f"No condition met. Running none_met branch")
+                logging.debug("No condition met. Running none_met branch")
                 self.next_block_name = self.branches.get('default', None)
 
             self.status = BlockStatus.success
@@ -64,4 +144,44 @@ class SplitVariableBlock(BasicBlock):
         return {
             "next_block_name": self.next_block_name,
             "run_next_block": True
-        }
\ No newline at end of file
+        }
+
+    def match_condition(self, variables: dict) -> Optional[str]:
+        """Return the block of the first condition that is true for the variables, or None"""
+
+        for condition, block_name in self._conditions:
+            if condition.evaluate(variables):
+                logging.debug("Condition %s met", condition.source)
+                return block_name
+        return None
+
+    def match_branch(self, value: Any) -> Optional[str]:
+        """Return the block of the branch that matches the value, or None"""
+
+        key = str(value)
+        if self.match_mode == "normalized":
+            key = normalize(key)
+
+        block_name = self._index.get(key)
+        if block_name is not None:
+            logging.debug("Condition %s met for variable %s", key, self.variable)
+            return block_name
+
+        if self._patterns:
+            text = str(value)
+            for pattern, block_name in self._patterns:
+                if pattern.search(text):
+                    logging.debug("Pattern %s met for variable %s", pattern.pattern, self.variable)
+                    return block_name
+
+        if self._ranges:
+            try:
+                number = float(value)
+            except (TypeError, ValueError):
+                return None
+            for low, high, block_name in self._ranges:
+                if (low is None or number >= low) and (high is None or number < high):
+                    logging.debug("Range %s..%s met for variable %s", low, high, self.variable)
+                    return block_name
+
+        return None
@@ -0,0 +1,279 @@
+import asyncio
+import csv
+import json
+import logging
+import time
+from typing import Callable, Iterable, Iterator, Optional, Union
+
+from schemas import BlockStatus, MessageChannels
+
+"""
+Outbound campaigns: start the same flow for a large list of recipients.
+
+The recipients are read lazily from an iterable, a CSV or a JSONL file, and go through
+a bounded pipeline of `concurrency` workers running arun_flow, so the memory use stays
+the same for a thousand or ten million recipients. Every conversation shares the
+compiled flow template and the channel, and the first messages are sent in batches by
+the outbound dispatcher (one is created for the campaign when none is set).
+
+    campaign = Campaign(
+        flow_file="promo_flow.json",
+        from_="whatsapp:+5511999990000",
+        channel=MessageChannels.twilio,
+        store=SQLiteStateStore("conversations.sqlite3"),   # where the replies continue
+        rate_limit=80,
+    )
+    report = campaign.run("recipients.csv")
+    print(report)
+
+Recipients:
+- CSV: a "to" column with the recipient address. The other columns are the initial
+  flow variables of the recipient.
+- JSONL: one object per line, {"to": "...", "variables": {...}}. Without "variables",
+  the other keys are the variables.
+- an iterable of dicts in one of the formats above, or of plain addresses.
+Invalid records (without "to", or a line that isn't json) are counted as failed in the
+report and skipped, the campaign goes on with the next ones.
+
+With a store, every conversation is saved after its first run, so the inbound router
+(or store.load_for_message) continues it when the recipient answers.
+"""
+
+DEFAULT_CONCURRENCY = 200
+DEFAULT_PROGRESS_EVERY = 1000
+MAX_ERRORS = 100
+
+
+class Recipient:
+    """A campaign recipient and the initial variables of its conversation"""
+
+    __slots__ = ("to", "variables")
+
+    def __init__(self, to: str, variables: Optional[dict] = None):
+        self.to = to
+        self.variables = variables or {}
+
+    @classmethod
+    def from_record(cls, record: Union[str, dict, "Recipient"]) -> "Recipient":
+        if isinstance(record, Recipient):
+            return record
+        if isinstance(record, str):
+            return cls(record)
+
+        record = dict(record)
+        to = record.pop("to", None)
+        if not to:
+            raise ValueError(f"Recipient without 'to': {record}")
+        variables = record.pop("variables", None)
+        return cls(to, variables if variables is not None else record)
+
+
+def read_recipients(
+    source: Union[str, Iterable],
+    on_error: Optional[Callable[[int, Exception], None]] = None,
+) -> Iterator[Recipient]:
+    """
+    Read the recipients one by one. `source` is the path of a .csv or .jsonl file, or an
+    iterable of records. An invalid record raises, or with on_error(position, error) (the
+    position of the record in the source, from 1) it's skipped
+    """
+
+    for position, record in enumerate(_read_records(source), start=1):
+        try:
+            yield Recipient.from_record(json.loads(record) if isinstance(record, _JsonLine) else record)
+        except (ValueError, TypeError) as e:
+            if on_error is None:
+                raise
+            on_error(position, e)
+
+
+class _JsonLine(str):
+    """A line of a jsonl file, decoded with the other record errors"""
+
+
+def _read_records(source: Union[str, Iterable]) -> Iterator:
+    if not isinstance(source, str):
+        yield from source
+        return
+
+    with open(source, newline="", encoding="utf-8") as file:
+        if source.endswith(".csv"):
+            yield from csv.DictReader(file)
+        elif source.endswith((".jsonl", ".ndjson")):
+            for line in file:
+                if line.strip():
+                    yield _JsonLine(line)
+        else:
+            raise ValueError(f"Unknown recipients file format: {source}. Use .csv or .jsonl")
+
+
+class CampaignReport:
+    """Progress of a campaign. Only counters are kept, never the conversations"""
+
+    def __init__(self):
+        self.started_at = time.monotonic()
+        self.finished_at: Optional[float] = None
+        self.recipients = 0     # read from the source
+        self.started = 0        # conversations that ran their first blocks
+        self.waiting = 0        # ... and are waiting for the recipient answer
+        self.finished = 0       # ... and already finished
+        self.failed = 0         # conversations that raised an error, and invalid records
+        self.errors = []        # (recipient, error) of the first MAX_ERRORS failures
+
+    @property
+    def elapsed(self) -> float:
+        end = self.finished_at if self.finished_at is not None else time.monotonic()
+        return end - self.started_at
+
+    @property
+    def throughput(self) -> float:
+        """Conversations started per second"""
+        elapsed = self.elapsed
+        return (self.started + self.failed) / elapsed if elapsed > 0 else 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "recipients": self.recipients,
+            "started": self.started,
+            "waiting": self.waiting,
+            "finished": self.finished,
+            "failed": self.failed,
+            "elapsed": round(self.elapsed, 3),
+            "throughput": round(self.throughput, 1),
+        }
+
+    def __str__(self):
+        return (
+            f"{self.started} conversations started ({self.waiting} waiting, {self.finished} finished), "
+            f"{self.failed} failed in {self.elapsed:.1f}s ({self.throughput:.0f}/s)"
+        )
+
+
+class Campaign:
+    """Starts a flow for every recipient of a list, with bounded concurrency"""
+
+    def __init__(
+        self,
+        flow_file: str,
+        from_: str,
+        channel: MessageChannels = MessageChannels.twilio,
+        flow_name: Optional[str] = None,
+        store=None,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        rate_limit: Optional[float] = None,
+        on_progress: Optional[Callable[[CampaignReport], None]] = None,
+        progress_every: int = DEFAULT_PROGRESS_EVERY,
+    ):
+        """
+        store: a FlowStateStore where the conversations are saved after their first run.
+        rate_limit: messages per second of the channel, used when the campaign creates
+            its own outbound dispatcher.
+        on_progress(report): called every `progress_every` recipients and at the end.
+        """
+        self.flow_file = flow_file
+        self.flow_name = flow_name or flow_file
+        self.from_ = from_
+        self.channel = channel
+        self.store = store
+        self.concurrency = concurrency
+        self.rate_limit = rate_limit
+        self.on_progress = on_progress
+        self.progress_every = progress_every
+
+    def run(self, recipients: Union[str, Iterable]) -> CampaignReport:
+        """Run the campaign in a new event loop"""
+        return asyncio.run(self.arun(recipients))
+
+    async def arun(self, recipients: Union[str, Iterable]) -> CampaignReport:
+        """Run the campaign inside the running event loop. Returns when every message was sent"""
+
+        from dispatcher import OutboundDispatcher, get_dispatcher, set_dispatcher
+        from flow_registry import registry
+
+        # compile (and validate) the flow before reading the recipients
+        registry.get(self.flow_file)
+
+        report = CampaignReport()
+        own_dispatcher = get_dispatcher() is None
+        if own_dispatcher:
+            rate_limits = {self.channel: self.rate_limit} if self.rate_limit else None
+            set_dispatcher(OutboundDispatcher(rate_limits=rate_limits, max_queue=self.concurrency * 2))
+        dispatcher = get_dispatcher()
+
+        def invalid_record(position: int, error: Exception):
+            report.recipients += 1
+            self._failed(report, f"record {position}", error)
+
+        queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        workers = [asyncio.create_task(self._worker(queue, report)) for _ in range(self.concurrency)]
+        try:
+            for recipient in read_recipients(recipients, on_error=invalid_record):
+                await queue.put(recipient)
+                report.recipients += 1
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            for worker in workers:
+                worker.cancel()
+            if own_dispatcher:
+                await dispatcher.stop()
+                set_dispatcher(None)
+
+        report.finished_at = time.monotonic()
+        self._progress(report)
+        return report
+
+    async def _worker(self, queue: asyncio.Queue, report: CampaignReport):
+        while True:
+            recipient = await queue.get()
+            if recipient is None:
+                return
+            try:
+                await self._start(recipient, report)
+            except Exception as e:
+                self._failed(report, recipient.to, e)
+            else:
+                self._count_progress(report)
+
+    def _failed(self, report: CampaignReport, recipient: str, error: Exception):
+        report.failed += 1
+        if len(report.errors) < MAX_ERRORS:
+            report.errors.append((recipient, str(error)))
+        logging.error(f"Error starting the campaign flow for {recipient}: {error}")
+        self._count_progress(report)
+
+    def _count_progress(self, report: CampaignReport):
+        done = report.started + report.failed
+        if self.on_progress is not None and done % self.progress_every == 0:
+            self._progress(report)
+
+    async def _start(self, recipient: Recipient, report: CampaignReport):
+        from flows import BasicFlow
+
+        flow = BasicFlow(
+            flow_file=self.flow_file,
+            flow_name=self.flow_name,
+            curr_channel=self.channel,
+            from_=self.from_,
+            to=recipient.to,
+            variables=dict(recipient.variables),
+        )
+        if self.store is not None:
+            await self.store.arun_flow(flow)
+        else:
+            await flow.arun_flow()
+
+        report.started += 1
+        if flow.flow_status in (BlockStatus.success, BlockStatus.failed):
+            report.finished += 1
+        else:
+            report.waiting += 1
+
+    def _progress(self, report: CampaignReport):
+        if self.on_progress is None:
+            return
+        try:
+            self.on_progress(report)
+        except Exception as e:
+            logging.error(f"Error reporting the campaign progress: {e}")
@@ -0,0 +1,270 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional
+
+from message_channels.channels_factory import get_channel
+from schemas import DeliveryResult, Message, MessageChannels
+
+"""
+The outbound dispatcher sits between the message blocks and the message channels.
+
+Messages are queued per channel and sent concurrently by a consumer task, respecting
+a token-bucket rate limit for each channel. Channels that implement asend_batch
+receive the queued messages in batches. The result of every delivery is reported
+through a callback and an asyncio.Future, so the flow doesn't wait for the provider.
+
+The messages of a recipient are delivered one at a time, in the order they were queued:
+a message waits while the previous one to the same recipient is in flight, so the
+conversation never arrives reordered. Only different recipients are sent concurrently.
+
+    dispatcher = OutboundDispatcher(rate_limits={MessageChannels.twilio: 80})
+    set_dispatcher(dispatcher)
+    await asyncio.gather(*[flow.arun_flow() for flow in flows])
+    await dispatcher.stop()
+
+While a dispatcher is set, message blocks running through arun_flow queue their
+messages on it instead of sending them directly.
+"""
+
+DEFAULT_CONCURRENCY = 10
+DEFAULT_BATCH_SIZE = 50
+DEFAULT_BATCH_WAIT = 0.05
+DEFAULT_MAX_QUEUE = 10000
+
+
+class TokenBucket:
+    """Allows `rate` operations per second, with bursts of up to `capacity` operations"""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+
+    async def acquire(self, tokens: float = 1):
+        """Wait until there are enough tokens and take them"""
+
+        while True:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return
+
+            await asyncio.sleep((tokens - self._tokens) / self.rate)
+
+
+class _Outbound:
+    """A queued message waiting to be delivered"""
+
+    __slots__ = ("message", "future", "on_result")
+
+    def __init__(self, message: Message, future: asyncio.Future, on_result: Optional[Callable]):
+        self.message = message
+        self.future = future
+        self.on_result = on_result
+
+
+class OutboundDispatcher:
+    """Queues outbound messages and sends them concurrently, rate limited per channel"""
+
+    def __init__(
+        self,
+        rate_limits: Optional[Dict[MessageChannels, float]] = None,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        batch_wait: float = DEFAULT_BATCH_WAIT,
+        max_queue: int = DEFAULT_MAX_QUEUE,
+    ):
+        self.rate_limits = rate_limits or {}
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.max_queue = max_queue
+
+        self._queues: Dict[MessageChannels, asyncio.Queue] = {}
+        self._consumers: Dict[MessageChannels, asyncio.Task] = {}
+        self._in_flight: set = set()
+        # (channel, recipient) of the messages in flight -> the messages queued behind them
+        self._recipients: Dict[tuple, deque] = {}
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.sent = 0
+        self.failed = 0
+
+    async def submit(
+        self,
+        channel: MessageChannels,
+        message: Message,
+        on_result: Optional[Callable[[DeliveryResult], None]] = None,
+    ) -> asyncio.Future:
+        """
+        Queue a message. Waits only while the channel queue is full.
+        Returns a future that resolves to the DeliveryResult.
+        """
+
+        future = asyncio.get_running_loop().create_future()
+        await self._get_queue(channel).put(_Outbound(message, future, on_result))
+        return future
+
+    async def send(self, channel: MessageChannels, message: Message) -> DeliveryResult:
+        """Queue a message and wait for its delivery"""
+        return await (await self.submit(channel, message))
+
+    async def stop(self):
+        """Wait for every queued message to be delivered and stop the consumers"""
+
+        for queue in self._queues.values():
+            await queue.join()
+
+        if self._in_flight:
+            await asyncio.gather(*self._in_flight, return_exceptions=True)
+
+        for consumer in self._consumers.values():
+            consumer.cancel()
+        await asyncio.gather(*self._consumers.values(), return_exceptions=True)
+
+        self._queues.clear()
+        self._consumers.clear()
+
+    def stats(self) -> dict:
+        return {
+            "sent": self.sent,
+            "failed": self.failed,
+            "in_flight": len(self._in_flight),
+            "queued": {getattr(channel, "value", channel): queue.qsize() for channel, queue in self._queues.items()},
+        }
+
+    def _get_queue(self, channel: MessageChannels) -> asyncio.Queue:
+        queue = self._queues.get(channel)
+        if queue is None:
+            if self._semaphore is None:
+                self._semaphore = asyncio.Semaphore(self.concurrency)
+            queue = asyncio.Queue(maxsize=self.max_queue)
+            self._queues[channel] = queue
+            self._consumers[channel] = asyncio.create_task(self._consume(channel, queue))
+        return queue
+
+    async def _consume(self, channel_type: MessageChannels, queue: asyncio.Queue):
+        """Take the queued messages of a channel and start their delivery"""
+
+        loop = asyncio.get_running_loop()
+        channel = get_channel(channel_type)
+        rate = self.rate_limits.get(channel_type)
+        bucket = TokenBucket(rate) if rate else None
+        batch_size = self.batch_size if hasattr(channel, "asend_batch") else 1
+
+        while True:
+            batch = [await queue.get()]
+            deadline = loop.time() + self.batch_wait
+            while len(batch) < batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            if bucket is not None:
+                for _ in batch:
+                    await bucket.acquire()
+
+            batch = self._claim_recipients(channel_type, batch)
+            if not batch:
+                continue  # every message waits for a message in flight to its recipient
+
+            await self._semaphore.acquire()
+            task = asyncio.create_task(self._deliver(channel, channel_type, queue, batch))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+
+    def _claim_recipients(self, channel_type: MessageChannels, batch: List[_Outbound]) -> List[_Outbound]:
+        """The messages of the batch whose recipient is free. The others wait for their turn"""
+
+        ready = []
+        for outbound in batch:
+            key = (channel_type, outbound.message.to)
+            waiting = self._recipients.get(key)
+            if waiting is None:
+                self._recipients[key] = deque()
+                ready.append(outbound)
+            else:
+                waiting.append(outbound)
+        return ready
+
+    def _next_of_recipients(self, channel_type: MessageChannels, batch: List[_Outbound]) -> List[_Outbound]:
+        """The next waiting message of each recipient of the delivered batch"""
+
+        ready = []
+        for outbound in batch:
+            key = (channel_type, outbound.message.to)
+            waiting = self._recipients[key]
+            if waiting:
+                ready.append(waiting.popleft())
+            else:
+                del self._recipients[key]
+        return ready
+
+    async def _deliver(self, channel, channel_type: MessageChannels, queue: asyncio.Queue, batch: List[_Outbound]):
+        try:
+            # the messages that waited for these recipients go next, in the same slot
+            while batch:
+                try:
+                    await self._deliver_batch(channel, channel_type, batch)
+                finally:
+                    for _ in batch:
+                        queue.task_done()
+                batch = self._next_of_recipients(channel_type, batch)
+        finally:
+            self._semaphore.release()
+
+    async def _deliver_batch(self, channel, channel_type: MessageChannels, batch: List[_Outbound]):
+        messages = [outbound.message for outbound in batch]
+        try:
+            if len(batch) > 1:
+                responses = await channel.asend_batch(messages)
+            else:
+                responses = [await channel.asend_message(messages[0])]
+        except Exception as e:
+            responses = [e] * len(batch)
+
+        for outbound, response in zip(batch, responses):
+            error = response if isinstance(response, Exception) else None
+            result = DeliveryResult(
+                message=outbound.message,
+                channel=channel_type,
+                success=error is None,
+                error=str(error) if error is not None else None,
+            )
+            if error is None:
+                self.sent += 1
+            else:
+                self.failed += 1
+                logging.error(f"Error sending message to {outbound.message.to}: {error}")
+            self._report(outbound, result)
+
+    def _report(self, outbound: _Outbound, result: DeliveryResult):
+        if not outbound.future.done():
+            outbound.future.set_result(result)
+        if outbound.on_result is not None:
+            try:
+                outbound.on_result(result)
+            except Exception as e:
+                logging.error(f"Error reporting delivery result: {e}")
+
+
+_dispatcher: Optional[OutboundDispatcher] = None
+
+
+def set_dispatcher(dispatcher: Optional[OutboundDispatcher]):
+    """Make the message blocks send through the dispatcher. None sends directly again"""
+    global _dispatcher
+    _dispatcher = dispatcher
+
+
+def get_dispatcher() -> Optional[OutboundDispatcher]:
+    return _dispatcher
@@ -12,4 +12,12 @@ class MissingBlockException(Exception):
         self.block = block
 
     def __str__(self):
-        return f"Missing block: {self.block}"
\ No newline at end of file
+        return f"Missing block: {self.block}"
+
+class InvalidFlowException(Exception):
+    def __init__(self, flow_file, issues):
+        self.flow_file = flow_file
+        self.issues = issues
+
+    def __str__(self):
+        return f"Invalid flow {self.flow_file}:\n" + "\n".join(f"  {issue}" for issue in self.issues)
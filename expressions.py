@@ -0,0 +1,599 @@
+import functools
+import math
+import operator
+import re
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from templates import Reference, get_path
+
+"""
+A small, safe expression language for conditions and computed variables.
+
+    score > 0.8 and intent == 'sales'
+    len(order.items) >= 3 or customer.vip
+    lower(strip(answer)) in ['yes', 'sim', 'y']
+    price * quantity * (1 - discount)
+    'premium' if total > 1000 else 'standard'
+
+Expressions are parsed once, when the flow is compiled, into nested closures (a Pratt
+parser builds them directly, folding the constant parts). Nothing is passed to eval
+and only the functions registered in FUNCTIONS can be called, so the flow files can't
+run arbitrary code.
+
+Syntax:
+- literals: numbers, 'strings' or "strings", true/false/null, lists [1, 2]
+- names are flow variables (and, in set_variables, the blocks that already ran:
+  ask.inbound). a.b and a[0] read dicts, lists and json strings
+- or, and, not, ==, !=, <, <=, >, >=, in, not in, + - * / %, x if cond else y
+- function calls: len(x), lower(x), matches(x, '^[0-9]+$')... see FUNCTIONS.
+  register_function adds new ones.
+
+Names and keys that don't exist are null, and so is any member of null and any
+arithmetic with null, so a missing variable doesn't raise. The functions return null
+when an argument is null (len(null) is null), except bool, contains, matches and
+coalesce, and int() and float() of a text that isn't a number are null too.
+The user answers are text, so numeric strings are numbers when compared with a number
+or with another numeric string ("0.9" > 0.8 and '10' > '9' are true), in arithmetic
+(x + 1 with x = '3' is 4) and in abs, int, round, min and max. Only + between two
+strings joins them. <, <=, >, >= with null are false. x / 0 and x % 0 are null.
+str() writes true and false like the literals. Other type errors (like 'a' * 2.5) raise,
+and so does a constant part that fails when the expression is compiled (1 / 0).
+
+Where expressions are used:
+- split_variable blocks with "match_mode": "expression": each branch key is a condition,
+  the first true one (in the file order) is followed.
+- set_variables values written as "{{= expr }}": "total": "{{= price * quantity }}"
+"""
+
+_NOT_CONSTANT = object()
+
+KEYWORDS = {"and", "or", "not", "in", "if", "else"}
+CONSTANTS = {"true": True, "false": False, "null": None, "True": True, "False": False, "None": None}
+# attributes of the objects that aren't dicts (the blocks) that expressions can read
+BLOCK_ATTRIBUTES = {"inbound", "outbound", "status", "delivery_status"}
+# name.attribute pairs reported as block references to the flow linter
+REFERENCE_ATTRIBUTES = {"inbound", "outbound"}
+
+_TOKENS = re.compile(
+    r"""
+    \s*(?:
+        (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+      | (?P<string>'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")
+      | (?P<name>[A-Za-z_][A-Za-z0-9_]*)
+      | (?P<op>==|!=|<=|>=|[-+*/%<>()\[\],.])
+    )
+    """,
+    re.VERBOSE,
+)
+_ESCAPES = {"n": "\n", "t": "\t", "r": "\r", "\\": "\\", "'": "'", '"': '"'}
+_ESCAPE = re.compile(r"\\(.)")
+
+
+class ExpressionError(ValueError):
+    """An invalid expression"""
+
+    def __init__(self, message: str, expression: str, position: int):
+        self.message = message
+        self.expression = expression
+        self.position = position
+
+    def __str__(self):
+        return f"{self.message} at position {self.position} of '{self.expression}'"
+
+
+def _normalize(value) -> str:
+    return " ".join(str(value).split()).casefold()
+
+
+@functools.lru_cache(maxsize=256)
+def _pattern(pattern: str):
+    return re.compile(pattern)
+
+
+def _matches(value, pattern: str) -> bool:
+    return value is not None and _pattern(pattern).search(str(value)) is not None
+
+
+def _coalesce(*values):
+    return next((value for value in values if value is not None), None)
+
+
+def _number(value):
+    """The number in a numeric string ("12" -> 12, "0.5" -> 0.5), or the value itself"""
+
+    if not isinstance(value, str):
+        return value
+    try:
+        return int(value)
+    except ValueError:
+        pass
+    try:
+        number = float(value)
+    except ValueError:
+        return value
+    # "nan" and "inf" are words for the users, not numbers
+    return number if math.isfinite(number) else value
+
+
+def _numbers(values: tuple) -> list:
+    """The arguments of min and max, a single list or several values, as numbers"""
+
+    if len(values) == 1 and isinstance(values[0], (list, tuple)):
+        values = values[0]
+    return [_number(value) for value in values]
+
+
+def _text(value) -> str:
+    if type(value) is bool:
+        return "true" if value else "false"
+    return str(value)
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _null_safe(function: Callable) -> Callable:
+    """null if any argument is null, like the operators"""
+
+    def call(*arguments):
+        if None in arguments:
+            return None
+        return function(*arguments)
+    return call
+
+
+def _converter(convert: Callable) -> Callable:
+    def converted(value):
+        try:
+            return convert(value)
+        except (TypeError, ValueError):
+            return None
+    return converted
+
+
+FUNCTIONS: Dict[str, Callable] = {
+    "len": _null_safe(len),
+    "str": _null_safe(_text),
+    "int": _null_safe(_converter(lambda value: int(_number(value)))),
+    "float": _null_safe(_converter(float)),
+    "round": _null_safe(lambda value, *digits: round(_number(value), *map(_number, digits))),
+    "abs": _null_safe(lambda value: abs(_number(value))),
+    "min": _null_safe(lambda *values: min(_numbers(values))),
+    "max": _null_safe(lambda *values: max(_numbers(values))),
+    "lower": _null_safe(lambda value: str(value).lower()),
+    "upper": _null_safe(lambda value: str(value).upper()),
+    "strip": _null_safe(lambda value: str(value).strip()),
+    "normalize": _null_safe(_normalize),
+    "startswith": _null_safe(lambda value, prefix: str(value).startswith(prefix)),
+    "endswith": _null_safe(lambda value, suffix: str(value).endswith(suffix)),
+    # these take null on purpose
+    "bool": bool,
+    "contains": lambda value, part: value is not None and part in value,
+    "matches": _matches,
+    "coalesce": _coalesce,
+}
+
+
+def register_function(name: str, function: Callable, null_safe: bool = True):
+    """
+    Make a function callable from the expressions. With null_safe, it returns null without
+    being called when an argument is null. Compiled expressions keep the previous function
+    """
+    FUNCTIONS[name] = _null_safe(function) if null_safe else function
+
+
+def _coerce(left, right):
+    """Numeric strings become numbers when the other side is a number or a numeric string too"""
+
+    if isinstance(left, str):
+        if isinstance(right, str):
+            left_number, right_number = _number(left), _number(right)
+            if left_number is not left and right_number is not right:
+                return left_number, right_number
+            return left, right
+        if _is_number(right):
+            return _number(left), right
+    elif isinstance(right, str) and _is_number(left):
+        return left, _number(right)
+    return left, right
+
+
+def _equal(left, right) -> bool:
+    left, right = _coerce(left, right)
+    return left == right
+
+
+def _ordering(compare: Callable) -> Callable:
+    def ordered(left, right) -> bool:
+        if left is None or right is None:
+            return False
+        left, right = _coerce(left, right)
+        return compare(left, right)
+    return ordered
+
+
+def _contains(item, container) -> bool:
+    if container is None:
+        return False
+    if isinstance(container, str):
+        return str(item) in container
+    return item in container or any(_equal(item, element) for element in container)
+
+
+def _by_nonzero(operation: Callable) -> Callable:
+    """Division and modulo, null when dividing by zero"""
+
+    def divided(left, right):
+        if right == 0:
+            return None
+        return operation(left, right)
+    return divided
+
+
+def _negate(value):
+    return None if value is None else -_number(value)
+
+
+_COMPARISONS = {
+    "==": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+}
+
+# null if either side is null. Numeric strings are numbers, except for + between two
+# strings, which joins them
+_ARITHMETIC = {
+    "+": operator.add,
+    "-": operator.sub,
+    "*": operator.mul,
+    "/": _by_nonzero(operator.truediv),
+    "%": _by_nonzero(operator.mod),
+}
+
+_BINARY = {
+    "==": _equal,
+    "!=": lambda left, right: not _equal(left, right),
+    "<": _ordering(operator.lt),
+    "<=": _ordering(operator.le),
+    ">": _ordering(operator.gt),
+    ">=": _ordering(operator.ge),
+    "in": _contains,
+    "not in": lambda item, container: not _contains(item, container),
+}
+
+# binding power of the infix operators
+_PRECEDENCE = {
+    "if": 5,
+    "or": 10,
+    "and": 20,
+    "==": 40, "!=": 40, "<": 40, "<=": 40, ">": 40, ">=": 40, "in": 40, "not in": 40,
+    "+": 50, "-": 50,
+    "*": 60, "/": 60, "%": 60,
+    ".": 80, "[": 80,
+}
+_NOT_PRECEDENCE = 30
+_UNARY_PRECEDENCE = 70
+
+
+def _member(value, key):
+    """value.key or value[key]. Null when it doesn't exist"""
+
+    if value is None:
+        return None
+    if not isinstance(value, (dict, list, tuple, str)):
+        # a block (or its state)
+        return getattr(value, key, None) if key in BLOCK_ATTRIBUTES else None
+    try:
+        return get_path(value, (key,))
+    except (KeyError, IndexError, TypeError, ValueError, SyntaxError):
+        return None
+
+
+class _Node:
+    """A compiled part of an expression: the closure that evaluates it, and its value if it's constant"""
+
+    __slots__ = ("evaluate", "constant", "name")
+
+    def __init__(self, evaluate: Callable, constant=_NOT_CONSTANT, name: Optional[str] = None):
+        self.evaluate = evaluate
+        self.constant = constant
+        self.name = name  # the variable, when the node is a bare name
+
+
+def _constant(value) -> _Node:
+    return _Node(lambda scope: value, value)
+
+
+class _Parser:
+    def __init__(self, source: str):
+        self.source = source
+        self.tokens = self._tokenize(source)
+        self.position = 0
+        self.references: List[Reference] = []
+
+    def _tokenize(self, source: str) -> List[Tuple[str, Any, int]]:
+        tokens = []
+        position = 0
+        length = len(source)
+        while True:
+            match = _TOKENS.match(source, position)
+            if match is None or match.end() == position:
+                if source[position:].strip():
+                    start = len(source) - len(source[position:].lstrip())
+                    raise ExpressionError(f"Unexpected character '{source[start]}'", source, start)
+                break
+            position = match.end()
+            kind = match.lastgroup
+            text = match.group(kind)
+            start = match.start(kind)
+            if kind == "number":
+                value = float(text) if any(char in text for char in ".eE") else int(text)
+                tokens.append(("constant", value, start))
+            elif kind == "string":
+                value = _ESCAPE.sub(lambda escape: _ESCAPES.get(escape.group(1), escape.group(0)), text[1:-1])
+                tokens.append(("constant", value, start))
+            elif kind == "name" and text in CONSTANTS:
+                tokens.append(("constant", CONSTANTS[text], start))
+            elif kind == "name" and text in KEYWORDS:
+                tokens.append(("op", text, start))
+            else:
+                tokens.append((kind, text, start))
+            if position >= length:
+                break
+        tokens.append(("end", None, length))
+        return tokens
+
+    def error(self, message: str, token=None):
+        token = token or self.tokens[self.position]
+        return ExpressionError(message, self.source, token[2])
+
+    def peek(self):
+        return self.tokens[self.position]
+
+    def next(self):
+        token = self.tokens[self.position]
+        self.position += 1
+        return token
+
+    def expect(self, op: str):
+        token = self.next()
+        if token[0] != "op" or token[1] != op:
+            raise self.error(f"Expected '{op}'", token)
+
+    def infix_operator(self) -> Optional[str]:
+        kind, value, _ = self.peek()
+        if kind != "op":
+            return None
+        if value == "not":
+            following = self.tokens[self.position + 1]
+            return "not in" if following[0] == "op" and following[1] == "in" else None
+        return value if value in _PRECEDENCE else None
+
+    def parse(self) -> _Node:
+        try:
+            node = self.expression(0)
+        except ExpressionError:
+            raise
+        except Exception as e:
+            # a constant part failed when it was folded, like 1 / 0
+            raise self.error(f"Invalid constant expression ({type(e).__name__}: {e})", self.tokens[self.position - 1])
+        if self.peek()[0] != "end":
+            raise self.error("Unexpected token")
+        return node
+
+    def expression(self, precedence: int) -> _Node:
+        node = self.prefix()
+        while True:
+            symbol = self.infix_operator()
+            if symbol is None or _PRECEDENCE[symbol] <= precedence:
+                return node
+            self.next()
+            if symbol == "not in":
+                self.next()
+            node = self.infix(symbol, node)
+
+    def prefix(self) -> _Node:
+        token = self.next()
+        kind, value, _ = token
+
+        if kind == "constant":
+            return _constant(value)
+
+        if kind == "name":
+            if value.startswith("_"):
+                raise self.error(f"Invalid name '{value}'", token)
+            if self.peek()[0] == "op" and self.peek()[1] == "(":
+                return self.call(value, token)
+            return _Node(lambda scope: scope.get(value), name=value)
+
+        if kind == "op":
+            if value == "(":
+                node = self.expression(0)
+                self.expect(")")
+                return node
+            if value == "[":
+                return self.list_literal()
+            if value == "not":
+                operand = self.expression(_NOT_PRECEDENCE)
+                evaluate_operand = operand.evaluate
+                return _fold(lambda scope: not evaluate_operand(scope), operand)
+            if value in ("-", "+"):
+                operand = self.expression(_UNARY_PRECEDENCE)
+                if value == "+":
+                    return operand
+                evaluate_operand = operand.evaluate
+                return _fold(lambda scope: _negate(evaluate_operand(scope)), operand)
+
+        raise self.error("Unexpected token" if kind != "end" else "Unexpected end of the expression", token)
+
+    def infix(self, symbol: str, left: _Node) -> _Node:
+        # the closures call the evaluate functions directly, an attribute lookup less per node
+        evaluate_left = left.evaluate
+
+        if symbol == ".":
+            token = self.next()
+            if token[0] != "name" or token[1].startswith("_"):
+                raise self.error("Expected a name after '.'", token)
+            key = token[1]
+            if left.name is not None and key in REFERENCE_ATTRIBUTES:
+                self.references.append(Reference(f"{left.name}.{key}"))
+
+            def member(scope):
+                value = evaluate_left(scope)
+                if type(value) is dict:
+                    return value.get(key)
+                return _member(value, key)
+            return _fold(member, left)
+
+        if symbol == "[":
+            index = self.expression(0)
+            self.expect("]")
+            evaluate_index = index.evaluate
+            return _fold(lambda scope: _member(evaluate_left(scope), evaluate_index(scope)), left, index)
+
+        if symbol == "if":
+            condition = self.expression(_PRECEDENCE["if"])
+            self.expect("else")
+            otherwise = self.expression(_PRECEDENCE["if"] - 1)
+            evaluate_condition = condition.evaluate
+            evaluate_otherwise = otherwise.evaluate
+            return _fold(
+                lambda scope: evaluate_left(scope) if evaluate_condition(scope) else evaluate_otherwise(scope),
+                left, condition, otherwise,
+            )
+
+        right = self.expression(_PRECEDENCE[symbol])
+        evaluate_right = right.evaluate
+        if symbol == "and":
+            return _fold(lambda scope: evaluate_left(scope) and evaluate_right(scope), left, right)
+        if symbol == "or":
+            return _fold(lambda scope: evaluate_left(scope) or evaluate_right(scope), left, right)
+
+        if symbol in _COMPARISONS and right.constant is not _NOT_CONSTANT:
+            return _compare_constant(symbol, left, right.constant)
+
+        if symbol in _ARITHMETIC:
+            calculate = _ARITHMETIC[symbol]
+            if symbol in ("/", "%") and _is_number(right.constant) and right.constant == 0:
+                raise self.error("Division by zero", self.tokens[self.position - 1])
+
+            joins = symbol == "+"
+
+            def arithmetic(scope):
+                left_value = evaluate_left(scope)
+                right_value = evaluate_right(scope)
+                if left_value is None or right_value is None:
+                    return None
+                if type(left_value) is str or type(right_value) is str:
+                    if not (joins and type(left_value) is str and type(right_value) is str):
+                        left_value, right_value = _number(left_value), _number(right_value)
+                return calculate(left_value, right_value)
+            return _fold(arithmetic, left, right)
+
+        function = _BINARY[symbol]
+        return _fold(lambda scope: function(evaluate_left(scope), evaluate_right(scope)), left, right)
+
+    def call(self, name: str, token) -> _Node:
+        function = FUNCTIONS.get(name)
+        if function is None:
+            raise self.error(f"Unknown function '{name}'", token)
+        self.expect("(")
+        arguments = self.arguments(")")
+        evaluators = [argument.evaluate for argument in arguments]
+        if len(evaluators) == 1:
+            evaluate_argument = evaluators[0]
+            return _Node(lambda scope: function(evaluate_argument(scope)))
+        return _Node(lambda scope: function(*[evaluate(scope) for evaluate in evaluators]))
+
+    def list_literal(self) -> _Node:
+        items = self.arguments("]")
+        evaluators = [item.evaluate for item in items]
+        return _fold(lambda scope: [evaluate(scope) for evaluate in evaluators], *items)
+
+    def arguments(self, closing: str) -> List[_Node]:
+        items = []
+        if self.peek()[0] == "op" and self.peek()[1] == closing:
+            self.next()
+            return items
+        while True:
+            items.append(self.expression(0))
+            token = self.next()
+            if token[0] == "op" and token[1] == closing:
+                return items
+            if token[0] != "op" or token[1] != ",":
+                raise self.error(f"Expected ',' or '{closing}'", token)
+
+
+def _compare_constant(symbol: str, left: _Node, constant) -> _Node:
+    """
+    A comparison with a constant, the common case in conditions (score > 0.8, intent == 'sales').
+    The coercion the constant may need is decided once, here, instead of on every evaluation
+    """
+
+    compare = _COMPARISONS[symbol]
+    evaluate_left = left.evaluate
+    is_number = _is_number(constant)
+    ordering = symbol not in ("==", "!=")
+
+    if is_number:
+        def compare_number(scope):
+            value = evaluate_left(scope)
+            if type(value) is str:
+                value = _number(value)
+            elif value is None:
+                return not ordering and compare(None, constant)
+            return compare(value, constant)
+        return _fold(compare_number, left)
+
+    if not ordering and (constant is None or (isinstance(constant, str) and _number(constant) is constant)):
+        # no number can be equal to the constant, so no coercion is needed
+        return _fold(lambda scope: compare(evaluate_left(scope), constant), left)
+
+    function = _BINARY[symbol]
+    return _fold(lambda scope: function(evaluate_left(scope), constant), left)
+
+
+def _fold(evaluate: Callable, *children: _Node) -> _Node:
+    """Evaluate now the nodes whose children are all constants"""
+
+    if all(child.constant is not _NOT_CONSTANT for child in children):
+        return _constant(evaluate(None))
+    return _Node(evaluate)
+
+
+class Expression:
+    """A compiled expression. Immutable, so copies of a block share it"""
+
+    __slots__ = ("source", "_evaluate", "_references")
+
+    def __init__(self, source: str):
+        parser = _Parser(source)
+        self.source = source
+        self._evaluate = parser.parse().evaluate
+        self._references = tuple(parser.references)
+
+    def evaluate(self, scope) -> Any:
+        """scope: the values of the names, any object with get(name) (like a dict)"""
+        return self._evaluate(scope)
+
+    def references(self) -> tuple:
+        """The block references (name.inbound, name.outbound) used by the expression, for the flow linter"""
+        return self._references
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __repr__(self):
+        return f"Expression({self.source!r})"
+
+
+def compile_expression(source: str) -> Expression:
+    """Compile an expression. Raises ExpressionError (a ValueError) if it's invalid"""
+    return Expression(source.strip())
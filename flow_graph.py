@@ -0,0 +1,264 @@
+import logging
+import sys
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from blocks.basicBlock import BaseMessageBlock
+from blocks.send_and_reply_block import SendReplyBlock
+from exceptions import InvalidFlowException
+from expressions import Expression
+
+"""
+Static analysis of a flow: the graph of blocks and the references between them.
+
+The flow registry runs it once per flow version, when the flow file is compiled, so a
+broken flow fails when it's loaded instead of in the middle of a conversation, and the
+runtime loop can trust the block names it follows. It finds:
+
+Errors (the flow is not loaded, InvalidFlowException):
+- missing_block: next_block_name, a branch, on_error or on_timeout names a block that
+  doesn't exist. The next_block_name of final blocks is ignored, the flow stops there.
+- non_yielding_cycle: blocks that can run in a loop without a send_and_reply block
+  among them. run_flow would never return.
+- unknown_reference: a '{{block.attribute}}' reference to a block that doesn't exist
+  or an attribute the block doesn't have.
+- invalid_stream_target: the stream.forward_to of an http block isn't a message block.
+
+Warnings (logged):
+- unreachable: a block that can't be reached from the first block.
+- reference_not_before: a '{{block.attribute}}' reference to a block that can't run
+  before the block using it, so the value is always empty.
+
+It can also lint the flow files from the command line:
+
+    python flow_graph.py                      # every file in ./flows
+    python flow_graph.py flows/my_flow.json
+"""
+
+ERROR = "error"
+WARNING = "warning"
+
+
+class FlowIssue:
+    """A problem found in a flow"""
+
+    __slots__ = ("level", "code", "block", "message")
+
+    def __init__(self, level: str, code: str, block: Optional[str], message: str):
+        self.level = level
+        self.code = code
+        self.block = block
+        self.message = message
+
+    def __str__(self):
+        where = f"block {self.block}: " if self.block is not None else ""
+        return f"{self.level} [{self.code}] {where}{self.message}"
+
+    def __repr__(self):
+        return f"FlowIssue({self.level!r}, {self.code!r}, {self.block!r}, {self.message!r})"
+
+
+def block_targets(block) -> Iterator[Tuple[str, str]]:
+    """(field, block name) of every block that can run right after the given block"""
+
+    if block.next_block_name and not block.is_final_block:
+        yield "next_block_name", block.next_block_name
+    for key, target in (getattr(block, "branches", None) or {}).items():
+        if target:
+            yield f"branches[{key}]", target
+    for field in ("on_error", "on_timeout"):
+        target = getattr(block, field, None)
+        if target:
+            yield field, target
+
+
+def build_graph(prototypes) -> Dict[str, List[str]]:
+    """Block name -> names of the existing blocks that can run after it"""
+
+    names = {block.name_in_flow for block in prototypes}
+    graph = {}
+    for block in prototypes:
+        edges = []
+        for _, target in block_targets(block):
+            if target in names and target not in edges:
+                edges.append(target)
+        graph[block.name_in_flow] = edges
+    return graph
+
+
+def reachable(graph: Dict[str, List[str]], start: str) -> set:
+    seen = {start}
+    stack = [start]
+    while stack:
+        for target in graph[stack.pop()]:
+            if target not in seen:
+                seen.add(target)
+                stack.append(target)
+    return seen
+
+
+def strongly_connected_components(graph: Dict[str, List[str]]) -> List[List[str]]:
+    """Tarjan's algorithm, iterative so big flows don't hit the recursion limit"""
+
+    index: Dict[str, int] = {}
+    lowlink: Dict[str, int] = {}
+    on_stack = set()
+    stack: List[str] = []
+    components = []
+
+    for root in graph:
+        if root in index:
+            continue
+        work = [(root, iter(graph[root]))]
+        index[root] = lowlink[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+
+        while work:
+            node, targets = work[-1]
+            for target in targets:
+                if target not in index:
+                    index[target] = lowlink[target] = len(index)
+                    stack.append(target)
+                    on_stack.add(target)
+                    work.append((target, iter(graph[target])))
+                    break
+                if target in on_stack:
+                    lowlink[node] = min(lowlink[node], index[target])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[node])
+                if lowlink[node] == index[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == node:
+                            break
+                    components.append(component)
+
+    return components
+
+
+def lint_blocks(prototypes) -> List[FlowIssue]:
+    """Analyze the validated blocks of a flow, the first one being where the flow starts"""
+
+    issues = []
+    if not prototypes:
+        return [FlowIssue(ERROR, "empty_flow", None, "the flow has no blocks")]
+
+    blocks = {block.name_in_flow: block for block in prototypes}
+    graph = build_graph(prototypes)
+
+    for block in prototypes:
+        for field, target in block_targets(block):
+            if target not in blocks:
+                issues.append(FlowIssue(ERROR, "missing_block", block.name_in_flow, f"{field} points to '{target}', which doesn't exist"))
+
+        stream_target = (getattr(block, "stream", None) or {}).get("forward_to")
+        if stream_target is not None and not isinstance(blocks.get(stream_target), BaseMessageBlock):
+            issues.append(FlowIssue(ERROR, "invalid_stream_target", block.name_in_flow, f"stream.forward_to '{stream_target}' is not a message block"))
+
+    start = prototypes[0].name_in_flow
+    from_start = reachable(graph, start)
+    for block in prototypes:
+        if block.name_in_flow not in from_start:
+            issues.append(FlowIssue(WARNING, "unreachable", block.name_in_flow, f"can't be reached from '{start}'"))
+
+    # run_flow stops at every send_and_reply block, so a loop is only endless if it doesn't
+    # go through one. Without their outgoing edges, any cycle left is such a loop
+    busy_graph = {
+        name: [] if isinstance(blocks[name], SendReplyBlock) else targets
+        for name, targets in graph.items()
+    }
+    for component in strongly_connected_components(busy_graph):
+        name = component[0]
+        if len(component) > 1 or name in busy_graph[name]:
+            members = ", ".join(sorted(component))
+            issues.append(FlowIssue(ERROR, "non_yielding_cycle", name, f"blocks {members} can loop forever without waiting for the user"))
+
+    issues.extend(_lint_references(prototypes, blocks, graph))
+    return issues
+
+
+def _lint_references(prototypes, blocks: dict, graph: Dict[str, List[str]]) -> List[FlowIssue]:
+    issues = []
+    reverse = {name: [] for name in graph}
+    for name, targets in graph.items():
+        for target in targets:
+            reverse[target].append(name)
+
+    for block in prototypes:
+        templates = getattr(block, "_templates", None)
+        if not templates:
+            continue
+
+        # blocks that can run before this one: the ones that reach it in the graph. Found lazily
+        before = None
+        set_before = set()
+        for variable, template in templates.items():
+            for reference in template.references():
+                if isinstance(template, Expression) and reference.block_name in set_before:
+                    continue  # in expressions the variables set before hide the blocks
+                referenced = blocks.get(reference.block_name)
+                text = f"{{{{{reference.block_name}.{reference.attribute}}}}}"
+                if referenced is None:
+                    issues.append(FlowIssue(ERROR, "unknown_reference", block.name_in_flow, f"variable '{variable}' uses {text}, but the block doesn't exist"))
+                    continue
+                if reference.attribute not in type(referenced).model_fields:
+                    issues.append(FlowIssue(ERROR, "unknown_reference", block.name_in_flow, f"variable '{variable}' uses {text}, but the block has no '{reference.attribute}'"))
+                    continue
+
+                if before is None:
+                    before = set()
+                    for source in reverse[block.name_in_flow]:
+                        before |= reachable(reverse, source)
+                if reference.block_name not in before:
+                    issues.append(FlowIssue(WARNING, "reference_not_before", block.name_in_flow, f"variable '{variable}' uses {text}, but that block can't run before this one"))
+            set_before.add(variable)
+
+    return issues
+
+
+def check_flow(flow_file: str, prototypes) -> List[FlowIssue]:
+    """Lint the blocks of a flow. Logs the warnings and raises InvalidFlowException on errors"""
+
+    issues = lint_blocks(prototypes)
+    errors = [issue for issue in issues if issue.level == ERROR]
+    for issue in issues:
+        if issue.level == WARNING:
+            logging.warning(f"flow {flow_file}: {issue}")
+    if errors:
+        raise InvalidFlowException(flow_file, errors)
+    return issues
+
+
+def main(argv=None) -> int:
+    import glob
+    import json
+    import os
+
+    from flow_registry import FlowTemplate
+
+    paths = argv or sorted(glob.glob(os.path.join("flows", "*.json")))
+    failed = False
+    for path in paths:
+        try:
+            with open(path) as file:
+                template = FlowTemplate(path, "", json.load(file), validate=False)
+            issues = lint_blocks(template.prototypes)
+        except Exception as e:
+            issues = [FlowIssue(ERROR, "invalid_flow", None, str(e))]
+
+        failed = failed or any(issue.level == ERROR for issue in issues)
+        print(f"{path}: {'ok' if not issues else f'{len(issues)} issue(s)'}")
+        for issue in issues:
+            print(f"  {issue}")
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,319 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from types import MappingProxyType
+from typing import Dict, Optional, Tuple
+
+from blocks.basicBlock import BaseMessageBlock
+from blocks.blocks_factory import get_block
+from flow_graph import check_flow
+from schemas import BlockStatus, MessageChannels
+
+"""
+The flow registry compiles each flow file only once.
+
+Reading a flow file, parsing the json and validating every block is done a single
+time per file version. The result is a FlowTemplate: a read-only set of validated
+block prototypes, shared by every conversation of the flow. A conversation only keeps
+one small BlockState per block (status, inbound and outbound). The blocks it runs are
+shallow copies of the prototypes with the conversation fields (to, from_,
+messaging_channel) and the state applied, so no json parsing or pydantic validation
+happens when a new BasicFlow is created.
+
+The registry checks the file mtime on every lookup and, when it changed, the file
+hash. The flow is only compiled again when its content really changed.
+
+Hot reload: registry.watch() starts a thread that polls the flow files and compiles the
+changed ones in the background. The new version is swapped in atomically, and while the
+watcher runs the lookups don't touch the file system at all. The last versions of every
+file are kept: a conversation keeps running the version it started with (its
+flow_version) and can be moved to the current one with BasicFlow.migrate.
+
+The versions are only kept in memory. After a restart, or once max_versions newer
+versions were compiled, a conversation pinned to a version that's gone moves to the
+current one (with a warning), keeping the state of its blocks by name. It's refused
+(ValueError) when the block it's on doesn't exist in the current version.
+
+Every compiled version is checked by the flow linter (flow_graph.py): a flow with
+broken block names, a loop that never waits for the user or references to missing
+blocks raises InvalidFlowException when it's loaded, not in the middle of a conversation.
+"""
+
+FLOWS_DIR = "./flows"
+DEFAULT_MAX_VERSIONS = 8
+DEFAULT_WATCH_INTERVAL = 1.0
+
+# placeholder values used to validate message blocks before a conversation exists
+_PLACEHOLDER_FIELDS = {
+    "to": "",
+    "from_": "",
+    "messaging_channel": MessageChannels.mock,
+}
+
+
+class BlockState:
+    """
+    The state of a block in a single conversation. The other attributes are read
+    from the shared block prototype
+    """
+
+    __slots__ = ("prototype", "status", "inbound", "outbound", "delivery_status", "streamed_content")
+
+    def __init__(self, prototype, status: BlockStatus, inbound=None, outbound=None, delivery_status=None, streamed_content=None):
+        self.prototype = prototype
+        self.status = status
+        self.inbound = inbound
+        self.outbound = outbound
+        self.delivery_status = delivery_status
+        self.streamed_content = streamed_content
+
+    @classmethod
+    def of(cls, block, prototype=None) -> "BlockState":
+        return cls(
+            prototype if prototype is not None else block,
+            block.status,
+            block.inbound,
+            block.outbound,
+            block.__dict__.get("delivery_status"),
+            block.__dict__.get("streamed_content"),
+        )
+
+    def is_same(self, block) -> bool:
+        """Whether the block has exactly this state"""
+        return (
+            block.status == self.status
+            and block.inbound is self.inbound
+            and block.outbound is self.outbound
+            and block.__dict__.get("delivery_status") == self.delivery_status
+            and block.__dict__.get("streamed_content") == self.streamed_content
+        )
+
+    @property
+    def name_in_flow(self) -> str:
+        # read on every snapshot, a property skips the failed slot lookup of __getattr__
+        return self.prototype.name_in_flow
+
+    def __getattr__(self, name):
+        return getattr(self.prototype, name)
+
+
+class FlowTemplate:
+    """A flow file compiled into read-only, validated block prototypes"""
+
+    __slots__ = ("flow_file", "version", "prototypes", "initial_states", "block_index", "issues")
+
+    def __init__(self, flow_file: str, version: str, block_infos: dict, validate: bool = True):
+        self.flow_file = flow_file
+        self.version = version
+
+        prototypes = []
+        for block_name, infos in block_infos.items():
+            infos = {**infos, **_PLACEHOLDER_FIELDS, "name_in_flow": block_name}
+            prototypes.append(get_block(infos))
+        self.prototypes = tuple(prototypes)
+        # the warnings of the flow linter. Errors raise InvalidFlowException, see flow_graph.py
+        self.issues = tuple(check_flow(flow_file, self.prototypes)) if validate else ()
+        # shared by the conversations until a block changes. Never mutated
+        self.initial_states = tuple(BlockState.of(block) for block in self.prototypes)
+        self.block_index = MappingProxyType(
+            {block.name_in_flow: index for index, block in enumerate(self.prototypes)}
+        )
+
+    def materialize(
+        self,
+        index: int,
+        state: BlockState,
+        to: str,
+        from_: str,
+        messaging_channel: Optional[MessageChannels],
+    ):
+        """
+        Return a runnable block of a conversation: a shallow copy of the prototype with the
+        conversation fields and the block state. The static fields are shared with the prototype
+        """
+
+        prototype = self.prototypes[index]
+        update = {"status": state.status, "inbound": state.inbound, "outbound": state.outbound}
+        if isinstance(prototype, BaseMessageBlock):
+            update.update(to=to, from_=from_, messaging_channel=messaging_channel, delivery_status=state.delivery_status, streamed_content=state.streamed_content)
+        return prototype.model_copy(update=update)
+
+
+class FlowRegistry:
+    """Keeps the compiled FlowTemplates of the flow files, the current one and the previous versions"""
+
+    def __init__(
+        self,
+        flows_dir: str = FLOWS_DIR,
+        validate: bool = True,
+        max_versions: int = DEFAULT_MAX_VERSIONS,
+        pin_versions: bool = True,
+    ):
+        """
+        validate: lint every flow version when it's compiled, see flow_graph.py
+        max_versions: compiled versions kept per flow file for the conversations pinned to them.
+        pin_versions: the conversations keep running the flow version they started with.
+            Without it they move to the current version, keeping the state of the blocks by name.
+        """
+        self.flows_dir = flows_dir
+        self.validate = validate
+        self.max_versions = max_versions
+        self.pin_versions = pin_versions
+        self._templates: Dict[str, Tuple[int, FlowTemplate]] = {}
+        self._versions: Dict[str, "OrderedDict[str, FlowTemplate]"] = {}
+        self._lock = threading.Lock()
+        self._watcher: Optional["FlowWatcher"] = None
+
+    def get(self, flow_file: str, version: Optional[str] = None) -> FlowTemplate:
+        """
+        Return the compiled template of a flow file, compiling it if needed. With a version,
+        return that version while it's kept, and the current one when it's not
+        """
+
+        if version is not None and self.pin_versions:
+            template = self._versions.get(flow_file, {}).get(version)
+            if template is not None:
+                return template
+
+        cached = self._templates.get(flow_file)
+        if cached is not None and self._watcher is not None:
+            # the watcher swaps in the new versions, the message path doesn't even stat the file
+            return cached[1]
+
+        path = os.path.join(self.flows_dir, flow_file)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            raise FileNotFoundError(f"File {flow_file} not found")
+
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
+        with self._lock:
+            cached = self._templates.get(flow_file)
+            if cached is not None and cached[0] == mtime:
+                return cached[1]
+            template = self._compile(flow_file, path, cached)
+            self._swap(flow_file, mtime, template)
+            return template
+
+    def reload(self, flow_file: str) -> bool:
+        """
+        Compile the flow file again if it changed and swap the new version in. The requests
+        keep getting the previous version while it compiles. Returns whether the version changed
+        """
+
+        cached = self._templates.get(flow_file)
+        path = os.path.join(self.flows_dir, flow_file)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            logging.warning(f"flow file {flow_file} was removed. Keeping its last version")
+            return False
+        if cached is not None and cached[0] == mtime:
+            return False
+
+        try:
+            template = self._compile(flow_file, path, cached)
+        except Exception as e:
+            logging.error(f"Error compiling flow {flow_file}. Keeping its current version: {e}")
+            # don't try again until the file changes
+            template = cached[1] if cached is not None else None
+
+        with self._lock:
+            if template is None:
+                return False
+            changed = cached is None or cached[1] is not template
+            self._swap(flow_file, mtime, template)
+        if changed:
+            logging.info(f"flow {flow_file} reloaded. Version {template.version}")
+        return changed
+
+    def versions(self, flow_file: str) -> list:
+        """The versions of a flow file kept in memory, oldest first"""
+        return list(self._versions.get(flow_file, ()))
+
+    def _compile(self, flow_file: str, path: str, cached: Optional[Tuple[int, FlowTemplate]]) -> FlowTemplate:
+        with open(path, "rb") as file:
+            raw = file.read()
+        version = hashlib.sha256(raw).hexdigest()[:16]
+
+        if cached is not None and cached[1].version == version:
+            return cached[1]
+        known = self._versions.get(flow_file, {}).get(version)
+        if known is not None:
+            return known  # the file went back to a version still kept
+
+        logging.debug(f"compiling flow {flow_file} version {version}")
+        return FlowTemplate(flow_file, version, json.loads(raw), self.validate)
+
+    def _swap(self, flow_file: str, mtime: int, template: FlowTemplate):
+        """Make the template the current version. Called with the lock held"""
+
+        versions = self._versions.setdefault(flow_file, OrderedDict())
+        versions[template.version] = template
+        versions.move_to_end(template.version)
+        while len(versions) > self.max_versions:
+            versions.popitem(last=False)
+        self._templates[flow_file] = (mtime, template)
+
+    def watch(self, interval: float = DEFAULT_WATCH_INTERVAL) -> "FlowWatcher":
+        """Reload the changed flow files in a background thread"""
+
+        if self._watcher is None:
+            self._watcher = FlowWatcher(self, interval)
+            self._watcher.start()
+        return self._watcher
+
+    def stop_watching(self):
+        if self._watcher is not None:
+            self._watcher.stop()
+            self._watcher = None
+
+    def invalidate(self, flow_file: Optional[str] = None):
+        """Drop the compiled templates of a flow file, or of every flow file"""
+        with self._lock:
+            if flow_file is None:
+                self._templates.clear()
+                self._versions.clear()
+            else:
+                self._templates.pop(flow_file, None)
+                self._versions.pop(flow_file, None)
+
+
+class FlowWatcher:
+    """Polls the files of the compiled flows and reloads the ones that changed"""
+
+    def __init__(self, registry: FlowRegistry, interval: float = DEFAULT_WATCH_INTERVAL):
+        self.registry = registry
+        self.interval = interval
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def check(self) -> list:
+        """Reload the changed flow files now. Returns the ones with a new version"""
+        return [flow_file for flow_file in list(self.registry._templates) if self.registry.reload(flow_file)]
+
+    def start(self):
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="flow_watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.check()
+            except Exception as e:
+                logging.error(f"Error checking the flow files: {e}")
+
+
+registry = FlowRegistry()
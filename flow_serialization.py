@@ -0,0 +1,113 @@
+import msgpack
+
+from flows import BasicFlow
+from schemas import BlockStatus, MessageChannels
+
+"""
+Compact binary format for the state of a conversation.
+
+Only the fields that change during a conversation are written: the flow cursor, the
+variables, and the status/inbound/outbound of the blocks that are not in their initial
+state (ready, no inbound, no outbound). The static block configuration comes from the
+flow template, identified by flow_file and flow_version. The record is a msgpack array:
+
+[FORMAT_VERSION, flow_file, flow_version, flow_id, flow_name, to, from_, channel,
+ flow_status, curr_block_name, previous_block_name, next_block_name, variables,
+ [[block_name, status, inbound, outbound], ...], wait_deadline]
+
+A block that is streaming a response (see streaming.py) has a fifth item, the text it
+already sent. It is left out when there is none, like the blocks in their initial state.
+
+Statuses are stored as small integers. Blocks are referenced by name, so a snapshot
+written with an older version of a flow can still be loaded when blocks were added
+or removed.
+"""
+
+FORMAT_VERSION = 1
+
+_STATUS_CODES = {status: code for code, status in enumerate(BlockStatus)}
+_STATUSES = list(BlockStatus)
+_CHANNEL_CODES = {channel: code for code, channel in enumerate(MessageChannels)}
+_CHANNELS = list(MessageChannels)
+
+
+def _default(value):
+    """Values msgpack can't encode, like the exceptions stored by failed http blocks"""
+    return str(value)
+
+
+def dumps_flow(flow: BasicFlow) -> bytes:
+    """Encode the mutable state of a flow"""
+
+    blocks = []
+    for block in flow.changed_block_states():
+        entry = [block.name_in_flow, _STATUS_CODES[block.status], block.inbound, block.outbound]
+        streamed_content = getattr(block, "streamed_content", None)
+        if streamed_content is not None:
+            entry.append(streamed_content)
+        blocks.append(entry)
+
+    record = [
+        FORMAT_VERSION,
+        flow.flow_file,
+        flow.flow_version,
+        flow.flow_id,
+        flow.flow_name,
+        flow.to,
+        flow.from_,
+        _CHANNEL_CODES[flow.curr_channel] if flow.curr_channel is not None else None,
+        _STATUS_CODES[flow.flow_status],
+        flow.curr_block_name,
+        flow.previous_block_name,
+        flow.next_block_name,
+        flow.variables,
+        blocks,
+        flow.wait_deadline,
+    ]
+    return msgpack.packb(record, default=_default, use_bin_type=True)
+
+
+def loads_flow(data: bytes) -> BasicFlow:
+    """Rebuild a flow encoded with dumps_flow"""
+
+    record = msgpack.unpackb(data, raw=False, strict_map_key=False)
+    if record[0] != FORMAT_VERSION:
+        raise ValueError(f"Unsupported flow state format version {record[0]}")
+
+    (
+        _,
+        flow_file,
+        flow_version,
+        flow_id,
+        flow_name,
+        to,
+        from_,
+        channel,
+        flow_status,
+        curr_block_name,
+        previous_block_name,
+        next_block_name,
+        variables,
+        blocks,
+        wait_deadline,
+    ) = record
+
+    return BasicFlow.from_snapshot({
+        "flow_id": flow_id,
+        "flow_file": flow_file,
+        "flow_name": flow_name,
+        "flow_version": flow_version,
+        "to": to,
+        "from_": from_,
+        "curr_channel": _CHANNELS[channel] if channel is not None else None,
+        "flow_status": _STATUSES[flow_status],
+        "curr_block_name": curr_block_name,
+        "previous_block_name": previous_block_name,
+        "next_block_name": next_block_name,
+        "variables": variables,
+        "wait_deadline": wait_deadline,
+        "blocks": {
+            name: [_STATUSES[status], inbound, outbound, *streamed]
+            for name, status, inbound, outbound, *streamed in blocks
+        },
+    })
@@ -1,16 +1,20 @@
+import time
 from enum import Enum
-import json
 from uuid import uuid4
+from collections.abc import Mapping
 from typing import List, Optional
 import logging
 
-from pydantic import AliasChoices, BaseModel, Field
+from pydantic import AliasChoices, BaseModel, Field, PrivateAttr
 
-from blocks.blocks_factory import get_block
 from blocks.set_variables_block import SetVariablesBlock
 from blocks.split_based_on_variable_block import SplitVariableBlock
 from blocks.http_request_block import HTTPBlock
+from blocks.parallel_http_block import ParallelHTTPBlock
+from blocks.send_and_reply_block import SendReplyBlock
 from exceptions import MissingFieldException
+from flow_registry import BlockState, registry
+from instrumentation import ablock_started, block_ended, block_started
 from schemas import BlockStatus, MessageChannels
 
 class BasicFlow(BaseModel):
@@ -21,41 +25,172 @@ class BasicFlow(BaseModel):
     flow_status: BlockStatus = BlockStatus.ready
     flow_file: str
     flow_name: str
+    flow_version: Optional[str] = None # version of the flow template the blocks came from
     curr_channel: Optional[MessageChannels] = None
     next_block_name: Optional[str] = None
     curr_block_name: Optional[str] = None
     previous_block_name: Optional[str] = None
     run_next_block: Optional[bool] = False
     flow_id: str = Field(default_factory=lambda: str(uuid4()))
-    blocks: Optional[list] = []
     variables: Optional[dict] = {}
+    wait_deadline: Optional[float] = None # unix time when the reply_timeout of the waiting block expires
+
+    # the compiled flow (shared by every conversation), name -> block position, and the
+    # state of each block in this conversation
+    _template = PrivateAttr(default=None)
+    _block_index: dict = PrivateAttr(default_factory=dict)
+    _states: list = PrivateAttr(default_factory=list)
+    # blocks materialized during a run, by position. Dropped when the run ends
+    _live_blocks: dict = PrivateAttr(default_factory=dict)
 
     def __init__(self, **data):
         super().__init__(**data)
         self.get_flow_blocks()
         if self.curr_block_name is None:
-            self.curr_block_name = self.blocks[0].name_in_flow
+            self.curr_block_name = self._template.prototypes[0].name_in_flow
 
     def get_flow_blocks(self):
-        """Get the blocks of the flow"""
+        """Get the compiled template of the flow and start the state of its blocks"""
 
-        if self.blocks == []:
-            if self.flow_file is None:
-                raise MissingFieldException("flow_file")
-            try:
-                with open(f"./flows/{self.flow_file}", 'r') as file:
-                    block_infos = json.load(file)
-            except FileNotFoundError:
-                raise FileNotFoundError(f"File {self.flow_file} not found")
-                        
-            for block_name in block_infos.keys():
-                block_infos[block_name]['name_in_flow'] = block_name
-                block_infos[block_name]['messaging_channel'] = self.curr_channel
-                block_infos[block_name]['to'] = self.to
-                block_infos[block_name]['from_'] = self.from_
-
-                block = get_block(block_infos[block_name])
-                self.blocks.append(block)
+        if self.flow_file is None:
+            raise MissingFieldException("flow_file")
+
+        # a conversation keeps the version of the flow it started with, while the registry has it
+        template = registry.get(self.flow_file, self.flow_version)
+        if self.flow_version is not None and template.version != self.flow_version:
+            # the pinned versions are only kept in memory: gone after a restart or max_versions reloads
+            if self.curr_block_name not in (None, "Stopped") and self.curr_block_name not in template.block_index:
+                raise ValueError(
+                    f"Can't load flow {self.flow_id}: version {self.flow_version} of {self.flow_file} is not "
+                    f"available and block '{self.curr_block_name}' is not in version {template.version}"
+                )
+            logging.warning(
+                f"flow {self.flow_file} version {self.flow_version} is not available. "
+                f"Flow {self.flow_id} moves to version {template.version}, keeping the state of the blocks by name"
+            )
+        self._bind_template(template)
+
+    def _bind_template(self, template):
+        self._template = template
+        self._block_index = template.block_index
+        self._states = list(template.initial_states)
+        self._live_blocks = {}
+        self.flow_version = template.version
+
+    def migrate(self, block_map: Optional[dict] = None, template=None):
+        """
+        Move the conversation to another version of its flow, the current one by default.
+        Each block keeps its state if the new version has a block with the same name, or
+        with the name given by block_map (old name -> new name). Raises ValueError when the
+        block the conversation is on doesn't exist in the new version
+        """
+
+        template = template if template is not None else registry.get(self.flow_file)
+        if template is self._template:
+            return
+
+        block_map = block_map or {}
+        curr_block_name = block_map.get(self.curr_block_name, self.curr_block_name)
+        if curr_block_name not in template.block_index and curr_block_name != "Stopped":
+            raise ValueError(
+                f"Can't migrate flow {self.flow_id}: block '{curr_block_name}' is not in version {template.version}"
+            )
+
+        old_version = self.flow_version
+        changed = [
+            (block_map.get(state.name_in_flow, state.name_in_flow), state)
+            for state in self.changed_block_states()
+        ]
+        self._bind_template(template)
+        for name, state in changed:
+            if name in template.block_index:
+                self.set_block_state(name, state.status, state.inbound, state.outbound, getattr(state, "streamed_content", None))
+            else:
+                logging.warning(f"block {name} is not in version {template.version} of flow {self.flow_file}. Dropping its state")
+
+        self.curr_block_name = curr_block_name
+        for field in ("next_block_name", "previous_block_name"):
+            name = getattr(self, field)
+            name = block_map.get(name, name)
+            setattr(self, field, name if name in template.block_index else None)
+        logging.info(f"flow {self.flow_id} migrated from version {old_version} to {template.version}")
+
+    @property
+    def blocks(self) -> list:
+        """
+        The blocks of the conversation. They are materialized from the flow template
+        and kept until the end of the next run, so changes made to them are saved
+        """
+        return [self._get_block(index) for index in range(len(self._states))]
+
+    def block_states(self) -> list:
+        """The state (status, inbound, outbound) of every block, without materializing them"""
+
+        # read straight from the private dict: every self._private lookup goes through
+        # BaseModel.__getattr__, which costs more than the whole loop
+        private = self.__pydantic_private__
+        states = private["_states"]
+        live_blocks = private["_live_blocks"]
+        if not live_blocks:
+            return list(states)
+        return [
+            live_blocks[index] if index in live_blocks else state
+            for index, state in enumerate(states)
+        ]
+
+    def changed_block_states(self) -> list:
+        """The states of the blocks that left their initial state, the ones a snapshot has to keep"""
+
+        private = self.__pydantic_private__
+        live_blocks = private["_live_blocks"]
+        changed = []
+        for index, (state, initial) in enumerate(zip(private["_states"], private["_template"].initial_states)):
+            if index in live_blocks:
+                state = live_blocks[index]
+                if initial.is_same(state):
+                    continue
+            elif state is initial:
+                # _store_block keeps the shared initial state for the unchanged blocks
+                continue
+            changed.append(state)
+        return changed
+
+    def set_block_state(self, name: str, status: BlockStatus, inbound=None, outbound=None, streamed_content=None):
+        index = self._block_index[name]
+        self._live_blocks.pop(index, None)
+        self._states[index] = BlockState(self._template.prototypes[index], status, inbound, outbound, streamed_content=streamed_content)
+
+    def _get_block(self, index: int):
+        block = self._live_blocks.get(index)
+        if block is None:
+            block = self._template.materialize(
+                index,
+                self._states[index],
+                to=self.to,
+                from_=self.from_,
+                messaging_channel=self.curr_channel,
+            )
+            self._live_blocks[index] = block
+        return block
+
+    def _store_block(self, block):
+        """Save the state of a materialized block"""
+        index = self._block_index[block.name_in_flow]
+        initial = self._template.initial_states[index]
+        if initial.is_same(block):
+            self._states[index] = initial
+        else:
+            self._states[index] = BlockState.of(block, prototype=initial.prototype)
+
+    def _release_blocks(self):
+        """
+        Save the state of the materialized blocks and drop them. Messages still queued
+        on the outbound dispatcher keep their block until the delivery result arrives
+        """
+        for index, block in list(self._live_blocks.items()):
+            self._store_block(block)
+            if block.__dict__.get("delivery_status") != "queued":
+                del self._live_blocks[index]
 
     def run_flow(self, event:str=None):
         """
@@ -63,62 +198,180 @@ class BasicFlow(BaseModel):
         The event that triggers run function is always a string with the content sent by the user.
         """
 
-        logging.debug(f"running flow with event: {event}")
+        self._start_run(event)
+
+        while self._should_run_next_block():
+            block, event = self._prepare_step(event)
+
+            action = "run" if block.status != BlockStatus.running else "continue"
+            logging.debug("block %s: %s with event: %s", block.name_in_flow, action, event)
+            started = block_started(self, block, action)
+            try:
+                if action == "run":
+                    keys_to_change = block.run_block(event)
+                else:
+                    keys_to_change = block.continue_block(event)
+            except Exception as e:
+                block_ended(self, block, action, started, e)
+                raise
+            block_ended(self, block, action, started)
+
+            self._finish_step(block, keys_to_change)
+
+        self._release_blocks()
+
+    async def arun_flow(self, event:str=None):
+        """
+        Run the flow inside an event loop. Same as run_flow, but the blocks that wait on
+        the network (messages, http requests) don't block the loop, so many conversations
+        can run concurrently in a single process.
+        """
+
+        import asyncio
+
+        self._start_run(event)
+        loop = asyncio.get_running_loop()
+
+        while self._should_run_next_block():
+            block, event = self._prepare_step(event, loop)
+
+            action = "run" if block.status != BlockStatus.running else "continue"
+            logging.debug("block %s: %s with event: %s", block.name_in_flow, action, event)
+            started = await ablock_started(self, block, action)
+            try:
+                if action == "run":
+                    keys_to_change = await block.arun_block(event)
+                else:
+                    keys_to_change = await block.acontinue_block(event)
+            except Exception as e:
+                block_ended(self, block, action, started, e)
+                raise
+            block_ended(self, block, action, started)
+
+            self._finish_step(block, keys_to_change)
+
+        self._release_blocks()
+
+    def handle_timeout(self, now: Optional[float] = None) -> bool:
+        """
+        Resume a flow whose send_and_reply block didn't get a reply before its reply_timeout.
+        The flow runs from the on_timeout block, or expires (status failed) if there is none.
+        Returns False if the flow isn't waiting or its deadline didn't pass yet.
+        """
+
+        if not self._start_timeout(now):
+            return False
+        if self.flow_status != BlockStatus.failed:
+            self.run_flow()
+        return True
+
+    async def ahandle_timeout(self, now: Optional[float] = None) -> bool:
+        """Same as handle_timeout, running the on_timeout branch inside an event loop"""
+
+        if not self._start_timeout(now):
+            return False
+        if self.flow_status != BlockStatus.failed:
+            await self.arun_flow()
+        return True
+
+    def _start_timeout(self, now: Optional[float]) -> bool:
+        """Time out the waiting block. Returns whether the deadline had passed"""
+
+        if self.wait_deadline is None or self.flow_status in (BlockStatus.success, BlockStatus.failed):
+            return False
+        if (now if now is not None else time.time()) < self.wait_deadline:
+            return False
+
+        block = self.get_block_by_name(self.curr_block_name)
+        logging.debug("block %s: no reply before its timeout", block.name_in_flow)
+        # routed here and not through _finish_step: the timeout goes to on_timeout, not
+        # to the next_block_name of the block, which its reply still follows
+        keys_to_change = block.timeout_block()
+        self._store_block(block)
+        self.wait_deadline = None
+        self.update_flow_values(keys_to_change)
+        self.previous_block_name = block.name_in_flow
+
+        if block.on_timeout is None:
+            logging.debug("block %s has no on_timeout block. expiring flow %s", block.name_in_flow, self.flow_id)
+            self.curr_block_name = "Stopped"
+            self.flow_status = BlockStatus.failed
+            self._release_blocks()
+        else:
+            self.curr_block_name = block.on_timeout
+        return True
+
+    def _start_run(self, event):
+        """Check the flow can run and mark it as running"""
+
+        logging.debug("running flow with event: %s", event)
         self.run_next_block = True
 
         if self.flow_status == BlockStatus.success:
             raise ValueError("Flow has already been run successfully. Cannot run again.")
 
-        while self.run_next_block and (self.flow_status != BlockStatus.success and self.flow_status != BlockStatus.failed):
-            logging.debug(f"########running/continuing block {self.curr_block_name}########")
+    def _should_run_next_block(self) -> bool:
+        return self.run_next_block and (self.flow_status != BlockStatus.success and self.flow_status != BlockStatus.failed)
+
+    def _prepare_step(self, event, loop=None):
+        """
+        Get the current block and give it the flow values it needs. Returns the block and its event.
+        `loop` is the event loop of arun_flow, the streamed chunks are sent on it
+        """
+
+        logging.debug("########running/continuing block %s########", self.curr_block_name)
 
-            block = self.get_block_by_name(self.curr_block_name)
+        block = self.get_block_by_name(self.curr_block_name)
 
-            if isinstance(block, SetVariablesBlock):
-                block.blocks = [ block_ for block_ in self.blocks if block_.status == BlockStatus.success]
-                event = self.variables
-            
-            if isinstance(block, HTTPBlock):
-                block.variables = self.variables
-
-            if isinstance(block, SplitVariableBlock):
-                block.variables = self.variables
-
-            # if self.previous_block_name is not None:
-            #     block.previous_block = self.get_block_by_name(self.previous_block_name)
-            if block.status != BlockStatus.running:
-                logging.debug(f"block {block.name_in_flow} is ready. running block with event: {event}")
-                keys_to_change = block.run_block(event)
-            elif block.status == BlockStatus.running:
-                logging.debug(f"block {block.name_in_flow} is running. continuing block with event: {event}")
-                keys_to_change = block.continue_block(event)            
-            
-            logging.debug(f"block ran. keys to change: {keys_to_change}")
-            self.update_flow_values(keys_to_change)
-            
-            if block.is_final_block:
-                self.curr_block_name = "Stopped"
-                self.flow_status = BlockStatus.success
-                self.previous_block_name = block.name_in_flow
-                logging.debug(f"encountered final block. stopping flow: {self}")
-                self.run_next_block = False
-                break
-            
-            if block.status == BlockStatus.success:
-                logging.debug(f"block {block.name_in_flow} was successful. moving to next block")
-                self.curr_block_name = block.next_block_name
-                self.previous_block_name = block.name_in_flow
+        if isinstance(block, SetVariablesBlock):
+            block.blocks = CompletedBlocks(self)
+            event = self.variables
+
+        if isinstance(block, HTTPBlock):
+            block.variables = self.variables
+            forward_to = block.stream.get("forward_to")
+            if forward_to is not None:
+                block.set_chunk_sink(self.get_block_by_name(forward_to).chunk_sender(loop))
+
+        if isinstance(block, (SplitVariableBlock, ParallelHTTPBlock)):
+            block.variables = self.variables
+
+        return block, event
+
+    def _finish_step(self, block, keys_to_change):
+        """Apply the result of a block run to the flow and move to the next block"""
+
+        self._store_block(block)
 
+        if block.status == BlockStatus.running and isinstance(block, SendReplyBlock) and block.reply_timeout is not None:
+            self.wait_deadline = time.time() + block.reply_timeout
+        else:
+            self.wait_deadline = None
 
-            # logging.debug(f"Setting event to None")
-            # event = None
-            logging.debug(f"ending block run. flow: {self}")
+        logging.debug("block ran. keys to change: %s", keys_to_change)
+        self.update_flow_values(keys_to_change)
+
+        if block.is_final_block:
+            self.curr_block_name = "Stopped"
+            self.flow_status = BlockStatus.success
+            self.previous_block_name = block.name_in_flow
+            logging.debug("encountered final block. stopping flow: %s", self)
+            self.run_next_block = False
+            return
+
+        # a failed block moves on only when it names an error branch (like on_error)
+        if block.status == BlockStatus.success or (block.status == BlockStatus.failed and block.next_block_name is not None):
+            logging.debug("block %s finished with status %s. moving to next block", block.name_in_flow, block.status)
+            self.curr_block_name = block.next_block_name
+            self.previous_block_name = block.name_in_flow
+
+        logging.debug("ending block run. flow: %s", self)
 
     def get_block_by_name(self, name):
-        for block in self.blocks:
-            if block.name_in_flow == name:
-                return block
-            
+        index = self._block_index.get(name)
+        if index is not None:
+            return self._get_block(index)
+
         logging.debug("could not get the block")
         raise ValueError(f"Could not find block '{name}'")
             
@@ -140,6 +393,89 @@ class BasicFlow(BaseModel):
                             # print(f"Attribute {key} not found in BasicFlow.")
                             raise AttributeError(f"Attribute {key} not found in BasicFlow.")
 
+    def snapshot(self) -> dict:
+        """
+        Return the state of the flow as a plain dict: the flow fields plus the
+        status, inbound and outbound of every block (and the text it already streamed). The static block configuration
+        is not included, it comes back from the flow file on from_snapshot.
+        """
+
+        blocks = {}
+        for block in self.block_states():
+            outbound = block.outbound
+            if isinstance(outbound, Exception):
+                outbound = str(outbound)
+            blocks[block.name_in_flow] = [block.status.value, block.inbound, outbound]
+            streamed_content = getattr(block, "streamed_content", None)
+            if streamed_content is not None:
+                blocks[block.name_in_flow].append(streamed_content)
+
+        return {
+            "flow_id": self.flow_id,
+            "flow_file": self.flow_file,
+            "flow_name": self.flow_name,
+            "flow_version": self.flow_version,
+            "to": self.to,
+            "from_": self.from_,
+            "curr_channel": self.curr_channel.value if self.curr_channel is not None else None,
+            "flow_status": self.flow_status.value,
+            "curr_block_name": self.curr_block_name,
+            "previous_block_name": self.previous_block_name,
+            "next_block_name": self.next_block_name,
+            "variables": self.variables,
+            "wait_deadline": self.wait_deadline,
+            "blocks": blocks,
+        }
+
+    @classmethod
+    def from_snapshot(cls, snapshot: dict) -> "BasicFlow":
+        """Rebuild a flow from snapshot(). The blocks are copied from the compiled flow template"""
+
+        fields = {key: value for key, value in snapshot.items() if key != "blocks"}
+        flow = cls(**fields)
+
+        for name, (status, inbound, outbound, *streamed) in snapshot.get("blocks", {}).items():
+            if name not in flow._block_index:
+                logging.warning(f"block {name} is not in flow {flow.flow_file} anymore. Ignoring its state")
+                continue
+            flow.set_block_state(name, BlockStatus(status), inbound, outbound, streamed[0] if streamed else None)
+
+        return flow
+
+
+class CompletedBlocks(Mapping):
+    """Read-only view of the blocks of a flow that finished successfully, by name"""
+
+    __slots__ = ("_block_index", "_states", "_live_blocks")
+
+    def __init__(self, flow: BasicFlow):
+        # the flow containers are read once, private attributes of a model are slow to get
+        private = flow.__pydantic_private__
+        self._block_index = private["_block_index"]
+        self._states = private["_states"]
+        self._live_blocks = private["_live_blocks"]
+
+    def get(self, name, default=None):
+        index = self._block_index.get(name)
+        if index is None:
+            return default
+        state = self._live_blocks.get(index) or self._states[index]
+        return state if state.status == BlockStatus.success else default
+
+    def __getitem__(self, name):
+        state = self.get(name)
+        if state is None:
+            raise KeyError(name)
+        return state
+
+    def __iter__(self):
+        for name in self._block_index:
+            if self.get(name) is not None:
+                yield name
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
 
 if __name__ == "__main__":
     
@@ -0,0 +1,213 @@
+import copy
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+"""
+Response cache for the http blocks.
+
+The cache is enabled per block in the flow json with a "cache" field:
+
+"test_request": {
+    "block_type": "http_request",
+    "options": {"method": "GET", "url": "https://viacep.com.br/ws/{cep}/json/"},
+    "cache": {
+        "ttl": 3600,           # seconds a response stays valid (default 300)
+        "max_entries": 5000,   # least recently used responses are dropped after that (default 1024)
+        "backend": "memory",   # "memory" or "disk" (default "memory")
+        "path": "http_cache.sqlite3"  # file used by the disk backend
+    }
+}
+
+The cache key is the fully formatted request (method, url, headers and body), so two
+conversations that send the same request share the response. Only successful json
+responses are stored.
+"""
+
+DEFAULT_TTL = 300
+DEFAULT_MAX_ENTRIES = 1024
+DEFAULT_DISK_PATH = "http_cache.sqlite3"
+
+
+class MemoryCacheBackend:
+    """Keeps the responses in memory, dropping the least recently used ones"""
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES, **kwargs):
+        self.max_entries = max_entries
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Tuple[float, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key: str, expires_at: float, value: Any):
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class DiskCacheBackend:
+    """Keeps the responses in a sqlite file, so they survive restarts and are shared between processes"""
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES, path: str = DEFAULT_DISK_PATH, **kwargs):
+        import sqlite3
+
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, expires_at REAL, last_access REAL, value TEXT)"
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)"
+        )
+
+    def get(self, key: str) -> Optional[Tuple[float, Any]]:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT expires_at, value FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._connection.execute(
+                "UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key)
+            )
+        return row[0], json.loads(row[1])
+
+    def set(self, key: str, expires_at: float, value: Any):
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)",
+                (key, expires_at, time.time(), json.dumps(value)),
+            )
+            self._connection.execute(
+                "DELETE FROM responses WHERE key IN ("
+                "SELECT key FROM responses ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def delete(self, key: str):
+        with self._lock:
+            self._connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+
+    def clear(self):
+        with self._lock:
+            self._connection.execute("DELETE FROM responses")
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+
+CACHE_BACKENDS = {
+    "memory": MemoryCacheBackend,
+    "disk": DiskCacheBackend,
+}
+
+
+class ResponseCache:
+    """A response cache with expiration and hit/miss counters"""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(request: dict) -> str:
+        """Build the cache key from the formatted request"""
+
+        key_fields = {
+            "method": str(request.get("method", "GET")).upper(),
+            "url": request.get("url", ""),
+            "headers": request.get("headers", {}),
+            "json": request.get("json", {}),
+        }
+        raw = json.dumps(key_fields, sort_keys=True, default=str)
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def get(self, request: dict) -> Tuple[bool, Any]:
+        """Return (True, response) when the request is cached and not expired, else (False, None)"""
+
+        key = self.make_key(request)
+        entry = self.backend.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > time.time():
+                self.hits += 1
+                return True, copy.deepcopy(value)
+            self.backend.delete(key)
+
+        self.misses += 1
+        return False, None
+
+    def set(self, request: dict, value: Any, ttl: float = DEFAULT_TTL):
+        """Store the response of a request for ttl seconds"""
+        self.backend.set(self.make_key(request), time.time() + ttl, copy.deepcopy(value))
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self.backend),
+        }
+
+
+_caches: Dict[tuple, ResponseCache] = {}
+_caches_lock = threading.Lock()
+
+
+def register_cache_backend(name: str, backend_class):
+    """Register a custom backend. It must implement get, set, delete, clear and __len__"""
+    CACHE_BACKENDS[name] = backend_class
+
+
+def get_response_cache(
+    backend: str = "memory",
+    max_entries: int = DEFAULT_MAX_ENTRIES,
+    path: str = DEFAULT_DISK_PATH,
+) -> ResponseCache:
+    """Return the shared cache for the given backend settings, creating it if needed"""
+
+    key = (backend, max_entries, path if backend != "memory" else None)
+    cache = _caches.get(key)
+    if cache is not None:
+        return cache
+
+    with _caches_lock:
+        cache = _caches.get(key)
+        if cache is None:
+            if backend not in CACHE_BACKENDS:
+                raise ValueError(f"{backend} is not a valid cache backend.")
+            cache = ResponseCache(CACHE_BACKENDS[backend](max_entries=max_entries, path=path))
+            _caches[key] = cache
+        return cache
+
+
+def get_cache_stats() -> dict:
+    """Return the hit/miss counters of every cache"""
+    return {f"{key[0]}:{key[1]}": cache.stats() for key, cache in list(_caches.items())}
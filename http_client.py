@@ -0,0 +1,134 @@
+import threading
+from typing import TYPE_CHECKING, Dict, Optional
+from urllib.parse import urlsplit
+
+if TYPE_CHECKING:
+    import requests
+
+"""
+Shared http connection pool used by the http blocks.
+
+Each host gets its own keep-alive requests.Session, so consecutive requests to the
+same API reuse the open TCP/TLS connection instead of opening a new one. The
+connection settings can be set per block inside the "options" of the flow json
+(requests is only imported when the first session is created):
+
+"options": {
+    "method": "POST",
+    "url": "https://api.openai.com/v1/chat/completions",
+    "timeout": 20,          # seconds to wait for the server (default 30)
+    "retries": 2,           # retries on connection errors and 429/5xx answers (default 0)
+    "backoff_factor": 0.5,  # sleep between retries: backoff_factor * 2 ** (retry - 1)
+    "max_connections": 10   # open connections to the host kept for reuse (default 10)
+}
+
+The pool doesn't block: when more than max_connections requests to a host run at once,
+the extra ones open their own connection, closed after use, instead of waiting for a
+free one with no bound (the block timeout doesn't cover that wait).
+"""
+
+DEFAULT_TIMEOUT = 30
+DEFAULT_RETRIES = 0
+DEFAULT_BACKOFF_FACTOR = 0.5
+DEFAULT_MAX_CONNECTIONS = 10
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class HTTPClientPool:
+    """Keeps one keep-alive session per host and connection settings"""
+
+    def __init__(self):
+        self._sessions: Dict[tuple, "requests.Session"] = {}
+        self._lock = threading.Lock()
+
+    def get_session(
+        self,
+        url: str,
+        retries: int = DEFAULT_RETRIES,
+        backoff_factor: float = DEFAULT_BACKOFF_FACTOR,
+        max_connections: int = DEFAULT_MAX_CONNECTIONS,
+    ) -> "requests.Session":
+        """Return the shared session for the host of the url, creating it if needed"""
+
+        parts = urlsplit(url)
+        key = (f"{parts.scheme}://{parts.netloc}", retries, backoff_factor, max_connections)
+
+        session = self._sessions.get(key)
+        if session is not None:
+            return session
+
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+                from urllib3.util.retry import Retry
+
+                adapter = HTTPAdapter(
+                    pool_connections=1,
+                    pool_maxsize=max_connections,
+                    pool_block=False,
+                    max_retries=Retry(
+                        total=retries,
+                        backoff_factor=backoff_factor,
+                        status_forcelist=RETRY_STATUSES,
+                        allowed_methods=None,
+                        raise_on_status=False,
+                    ),
+                )
+                session = requests.Session()
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                self._sessions[key] = session
+            return session
+
+    def request(
+        self,
+        method: str,
+        url: str,
+        timeout: Optional[float] = DEFAULT_TIMEOUT,
+        retries: int = DEFAULT_RETRIES,
+        backoff_factor: float = DEFAULT_BACKOFF_FACTOR,
+        max_connections: int = DEFAULT_MAX_CONNECTIONS,
+        **kwargs,
+    ) -> "requests.Response":
+        """Send a request through the pooled session of its host"""
+
+        session = self.get_session(url, retries, backoff_factor, max_connections)
+        return session.request(method=method, url=url, timeout=timeout, **kwargs)
+
+    def stats(self) -> dict:
+        """
+        Return the requests sent and the connections opened for each host.
+        'reused' is the number of requests that were sent on an already open connection.
+        """
+
+        hosts = {}
+        with self._lock:
+            sessions = list(self._sessions.items())
+
+        for key, session in sessions:
+            host_stats = hosts.setdefault(key[0], {"requests": 0, "connections": 0, "reused": 0})
+            adapter = session.get_adapter(key[0])
+            pools = adapter.poolmanager.pools
+            for pool_key in pools.keys():
+                pool = pools.get(pool_key)
+                if pool is None:
+                    continue
+                host_stats["requests"] += pool.num_requests
+                host_stats["connections"] += pool.num_connections
+
+        for host_stats in hosts.values():
+            host_stats["reused"] = max(host_stats["requests"] - host_stats["connections"], 0)
+
+        return hosts
+
+    def close(self):
+        """Close every open connection"""
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+
+
+http_pool = HTTPClientPool()
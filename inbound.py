@@ -0,0 +1,223 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+from schemas import Message
+from timers import TimerHeap
+
+"""
+Pre-processing of the inbound messages, before they run through their flows.
+
+Deduplication: providers like Twilio deliver the same webhook again when they don't
+get an answer in time. DedupeIndex remembers the provider ids (message.message_id) of
+the messages received in the last `ttl` seconds, up to `max_entries` ids, and the
+messages it already saw are dropped.
+
+Coalescing: users often answer with several short messages in a row ("hi", "I need
+help", "with my order"). With a debounce window, Coalescer holds the messages of a
+conversation until it's quiet for `window` seconds (or `max_wait` seconds passed since
+the first one) and joins them in a single message, one line per message. The flow
+runs once and the waiting send_and_reply block gets the whole answer, instead of
+continuing with the first fragment and restarting the flow with the others.
+
+    processor = InboundProcessor(
+        handler=lambda message: store.run_flow(store.load_for_message(message), message.content),
+        dedupe=DedupeIndex(ttl=600),
+        coalescer=Coalescer(window=2),
+    )
+    processor.receive(message)     # for every webhook
+    processor.run_due()            # periodically, waiting processor.seconds_to_next()
+
+The InboundRouter workers do this on their own with its dedupe_ttl and
+coalesce_window options.
+"""
+
+DEFAULT_DEDUPE_TTL = 600
+DEFAULT_MAX_ENTRIES = 100_000
+DEFAULT_WINDOW = 1.5
+DEFAULT_MAX_WAIT = 5.0
+
+
+class DedupeIndex:
+    """The ids seen in the last `ttl` seconds, at most `max_entries` of them"""
+
+    def __init__(self, ttl: float = DEFAULT_DEDUPE_TTL, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # id -> time it was seen. Insertion order is time order, so the oldest ids are first
+        self._seen: "OrderedDict[str, float]" = OrderedDict()
+
+    def seen(self, message_id: str, now: Optional[float] = None) -> bool:
+        """Whether the id was already seen. Remembers it if it wasn't"""
+
+        now = now if now is not None else time.monotonic()
+        self._expire(now)
+        if message_id in self._seen:
+            return True
+
+        self._seen[message_id] = now
+        if len(self._seen) > self.max_entries:
+            self._seen.popitem(last=False)
+        return False
+
+    def _expire(self, now: float):
+        seen = self._seen
+        limit = now - self.ttl
+        while seen:
+            message_id, seen_at = next(iter(seen.items()))
+            if seen_at > limit:
+                return
+            del seen[message_id]
+
+    def __len__(self):
+        return len(self._seen)
+
+    def __contains__(self, message_id):
+        return message_id in self._seen
+
+
+class _Burst:
+    """The messages of a conversation waiting to be joined"""
+
+    __slots__ = ("first_at", "messages")
+
+    def __init__(self, first_at: float):
+        self.first_at = first_at
+        self.messages: List[Message] = []
+
+
+class Coalescer:
+    """Joins the messages a conversation sends in a short time into a single message"""
+
+    def __init__(self, window: float = DEFAULT_WINDOW, max_wait: float = DEFAULT_MAX_WAIT, separator: str = "\n"):
+        """
+        window: seconds without new messages after which the burst is released.
+        max_wait: the burst is released at most this many seconds after its first message.
+        """
+        self.window = window
+        self.max_wait = max_wait
+        self.separator = separator
+        self._bursts: Dict[Tuple[str, str], _Burst] = {}
+        self._timers = TimerHeap()
+
+    def add(self, message: Message, now: Optional[float] = None):
+        """Hold the message until its conversation is quiet"""
+
+        now = now if now is not None else time.monotonic()
+        key = (message.to, message.from_)
+        burst = self._bursts.get(key)
+        if burst is None:
+            burst = self._bursts[key] = _Burst(now)
+        burst.messages.append(message)
+        self._timers.schedule(key, min(now + self.window, burst.first_at + self.max_wait))
+
+    def seconds_to_next(self, now: Optional[float] = None) -> Optional[float]:
+        """Seconds until the next burst is released, or None if nothing is held"""
+
+        deadline = self._timers.next_deadline()
+        if deadline is None:
+            return None
+        return max(deadline - (now if now is not None else time.monotonic()), 0)
+
+    def pop_due(self, now: Optional[float] = None) -> List[Message]:
+        """The joined messages of the conversations that are quiet now"""
+
+        now = now if now is not None else time.monotonic()
+        return [self._join(self._bursts.pop(key)) for key in self._timers.pop_due(now)]
+
+    def pop_all(self) -> List[Message]:
+        """The joined messages of every held conversation"""
+
+        messages = [self._join(burst) for burst in self._bursts.values()]
+        self._bursts.clear()
+        self._timers = TimerHeap()
+        return messages
+
+    def _join(self, burst: _Burst) -> Message:
+        messages = burst.messages
+        if len(messages) == 1:
+            return messages[0]
+        last = messages[-1]
+        return last.model_copy(update={"content": self.separator.join(message.content for message in messages)})
+
+    def __len__(self):
+        return len(self._bursts)
+
+
+class InboundProcessor:
+    """Deduplicates and coalesces the inbound messages before calling the handler"""
+
+    def __init__(
+        self,
+        handler: Callable[[Message], None],
+        dedupe: Optional[DedupeIndex] = None,
+        coalescer: Optional[Coalescer] = None,
+    ):
+        self.handler = handler
+        self.dedupe = dedupe
+        self.coalescer = coalescer
+        self._lock = threading.Lock()
+        self.received = 0
+        self.duplicates = 0
+        self.handled = 0
+
+    def receive(self, message: Message, now: Optional[float] = None) -> bool:
+        """Process an inbound message. Returns False if it was dropped as a duplicate"""
+
+        with self._lock:
+            self.received += 1
+            if self.dedupe is not None and message.message_id is not None and self.dedupe.seen(message.message_id, now):
+                self.duplicates += 1
+                logging.debug("dropping the duplicated message %s", message.message_id)
+                return False
+            if self.coalescer is not None:
+                self.coalescer.add(message, now)
+                return True
+
+        self._handle(message)
+        return True
+
+    def seconds_to_next(self, now: Optional[float] = None) -> Optional[float]:
+        if self.coalescer is None:
+            return None
+        with self._lock:
+            return self.coalescer.seconds_to_next(now)
+
+    def run_due(self, now: Optional[float] = None) -> int:
+        """Handle the coalesced messages that are due. Returns how many were handled"""
+
+        if self.coalescer is None:
+            return 0
+        with self._lock:
+            messages = self.coalescer.pop_due(now)
+        for message in messages:
+            self._handle(message)
+        return len(messages)
+
+    def flush(self) -> int:
+        """Handle every held message now, like before a shutdown"""
+
+        if self.coalescer is None:
+            return 0
+        with self._lock:
+            messages = self.coalescer.pop_all()
+        for message in messages:
+            self._handle(message)
+        return len(messages)
+
+    def stats(self) -> dict:
+        return {
+            "received": self.received,
+            "duplicates": self.duplicates,
+            "handled": self.handled,
+            "held": len(self.coalescer) if self.coalescer is not None else 0,
+        }
+
+    def _handle(self, message: Message):
+        self.handled += 1
+        try:
+            self.handler(message)
+        except Exception as e:
+            logging.error(f"Error handling message from {message.from_}: {e}")
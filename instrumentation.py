@@ -0,0 +1,183 @@
+import bisect
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+"""
+Instrumentation of the flow execution.
+
+Hooks are objects with on_block_start(flow, block, action) and
+on_block_end(flow, block, action, duration, error) methods. action is "run" or
+"continue", duration is in seconds and error is the exception raised by the block, if any.
+When no hook is registered the flows don't even read the clock. A hook can also define
+a coroutine aon_block_start(flow, block, action), awaited instead of on_block_start by
+arun_flow, when it has to wait for something (like a disk write) before the block runs.
+
+FlowStats is a ready to use hook that keeps, per block type, a latency histogram
+and the counts of runs, continues and failures. It can export them in the
+Prometheus text format:
+
+    stats = FlowStats()
+    add_hook(stats)
+    ...
+    stats.snapshot()             # dict with the counters and histograms
+    stats.export_prometheus()    # text for a /metrics endpoint
+"""
+
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+hooks: list = []
+
+
+def add_hook(hook):
+    """Register a hook. It is called around every block run of every flow"""
+    if hook not in hooks:
+        hooks.append(hook)
+
+
+def remove_hook(hook):
+    if hook in hooks:
+        hooks.remove(hook)
+
+
+def block_started(flow, block, action: str) -> Optional[float]:
+    """Notify the hooks that a block started. Returns the start time, or None without hooks"""
+
+    if not hooks:
+        return None
+    for hook in hooks:
+        hook.on_block_start(flow, block, action)
+    return time.perf_counter()
+
+
+async def ablock_started(flow, block, action: str) -> Optional[float]:
+    """Same as block_started, awaiting the aon_block_start of the hooks that have one"""
+
+    if not hooks:
+        return None
+    for hook in hooks:
+        on_block_start = getattr(hook, "aon_block_start", None)
+        if on_block_start is not None:
+            await on_block_start(flow, block, action)
+        else:
+            hook.on_block_start(flow, block, action)
+    return time.perf_counter()
+
+
+def block_ended(flow, block, action: str, started: Optional[float], error: Optional[Exception] = None):
+    """Notify the hooks that a block finished"""
+
+    if started is None:
+        return
+    duration = time.perf_counter() - started
+    for hook in hooks:
+        hook.on_block_end(flow, block, action, duration, error)
+
+
+class Histogram:
+    """A cumulative histogram with fixed buckets, like the Prometheus ones"""
+
+    __slots__ = ("buckets", "counts", "count", "sum")
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """Approximate quantile: the upper bound of the bucket holding it"""
+
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return self.buckets[index] if index < len(self.buckets) else float("inf")
+        return float("inf")
+
+    def to_dict(self) -> dict:
+        cumulative = []
+        seen = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            seen += count
+            cumulative.append((bound, seen))
+        return {"count": self.count, "sum": self.sum, "buckets": cumulative}
+
+
+class FlowStats:
+    """In-process block statistics, grouped by block type"""
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._histograms: Dict[str, Histogram] = {}
+        self._counters: Dict[Tuple[str, str], int] = {}
+        self._lock = threading.Lock()
+
+    def on_block_start(self, flow, block, action: str):
+        pass
+
+    def on_block_end(self, flow, block, action: str, duration: float, error: Optional[Exception] = None):
+        block_type = type(block).__name__
+        failed = error is not None or getattr(block.status, "value", block.status) == "failed"
+
+        with self._lock:
+            histogram = self._histograms.get(block_type)
+            if histogram is None:
+                histogram = self._histograms[block_type] = Histogram(self.buckets)
+            histogram.observe(duration)
+
+            key = (block_type, action)
+            self._counters[key] = self._counters.get(key, 0) + 1
+            if failed:
+                key = (block_type, "failure")
+                self._counters[key] = self._counters.get(key, 0) + 1
+
+    def snapshot(self) -> dict:
+        """Return the counters and histograms as a dict"""
+
+        with self._lock:
+            result = {}
+            for block_type, histogram in self._histograms.items():
+                result[block_type] = {
+                    "runs": self._counters.get((block_type, "run"), 0),
+                    "continues": self._counters.get((block_type, "continue"), 0),
+                    "failures": self._counters.get((block_type, "failure"), 0),
+                    "p50": histogram.quantile(0.5),
+                    "p99": histogram.quantile(0.99),
+                    "duration": histogram.to_dict(),
+                }
+            return result
+
+    def export_prometheus(self, prefix: str = "flow") -> str:
+        """Return the stats in the Prometheus text exposition format"""
+
+        lines: List[str] = []
+        with self._lock:
+            lines.append(f"# HELP {prefix}_block_duration_seconds Time spent running a block.")
+            lines.append(f"# TYPE {prefix}_block_duration_seconds histogram")
+            for block_type, histogram in sorted(self._histograms.items()):
+                for bound, count in histogram.to_dict()["buckets"]:
+                    le = "+Inf" if bound == float("inf") else repr(float(bound))
+                    lines.append(f'{prefix}_block_duration_seconds_bucket{{block_type="{block_type}",le="{le}"}} {count}')
+                lines.append(f'{prefix}_block_duration_seconds_sum{{block_type="{block_type}"}} {histogram.sum}')
+                lines.append(f'{prefix}_block_duration_seconds_count{{block_type="{block_type}"}} {histogram.count}')
+
+            lines.append(f"# HELP {prefix}_block_executions_total Block runs, continues and failures.")
+            lines.append(f"# TYPE {prefix}_block_executions_total counter")
+            for (block_type, kind), count in sorted(self._counters.items()):
+                lines.append(f'{prefix}_block_executions_total{{block_type="{block_type}",kind="{kind}"}} {count}')
+
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
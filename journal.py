@@ -0,0 +1,741 @@
+import contextvars
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import msgpack
+
+from blocks.basicBlock import BaseMessageBlock
+from blocks.set_variables_block import SetVariablesBlock
+from flow_serialization import dumps_flow, loads_flow
+from instrumentation import add_hook, remove_hook
+from message_channels.channels_factory import get_channel
+from schemas import Message
+from state_store import FlowStateStore
+
+"""
+Write-ahead journal of the conversations.
+
+Journal is an append-only log split in segment files. Every record gets a sequence
+number (lsn) and is checksummed, so a record torn by a crash is detected and cut off
+when the journal is opened again. Appends are buffered and a flusher thread writes
+and fsyncs them in groups: every writer waiting for its records to be durable shares
+the same fsync (group commit).
+
+JournaledStateStore puts the journal in front of any state store. Running a flow
+through it journals what happens:
+
+    run         an inbound event (the user reply) and the state of the flow before it
+    block       a block started (name, run/continue)
+    send        a message is about to be delivered, with its idempotency key
+    queued      the message was queued on the outbound dispatcher, with its content
+    sent        the message was delivered
+    variables   a set_variables block set the flow variables
+    state       the state of the flow after the run (closes the run)
+    abort       the run raised an exception (closes the run)
+    delete      the flow was deleted
+
+Saving a flow only appends its state to the journal and waits for the group commit.
+The states are written to the inner store in a checkpoint, every `checkpoint_every`
+saves or when checkpoint() is called, and the segments the checkpoint made useless
+are deleted. Until then the store reads the newest states from memory.
+
+    store = JournaledStateStore(SQLiteStateStore("conversations.sqlite3"), "journal")
+    store.recover()                          # at startup, after a crash
+    flow = store.load_for_message(message)
+    store.run_flow(flow, message.content)    # journaled run and save
+
+The run record is on the disk before the flow runs, and the send record of a message
+before the message is delivered, so nothing a run does is lost in a crash.
+
+recover() rebuilds the state from the last checkpoint (the snapshots of the inner
+store) plus the journal tail, and runs again the runs that were interrupted by the
+crash. Every message a run sends has an idempotency key (flow, run and the block
+occurrence in the run), so the messages delivered before the crash are not sent again.
+A message with a send record and no sent record was being delivered when the process
+crashed: it may or may not have reached the user. It is sent again (at least once
+delivery) and logged as a warning.
+
+With an outbound dispatcher (see dispatcher.py) the block only queues its message, and
+the run may end before it's delivered. The sent record is written when the dispatcher
+reports the delivery. Until then the queued record keeps the message, the checkpoints
+don't drop it, and recover() sends again the queued messages of the finished runs.
+
+Each store journals only the runs started through it, so several stores (with their
+own directories) can be used in the same process.
+"""
+
+DEFAULT_SEGMENT_BYTES = 64 * 1024 * 1024
+DEFAULT_CHECKPOINT_EVERY = 10000
+SEGMENT_SUFFIX = ".wal"
+CHECKPOINT_FILE = "checkpoint"
+
+RUN = "run"
+BLOCK = "block"
+SEND = "send"
+QUEUED = "queued"
+SENT = "sent"
+VARIABLES = "variables"
+STATE = "state"
+ABORT = "abort"
+DELETE = "delete"
+
+# record header: payload length and crc32 of the payload
+_HEADER = struct.Struct("<II")
+
+
+class JournalRecord:
+    __slots__ = ("lsn", "kind", "flow_id", "timestamp", "data")
+
+    def __init__(self, lsn: int, kind: str, flow_id: str, timestamp: float, data):
+        self.lsn = lsn
+        self.kind = kind
+        self.flow_id = flow_id
+        self.timestamp = timestamp
+        self.data = data
+
+    def __repr__(self):
+        return f"JournalRecord({self.lsn}, {self.kind!r}, {self.flow_id!r})"
+
+
+def _segment_name(first_lsn: int) -> str:
+    return f"{first_lsn:020d}{SEGMENT_SUFFIX}"
+
+
+def _read_segment(path: str) -> Iterator[Tuple[int, JournalRecord]]:
+    """(end offset, record) of the valid records of a segment. Stops at the first torn record"""
+
+    with open(path, "rb") as file:
+        data = file.read()
+
+    offset = 0
+    while offset + _HEADER.size <= len(data):
+        length, checksum = _HEADER.unpack_from(data, offset)
+        start = offset + _HEADER.size
+        payload = data[start:start + length]
+        if len(payload) < length or zlib.crc32(payload) != checksum:
+            return
+        offset = start + length
+        yield offset, JournalRecord(*msgpack.unpackb(payload, raw=False, strict_map_key=False))
+
+
+class Journal:
+    """Append-only, segmented log with group commit"""
+
+    def __init__(
+        self,
+        directory: str,
+        segment_bytes: int = DEFAULT_SEGMENT_BYTES,
+        fsync: bool = True,
+        commit_delay: float = 0.0,
+    ):
+        """
+        segment_bytes: size after which a new segment file is started.
+        fsync: sync the segment to the disk on every commit. Without it a commit only
+            reaches the OS, which survives a crash of the process but not of the machine.
+        commit_delay: seconds the flusher waits for more records before writing a group.
+        """
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.fsync = fsync
+        self.commit_delay = commit_delay
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._has_records = threading.Condition(self._lock)
+        self._flushed = threading.Condition(self._lock)
+        self._buffer: List[Tuple[int, bytes]] = []
+        self._waiters: list = []  # (lsn, loop, future) of the async commits
+        self._error: Optional[BaseException] = None
+        self._closing = False
+
+        self._segments = sorted(
+            int(name[:-len(SEGMENT_SUFFIX)])
+            for name in os.listdir(directory)
+            if name.endswith(SEGMENT_SUFFIX)
+        )
+        self._last_lsn = self._open_last_segment()
+        self._durable_lsn = self._last_lsn
+
+        self._thread = threading.Thread(target=self._flush_loop, name="journal_flusher", daemon=True)
+        self._thread.start()
+
+    @property
+    def last_lsn(self) -> int:
+        return self._last_lsn
+
+    def append(self, kind: str, flow_id: str, data=None) -> int:
+        """Add a record to the journal. Returns its lsn. It's durable after commit(lsn)"""
+
+        with self._lock:
+            if self._closing:
+                raise RuntimeError("The journal is closed")
+            self._last_lsn += 1
+            lsn = self._last_lsn
+            payload = msgpack.packb([lsn, kind, flow_id, time.time(), data], default=str, use_bin_type=True)
+            self._buffer.append((lsn, _HEADER.pack(len(payload), zlib.crc32(payload)) + payload))
+            self._has_records.notify()
+        return lsn
+
+    def commit(self, lsn: Optional[int] = None):
+        """Wait until the records up to lsn (by default all of them) are on the disk"""
+
+        with self._lock:
+            lsn = self._last_lsn if lsn is None else lsn
+            while self._durable_lsn < lsn and self._error is None:
+                self._flushed.wait()
+            if self._error is not None:
+                raise self._error
+
+    async def acommit(self, lsn: Optional[int] = None):
+        """Same as commit, without blocking the event loop"""
+
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            lsn = self._last_lsn if lsn is None else lsn
+            if self._error is not None:
+                raise self._error
+            if self._durable_lsn >= lsn:
+                return
+            future = loop.create_future()
+            self._waiters.append((lsn, loop, future))
+        await future
+
+    def read(self, from_lsn: int = 1) -> Iterator[JournalRecord]:
+        """The records on the disk with lsn >= from_lsn, in order"""
+
+        with self._lock:
+            segments = list(self._segments)
+
+        for position, first_lsn in enumerate(segments):
+            # skip the segments that end before from_lsn
+            if position + 1 < len(segments) and segments[position + 1] <= from_lsn:
+                continue
+            path = os.path.join(self.directory, _segment_name(first_lsn))
+            try:
+                records = list(_read_segment(path))
+            except FileNotFoundError:
+                continue  # removed by a checkpoint
+            for _, record in records:
+                if record.lsn >= from_lsn:
+                    yield record
+
+    def truncate(self, before_lsn: int):
+        """Delete the segments that only hold records older than before_lsn"""
+
+        with self._lock:
+            removable = [
+                first_lsn
+                for first_lsn, next_lsn in zip(self._segments, self._segments[1:])
+                if next_lsn <= before_lsn
+            ]
+            self._segments = self._segments[len(removable):]
+
+        for first_lsn in removable:
+            try:
+                os.remove(os.path.join(self.directory, _segment_name(first_lsn)))
+            except FileNotFoundError:
+                pass
+
+    def close(self):
+        """Write the pending records and stop the flusher"""
+
+        with self._lock:
+            self._closing = True
+            self._has_records.notify()
+        self._thread.join()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _open_last_segment(self) -> int:
+        """Open the last segment for appending, cutting a torn record at its end. Returns the last lsn"""
+
+        self._file = None
+        self._file_size = 0
+        if not self._segments:
+            return 0
+
+        path = os.path.join(self.directory, _segment_name(self._segments[-1]))
+        last_lsn, valid_bytes = self._segments[-1] - 1, 0
+        for valid_bytes, record in _read_segment(path):
+            last_lsn = record.lsn
+
+        if valid_bytes < os.path.getsize(path):
+            logging.warning(f"journal segment {path}: cutting a torn record at byte {valid_bytes}")
+            with open(path, "r+b") as file:
+                file.truncate(valid_bytes)
+
+        self._file = open(path, "ab")
+        self._file_size = valid_bytes
+        return last_lsn
+
+    def _flush_loop(self):
+        while True:
+            with self._lock:
+                while not self._buffer and not self._closing:
+                    self._has_records.wait()
+                if not self._buffer:
+                    return
+
+            if self.commit_delay:
+                time.sleep(self.commit_delay)
+
+            with self._lock:
+                batch, self._buffer = self._buffer, []
+
+            try:
+                self._write(batch)
+            except BaseException as e:
+                logging.error(f"Error writing the journal: {e}")
+                with self._lock:
+                    self._error = e
+                    self._flushed.notify_all()
+                    self._wake_waiters()
+                return
+
+            with self._lock:
+                self._durable_lsn = batch[-1][0]
+                self._flushed.notify_all()
+                self._wake_waiters()
+
+    def _write(self, batch: List[Tuple[int, bytes]]):
+        if self._file is None or self._file_size >= self.segment_bytes:
+            self._rotate(batch[0][0])
+
+        data = b"".join(record for _, record in batch)
+        self._file.write(data)
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        self._file_size += len(data)
+
+    def _rotate(self, first_lsn: int):
+        if self._file is not None:
+            self._file.close()
+        self._file = open(os.path.join(self.directory, _segment_name(first_lsn)), "ab")
+        self._file_size = 0
+        with self._lock:
+            self._segments.append(first_lsn)
+
+    def _wake_waiters(self):
+        """Resolve the async commits that are durable now. Called with the lock held"""
+
+        waiting = []
+        for lsn, loop, future in self._waiters:
+            if self._error is None and lsn > self._durable_lsn:
+                waiting.append((lsn, loop, future))
+            else:
+                loop.call_soon_threadsafe(_resolve, future, self._error)
+        self._waiters = waiting
+
+
+def _resolve(future, error):
+    if future.done():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(None)
+
+
+class _Run:
+    """A flow run in progress"""
+
+    __slots__ = ("flow_id", "lsn", "delivered", "in_doubt", "occurrences", "send_key")
+
+    def __init__(
+        self,
+        flow_id: str,
+        lsn: int,
+        delivered: Optional[Dict[str, str]] = None,
+        in_doubt: Optional[set] = None,
+    ):
+        self.flow_id = flow_id
+        self.lsn = lsn
+        self.delivered = delivered or {}  # idempotency key -> content, of the messages sent before a crash
+        self.in_doubt = in_doubt or set()  # keys of the messages that were being sent when it crashed
+        self.occurrences: Dict[str, int] = {}
+        self.send_key: Optional[str] = None
+
+    def next_send_key(self, block_name: str) -> str:
+        """The idempotency key of the next message of a block. A block can send more than once in a run"""
+
+        occurrence = self.occurrences.get(block_name, 0)
+        self.occurrences[block_name] = occurrence + 1
+        return f"{self.flow_id}:{self.lsn}:{block_name}:{occurrence}"
+
+
+class JournaledStateStore(FlowStateStore):
+    """A state store that journals the runs and saves, and writes to the inner store in checkpoints"""
+
+    def __init__(
+        self,
+        store: FlowStateStore,
+        directory: str = "flow_journal",
+        checkpoint_every: int = DEFAULT_CHECKPOINT_EVERY,
+        **journal_options,
+    ):
+        """
+        store: the store that keeps the snapshots, written on every checkpoint.
+        checkpoint_every: saves between automatic checkpoints. 0 disables them.
+        journal_options: segment_bytes, fsync and commit_delay of the Journal.
+        """
+        self.store = store
+        self.directory = directory
+        self.checkpoint_every = checkpoint_every
+        self.journal = Journal(directory, **journal_options)
+
+        self._lock = threading.RLock()
+        # states saved since the last checkpoint: flow_id -> (from_, to, data, wake_at), None when deleted
+        self._dirty: Dict[str, Optional[tuple]] = {}
+        self._dirty_participants: Dict[Tuple[str, str], str] = {}
+        # states being written by a checkpoint, still read from memory
+        self._checkpointing: Dict[str, Optional[tuple]] = {}
+        self._checkpoint_running = False
+        self._checkpointing_participants: Dict[Tuple[str, str], str] = {}
+        self._open_runs: Dict[int, str] = {}  # lsn of the run record -> flow_id
+        self._queued: Dict[str, int] = {}  # idempotency key -> lsn, of the messages waiting for their delivery
+        self._saves = 0
+        # the run of this store in progress in the current thread or task. The hooks are
+        # called for every flow, and only journal the runs of their own store
+        self._current_run: contextvars.ContextVar = contextvars.ContextVar(f"journal_run_{id(self)}", default=None)
+        add_hook(self)
+
+    def run_flow(self, flow, event=None):
+        run = self._start_run(flow, event)
+        self.journal.commit(run.lsn)
+        token = self._current_run.set(run)
+        try:
+            flow.run_flow(event)
+        except Exception:
+            self._abort_run(run)
+            raise
+        finally:
+            self._current_run.reset(token)
+        lsn, checkpoint = self._save(flow, run)
+        self.journal.commit(lsn)
+        if checkpoint:
+            self.checkpoint()
+
+    async def arun_flow(self, flow, event=None):
+        import asyncio
+
+        run = self._start_run(flow, event)
+        await self.journal.acommit(run.lsn)
+        token = self._current_run.set(run)
+        try:
+            await flow.arun_flow(event)
+        except Exception:
+            self._abort_run(run)
+            raise
+        finally:
+            self._current_run.reset(token)
+        lsn, checkpoint = self._save(flow, run)
+        await self.journal.acommit(lsn)
+        if checkpoint:
+            await asyncio.to_thread(self.checkpoint)
+
+    def save(self, flow):
+        lsn, checkpoint = self._save(flow)
+        self.journal.commit(lsn)
+        if checkpoint:
+            self.checkpoint()
+
+    def _start_run(
+        self,
+        flow,
+        event,
+        lsn: Optional[int] = None,
+        delivered: Optional[dict] = None,
+        in_doubt: Optional[set] = None,
+    ) -> _Run:
+        """Journal the run record (not committed yet). A run being recovered keeps its lsn"""
+
+        if lsn is None:
+            if event is not None and not isinstance(event, str):
+                event = str(event)
+            lsn = self.journal.append(RUN, flow.flow_id, [event, dumps_flow(flow)])
+        with self._lock:
+            self._open_runs[lsn] = flow.flow_id
+        return _Run(flow.flow_id, lsn, delivered, in_doubt)
+
+    def _abort_run(self, run: _Run):
+        self.journal.append(ABORT, run.flow_id, run.lsn)
+        with self._lock:
+            self._open_runs.pop(run.lsn, None)
+
+    def _save(self, flow, run: Optional[_Run] = None) -> Tuple[int, bool]:
+        """
+        Journal the state of the flow and keep it until the next checkpoint. Returns the lsn
+        to commit and whether a checkpoint is due, for the caller to run it once committed
+        """
+
+        entry = (flow.from_, flow.to, dumps_flow(flow), flow.wait_deadline)
+        with self._lock:
+            lsn = self.journal.append(STATE, flow.flow_id, list(entry))
+            self._dirty[flow.flow_id] = entry
+            self._dirty_participants[(flow.from_, flow.to)] = flow.flow_id
+            if run is not None:
+                self._open_runs.pop(run.lsn, None)
+            self._saves += 1
+            checkpoint = self.checkpoint_every and self._saves >= self.checkpoint_every
+            if checkpoint:
+                self._saves = 0
+        return lsn, bool(checkpoint)
+
+    def put_snapshot(self, flow_id, from_, to, data, wake_at=None):
+        entry = (from_, to, data, wake_at)
+        with self._lock:
+            lsn = self.journal.append(STATE, flow_id, list(entry))
+            self._dirty[flow_id] = entry
+            self._dirty_participants[(from_, to)] = flow_id
+        self.journal.commit(lsn)
+
+    def _pending(self, flow_id: str):
+        """(found, entry) of a state saved since the last checkpoint"""
+        with self._lock:
+            for states in (self._dirty, self._checkpointing):
+                if flow_id in states:
+                    return True, states[flow_id]
+        return False, None
+
+    def get_snapshot(self, flow_id):
+        found, entry = self._pending(flow_id)
+        if found:
+            return entry[2] if entry is not None else None
+        return self.store.get_snapshot(flow_id)
+
+    def get_snapshot_by_participants(self, from_, to):
+        with self._lock:
+            flow_id = self._dirty_participants.get((from_, to)) or self._checkpointing_participants.get((from_, to))
+        if flow_id is not None:
+            found, entry = self._pending(flow_id)
+            if found:
+                return entry[2] if entry is not None else None
+        return self.store.get_snapshot_by_participants(from_, to)
+
+    def get_deadlines(self):
+        with self._lock:
+            pending = {**self._checkpointing, **self._dirty}
+        deadlines = [deadline for deadline in self.store.get_deadlines() if deadline[0] not in pending]
+        for flow_id, entry in pending.items():
+            if entry is not None and entry[3] is not None:
+                deadlines.append((flow_id, entry[0], entry[1], entry[3]))
+        return deadlines
+
+    def delete_snapshot(self, flow_id):
+        with self._lock:
+            lsn = self.journal.append(DELETE, flow_id)
+            self._dirty[flow_id] = None
+        self.journal.commit(lsn)
+
+    def checkpoint(self):
+        """Write the states saved since the last checkpoint to the inner store and drop the old segments"""
+
+        with self._lock:
+            if self._checkpoint_running:
+                return  # another checkpoint is running, in another thread
+            self._checkpoint_running = True
+            checkpoint_lsn = self.journal.last_lsn
+            self._checkpointing, self._dirty = self._dirty, {}
+            self._checkpointing_participants, self._dirty_participants = self._dirty_participants, {}
+            # the runs still open are replayed from their run record, and the queued
+            # messages are kept until they are delivered
+            replay_from = min(
+                min(self._open_runs, default=checkpoint_lsn + 1),
+                min(self._queued.values(), default=checkpoint_lsn + 1),
+            )
+
+        try:
+            self.journal.commit(checkpoint_lsn)
+            for flow_id, entry in self._checkpointing.items():
+                if entry is None:
+                    self.store.delete_snapshot(flow_id)
+                else:
+                    self.store.put_snapshot(flow_id, *entry)
+            self._write_checkpoint(replay_from)
+            self.journal.truncate(replay_from)
+        except Exception:
+            # keep the states in memory, the next checkpoint writes them
+            with self._lock:
+                self._dirty = {**self._checkpointing, **self._dirty}
+                self._dirty_participants = {**self._checkpointing_participants, **self._dirty_participants}
+            raise
+        finally:
+            with self._lock:
+                self._checkpointing = {}
+                self._checkpointing_participants = {}
+                self._checkpoint_running = False
+
+    def recover(self) -> list:
+        """
+        Apply the journal tail after a restart: the saved states are written to the inner
+        store and the interrupted runs run again, without sending the messages they already
+        delivered. Returns the flows that ran again
+        """
+
+        states: Dict[str, Optional[tuple]] = {}
+        open_runs: Dict[str, list] = {}  # flow_id -> [lsn, event, state before, delivered, in doubt]
+        queued: Dict[str, JournalRecord] = {}  # idempotency key -> queued record not delivered
+        for record in self.journal.read(self._read_checkpoint()):
+            if record.kind == RUN:
+                open_runs[record.flow_id] = [record.lsn, record.data[0], record.data[1], {}, set()]
+            elif record.kind == SEND:
+                run = open_runs.get(record.flow_id)
+                if run is not None:
+                    run[4].add(record.data)
+            elif record.kind == QUEUED:
+                queued[record.data[0]] = record
+            elif record.kind == SENT:
+                queued.pop(record.data[0], None)
+                run = open_runs.get(record.flow_id)
+                if run is not None:
+                    run[3][record.data[0]] = record.data[1]
+                    run[4].discard(record.data[0])
+            elif record.kind == STATE:
+                states[record.flow_id] = tuple(record.data)
+                open_runs.pop(record.flow_id, None)
+            elif record.kind == ABORT:
+                open_runs.pop(record.flow_id, None)
+            elif record.kind == DELETE:
+                states[record.flow_id] = None
+
+        with self._lock:
+            for flow_id, entry in states.items():
+                self._dirty[flow_id] = entry
+                if entry is not None:
+                    self._dirty_participants[(entry[0], entry[1])] = flow_id
+
+        # the messages of the interrupted runs are sent again by their run
+        for run in open_runs.values():
+            for key in run[4]:
+                queued.pop(key, None)
+        for record in queued.values():
+            self._send_queued(record)
+
+        resumed = []
+        for flow_id, (lsn, event, state, delivered, in_doubt) in sorted(open_runs.items(), key=lambda item: item[1][0]):
+            logging.info(f"journal: running again the run {lsn} of flow {flow_id}, interrupted by a crash")
+            flow = loads_flow(state)
+            run = self._start_run(flow, event, lsn, delivered, in_doubt)
+            token = self._current_run.set(run)
+            try:
+                flow.run_flow(event)
+            except Exception as e:
+                logging.error(f"Error running again the run {lsn} of flow {flow_id}: {e}")
+                self._abort_run(run)
+                continue
+            finally:
+                self._current_run.reset(token)
+            self.journal.commit(self._save(flow, run)[0])
+            resumed.append(flow)
+
+        self.checkpoint()
+        return resumed
+
+    def _send_queued(self, record: JournalRecord):
+        """Send again a message that was queued on the dispatcher and not delivered before the crash"""
+
+        key, to, from_, channel, content = record.data
+        logging.warning(f"journal: message {key} was queued and not delivered when the process stopped. Sending it again")
+        try:
+            get_channel(channel).send_message(Message(to=to, from_=from_, content=content))
+        except Exception as e:
+            logging.error(f"Error sending again the queued message {key}: {e}")
+            with self._lock:
+                self._queued[key] = record.lsn  # kept for the next recovery
+            return
+        self.journal.append(SENT, record.flow_id, [key, content])
+
+    def _delivered(self, flow_id: str, key: str, content: str):
+        """The dispatcher delivered (or gave up on) a queued message"""
+
+        self.journal.append(SENT, flow_id, [key, content])
+        with self._lock:
+            self._queued.pop(key, None)
+
+    def _write_checkpoint(self, replay_from: int):
+        path = os.path.join(self.directory, CHECKPOINT_FILE)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as file:
+            file.write(str(replay_from))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, path)
+
+    def _read_checkpoint(self) -> int:
+        try:
+            with open(os.path.join(self.directory, CHECKPOINT_FILE)) as file:
+                return int(file.read().strip() or 1)
+        except FileNotFoundError:
+            return 1
+
+    def on_block_start(self, flow, block, action: str):
+        lsn = self._block_started(flow, block, action)
+        if lsn is not None:
+            self.journal.commit(lsn)
+
+    async def aon_block_start(self, flow, block, action: str):
+        lsn = self._block_started(flow, block, action)
+        if lsn is not None:
+            await self.journal.acommit(lsn)
+
+    def _block_started(self, flow, block, action: str) -> Optional[int]:
+        """Journal the block start. Returns the lsn of a send record, that must be durable before the block runs"""
+
+        run = self._current_run.get()
+        if run is None or run.flow_id != flow.flow_id:
+            return None
+
+        self.journal.append(BLOCK, run.flow_id, [block.name_in_flow, action])
+        if action != "run" or not isinstance(block, BaseMessageBlock):
+            return None
+
+        run.send_key = run.next_send_key(block.name_in_flow)
+        content = run.delivered.get(run.send_key)
+        if content is not None:
+            logging.info(f"journal: message {run.send_key} was already delivered. Not sending it again")
+            block.mark_delivered(content)
+            return None
+        if run.send_key in run.in_doubt:
+            logging.warning(f"journal: message {run.send_key} was being sent when the process stopped. Sending it again")
+        return self.journal.append(SEND, run.flow_id, run.send_key)
+
+    def on_block_end(self, flow, block, action: str, duration: float, error: Optional[Exception]):
+        run = self._current_run.get()
+        if run is None or run.flow_id != flow.flow_id or error is not None:
+            return
+
+        if isinstance(block, SetVariablesBlock):
+            self.journal.append(VARIABLES, run.flow_id, block.variables)
+        elif action == "run" and isinstance(block, BaseMessageBlock) and run.send_key is not None:
+            key, run.send_key = run.send_key, None
+            if key in run.delivered:
+                return
+            if block.delivery_status != "queued":
+                self.journal.append(SENT, run.flow_id, [key, block.outbound])
+                return
+
+            # only queued on the dispatcher: the message is kept until its delivery result
+            content = block.outbound
+            message = [key, block.to, block.from_, block.messaging_channel.value, content]
+            with self._lock:
+                self._queued[key] = self.journal.append(QUEUED, run.flow_id, message)
+            block.on_delivery(lambda result: self._delivered(run.flow_id, key, content))
+
+    def close(self):
+        """Checkpoint and close the journal"""
+
+        remove_hook(self)
+        self.checkpoint()
+        self.journal.close()
+        close = getattr(self.store, "close", None)
+        if close is not None:
+            close()
@@ -0,0 +1,29 @@
+from typing import List
+
+from pydantic import BaseModel
+
+from schemas import Message
+
+
+class BaseChannel(BaseModel):
+    """
+    Base class of the message channels. A channel is created once per channel name
+    by channels_factory.get_channel and reused for every message.
+    """
+
+    def open(self):
+        """Open the connection to the provider. Called once, before the first message"""
+        pass
+
+    def close(self):
+        """Close the connection to the provider"""
+        pass
+
+    def send_message(self, message: Message, **kwargs):
+        """Send a message to the recipient"""
+        raise NotImplementedError
+
+    async def asend_message(self, message: Message, **kwargs):
+        """Send a message to the recipient without blocking the event loop"""
+        import asyncio
+        return await asyncio.to_thread(self.send_message, message, **kwargs)
@@ -1,25 +1,99 @@
-from pydantic import BaseModel
+import logging
+import threading
+from typing import Callable, Dict, Union
 
 from schemas import Message, MessageChannels
 
+"""
+The channels registry keeps one channel object per channel name.
 
-def get_channel(channel: MessageChannels) -> BaseModel:
-    """Get the channel object based on the channel type"""
+Channels are created lazily on their first message, opened once and reused for every
+following message. close_channels() closes all of them. A channel reads its credentials
+from the settings. Another account of a provider is registered under its own name,
+with its credentials bound:
 
-    
-    if channel == MessageChannels.mock:
+register_channel("twilio_sales", functools.partial(TwilioChannel, account_sid="AC...", auth_token="..."))
+
+Third-party channels can be added with register_channel, or from an installed package
+through the "flow_control.channels" entry point group:
+
+[project.entry-points."flow_control.channels"]
+telegram = "my_package.telegram:TelegramChannel"
+"""
+
+ENTRY_POINT_GROUP = "flow_control.channels"
+
+_channel_classes: Dict[str, Callable] = {}
+_channels: Dict[str, object] = {}
+_lock = threading.Lock()
+
+
+def register_channel(name: str, channel_class: Callable):
+    """Register a channel class under a channel name"""
+    _channel_classes[name] = channel_class
+
+
+def get_channel_class(name: str) -> Callable:
+    """Return the class of a channel, importing it only when it's first needed"""
+
+    channel_class = _channel_classes.get(name)
+    if channel_class is not None:
+        return channel_class
+
+    if name == MessageChannels.mock.value:
         from message_channels.mock_channel import MockChannel
-        return MockChannel()
-    
-    if channel == MessageChannels.twilio:
+        channel_class = MockChannel
+    elif name == MessageChannels.twilio.value:
         from message_channels.twilio_channel import TwilioChannel
-        return TwilioChannel()
+        channel_class = TwilioChannel
+    else:
+        from importlib.metadata import entry_points
+        for entry_point in entry_points(group=ENTRY_POINT_GROUP):
+            if entry_point.name == name:
+                channel_class = entry_point.load()
+                break
+
+    if channel_class is None:
+        raise ValueError(f'Channel {name} is not supported')
+
+    register_channel(name, channel_class)
+    return channel_class
+
+
+def get_channel(channel: Union[MessageChannels, str]):
+    """Get the shared channel object of a channel"""
+
+    name = channel.value if isinstance(channel, MessageChannels) else channel
+
+    channel_obj = _channels.get(name)
+    if channel_obj is not None:
+        return channel_obj
+
+    with _lock:
+        channel_obj = _channels.get(name)
+        if channel_obj is None:
+            logging.debug(f"opening channel {name}")
+            channel_obj = get_channel_class(name)()
+            channel_obj.open()
+            _channels[name] = channel_obj
+        return channel_obj
+
+
+def close_channels():
+    """Close every open channel. They are opened again on their next message"""
+
+    with _lock:
+        channels = list(_channels.values())
+        _channels.clear()
 
-    raise ValueError(f'Channel {channel} is not supported')
-    
+    for channel_obj in channels:
+        try:
+            channel_obj.close()
+        except Exception as e:
+            logging.error(f"Error closing channel {channel_obj}: {e}")
 
 
 if __name__ == '__main__':
     msg = Message(content='Hello, World!', to='555-555-5555', from_='555-555-5556')
     channel = get_channel(MessageChannels.mock)
-    channel.send_message(msg)
\ No newline at end of file
+    channel.send_message(msg)
@@ -1,10 +1,20 @@
+from typing import List
+
 from schemas import Message
 
-from pydantic import BaseModel, Field
+from message_channels.base_channel import BaseChannel
 
-class MockChannel(BaseModel):
+class MockChannel(BaseChannel):
     """A mock channel for testing purposes"""
     
     def send_message(self, message: Message, **kwargs):
         """Send a message to the recipient"""
-        print(f'Sending message to {message.to} from {message.from_}: {message.content}')
\ No newline at end of file
+        print(f'Sending message to {message.to} from {message.from_}: {message.content}')
+
+    async def asend_message(self, message: Message, **kwargs):
+        """Send a message to the recipient without blocking the event loop"""
+        return self.send_message(message, **kwargs)
+
+    async def asend_batch(self, messages: List[Message], **kwargs):
+        """Send several messages at once. Returns one response per message"""
+        return [self.send_message(message, **kwargs) for message in messages]
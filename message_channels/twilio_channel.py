@@ -1,19 +1,48 @@
+from typing import Optional
 
-from twilio.rest import Client
+from pydantic import PrivateAttr
 
-from pydantic import BaseModel, Field
-
-from settings import settings
+from message_channels.base_channel import BaseChannel
 from schemas import Message
 
 
-client = Client(settings.twilio_account_sid, settings.twilio_auth_token)
-class TwilioChannel(BaseModel):
-    """A Twilio channel to send messages"""
+class TwilioChannel(BaseChannel):
+    """
+    A Twilio channel to send messages.
+    The credentials default to the ones in settings. The twilio client is created on open().
+    """
+
+    account_sid: Optional[str] = None
+    auth_token: Optional[str] = None
+
+    _client = PrivateAttr(default=None)
+
+    def open(self):
+        """Create the twilio client"""
+
+        if self._client is not None:
+            return
+
+        from twilio.rest import Client
+
+        account_sid, auth_token = self.account_sid, self.auth_token
+        if account_sid is None or auth_token is None:
+            from settings import get_settings
+            settings = get_settings()
+            account_sid = account_sid or settings.twilio_account_sid
+            auth_token = auth_token or settings.twilio_auth_token
+
+        self._client = Client(account_sid, auth_token)
+
+    def close(self):
+        self._client = None
 
     def send_message(self, message: Message, **kwargs):
         """Send a message to the recipient"""
-        message = client.messages.create(
+        if self._client is None:
+            self.open()
+
+        message = self._client.messages.create(
             from_=message.from_,
             to=message.to,
             body=message.content,
@@ -23,6 +52,8 @@ class TwilioChannel(BaseModel):
 
 
 if __name__ == "__main__":
+    from settings import settings
+
     twilio_channel = TwilioChannel()
     content ="Olá. Investidor(a)!\nÉ uma pena você ter cancelado seu trial da Suno Premium...\nPensando nisso, decidimos disponibilizar uma condição especial para um grupo seleto de pessoas, e você está dentro dele!\nPara garantir sua condição especial, você poderia me informar qual o motivo do cancelamento?"
 
@@ -32,4 +63,4 @@ if __name__ == "__main__":
         content="dps eu posso sair botando tudo"
     )
     result = twilio_channel.send_message(message)
-    print("Message sent!")
\ No newline at end of file
+    print("Message sent!")
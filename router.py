@@ -0,0 +1,220 @@
+import logging
+import multiprocessing
+import os
+import queue as queue_module
+import zlib
+from typing import Callable, Dict, List, Optional
+
+from schemas import Message, MessageChannels
+
+"""
+The inbound router takes the messages received from the users and runs them through
+their flows on a pool of worker processes.
+
+Every conversation (the pair of participants) is always routed to the same worker, so
+the messages of a conversation are processed in order while different conversations
+run in parallel on all cores. Each worker keeps the conversations in the state store
+returned by store_factory.
+
+    router = InboundRouter(
+        flow_file="support_example_flow.json",
+        channel=MessageChannels.twilio,
+        store_factory=functools.partial(SQLiteStateStore, "conversations.sqlite3"),
+        workers=4,
+    )
+    router.start()
+    router.submit(message)          # blocks while the worker queue is full
+    router.queue_depths()           # messages waiting on each worker
+    router.stop()
+
+For multi-tenant setups, `tenants` maps the number that received the message
+(message.to) to the flow file used for its conversations.
+
+Each worker also resumes its conversations whose send_and_reply reply_timeout expired
+(see timers.py), between the inbound messages.
+
+With dedupe_ttl the workers drop the messages redelivered by the provider (same
+message_id), and with coalesce_window they join the burst of messages of a conversation
+into a single run of the flow (see inbound.py).
+"""
+
+DEFAULT_MAX_QUEUE = 1000
+
+
+def handle_message(store, message: Message, flow_file: str, flow_name: str, channel: MessageChannels, timeouts=None):
+    """Run an inbound message through its conversation, starting a new one if needed"""
+
+    from flows import BasicFlow
+    from schemas import BlockStatus
+
+    flow = store.load_for_message(message)
+    # finished and expired conversations start again
+    if flow is None or flow.flow_status in (BlockStatus.success, BlockStatus.failed):
+        flow = BasicFlow(
+            flow_file=flow_file,
+            flow_name=flow_name,
+            curr_channel=channel,
+            from_=message.to,
+            to=message.from_,
+        )
+
+    store.run_flow(flow, message.content)
+    if timeouts is not None:
+        timeouts.track(flow)
+    return flow
+
+
+def conversation_worker(from_: str, to: str, workers: int) -> int:
+    """Index of the worker that owns the conversation of a flow (flow.from_, flow.to)"""
+    return zlib.crc32(f"{from_}\n{to}".encode()) % workers
+
+
+def _worker_loop(
+    queue: multiprocessing.Queue,
+    depth,
+    store_factory: Callable,
+    flow_file: str,
+    flow_name: str,
+    channel: MessageChannels,
+    tenants: Dict[str, str],
+    worker_index: int = 0,
+    workers: int = 1,
+    dedupe_ttl: Optional[float] = None,
+    coalesce_window: Optional[float] = None,
+):
+    from inbound import Coalescer, DedupeIndex, InboundProcessor
+    from timers import ReplyTimeouts
+
+    store = store_factory()
+    timeouts = ReplyTimeouts(store, owns=lambda from_, to: conversation_worker(from_, to, workers) == worker_index)
+    try:
+        timeouts.restore()
+    except NotImplementedError:
+        pass
+
+    processor = InboundProcessor(
+        lambda message: handle_message(store, message, tenants.get(message.to, flow_file), flow_name, channel, timeouts),
+        dedupe=DedupeIndex(dedupe_ttl) if dedupe_ttl else None,
+        coalescer=Coalescer(coalesce_window) if coalesce_window else None,
+    )
+
+    while True:
+        try:
+            message = queue.get(timeout=_earliest(timeouts.seconds_to_next(), processor.seconds_to_next()))
+        except queue_module.Empty:
+            processor.run_due()
+            timeouts.run_due()
+            continue
+        if message is None:
+            processor.flush()
+            break
+
+        try:
+            processor.receive(message)
+        finally:
+            with depth.get_lock():
+                depth.value -= 1
+
+        # a busy queue never times out, so the due messages and timeouts also run between messages
+        processor.run_due()
+        timeouts.run_due()
+
+
+def _earliest(*waits: Optional[float]) -> Optional[float]:
+    waits = [wait for wait in waits if wait is not None]
+    return min(waits) if waits else None
+
+
+class InboundRouter:
+    """Shards the inbound messages by conversation across worker processes"""
+
+    def __init__(
+        self,
+        flow_file: str,
+        store_factory: Callable,
+        flow_name: Optional[str] = None,
+        channel: MessageChannels = MessageChannels.twilio,
+        workers: Optional[int] = None,
+        max_queue: int = DEFAULT_MAX_QUEUE,
+        tenants: Optional[Dict[str, str]] = None,
+        dedupe_ttl: Optional[float] = None,
+        coalesce_window: Optional[float] = None,
+    ):
+        """
+        dedupe_ttl: seconds the message ids are remembered to drop the redelivered messages.
+        coalesce_window: seconds a conversation must be quiet before its burst of messages
+            runs through the flow as a single message. See inbound.py
+        """
+        self.flow_file = flow_file
+        self.flow_name = flow_name or flow_file
+        self.store_factory = store_factory
+        self.channel = channel
+        self.workers = workers or os.cpu_count() or 1
+        self.max_queue = max_queue
+        self.tenants = tenants or {}
+        self.dedupe_ttl = dedupe_ttl
+        self.coalesce_window = coalesce_window
+
+        self._queues: List[multiprocessing.Queue] = []
+        self._depths: list = []
+        self._processes: List[multiprocessing.Process] = []
+
+    def start(self):
+        """Start the worker processes"""
+
+        for index in range(self.workers):
+            queue = multiprocessing.Queue(maxsize=self.max_queue)
+            depth = multiprocessing.Value("i", 0)
+            process = multiprocessing.Process(
+                target=_worker_loop,
+                args=(
+                    queue, depth, self.store_factory, self.flow_file, self.flow_name, self.channel, self.tenants,
+                    index, self.workers, self.dedupe_ttl, self.coalesce_window,
+                ),
+                daemon=True,
+            )
+            process.start()
+            self._queues.append(queue)
+            self._depths.append(depth)
+            self._processes.append(process)
+
+    def worker_for(self, message: Message) -> int:
+        """Return the index of the worker that owns the conversation of the message"""
+        return conversation_worker(message.to, message.from_, self.workers)
+
+    def submit(self, message: Message, block: bool = True, timeout: Optional[float] = None):
+        """
+        Queue an inbound message on the worker of its conversation.
+        Waits while the worker queue is full. With block=False (or when the timeout
+        expires) raises queue.Full instead, so the caller can apply backpressure.
+        """
+
+        if not self._processes:
+            raise RuntimeError("The router is not running. Call start() first.")
+
+        index = self.worker_for(message)
+        depth = self._depths[index]
+        with depth.get_lock():
+            depth.value += 1
+        try:
+            self._queues[index].put(message, block, timeout)
+        except Exception:
+            with depth.get_lock():
+                depth.value -= 1
+            raise
+
+    def queue_depths(self) -> List[int]:
+        """Messages queued or being processed on each worker"""
+        return [depth.value for depth in self._depths]
+
+    def stop(self, timeout: Optional[float] = None):
+        """Wait for the queued messages to be processed and stop the workers"""
+
+        for queue in self._queues:
+            queue.put(None)
+        for process in self._processes:
+            process.join(timeout)
+
+        self._queues.clear()
+        self._depths.clear()
+        self._processes.clear()
@@ -26,6 +26,7 @@ class BlockTypes(str, Enum):
     set_variables = 'set_variables'
     http_request = 'http_request'
     split_variable = 'split_variable'
+    parallel_http = 'parallel_http'
 
 
 class MessageChannels(str, Enum):
@@ -42,4 +43,13 @@ class Message(BaseModel):
     to: str
     from_: str = Field(..., validation_alias=AliasChoices('from_', 'from'))
     type: str = 'text'
+    message_id: Optional[str] = None # id given by the provider (like the Twilio MessageSid), used to drop redeliveries
 
+
+class DeliveryResult(BaseModel):
+    """The result of sending a message through a channel"""
+
+    message: Message
+    channel: MessageChannels
+    success: bool
+    error: Optional[str] = None
@@ -1,5 +1,15 @@
+from functools import lru_cache
+
 from pydantic_settings import BaseSettings
 
+"""
+Settings of the twilio channel, read from the environment or the .env file.
+
+They are only built when first used (get_settings(), or `from settings import settings`),
+so importing the package or running flows on other channels doesn't need the twilio
+environment variables.
+"""
+
 class Settings(BaseSettings):
     debug_level: str = "INFO"
     twilio_account_sid: str
@@ -10,4 +20,12 @@ class Settings(BaseSettings):
         env_file = ".env"
 
 
-settings = Settings()
\ No newline at end of file
+@lru_cache(maxsize=None)
+def get_settings() -> Settings:
+    return Settings()
+
+
+def __getattr__(name):
+    if name == "settings":
+        return get_settings()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,288 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from flow_serialization import dumps_flow, loads_flow
+from flows import BasicFlow
+from schemas import Message
+
+"""
+State stores keep the state of the conversations between inbound messages, so a flow
+doesn't need to stay alive in memory and survives restarts.
+
+Each store saves the compact state of the flow (see flow_serialization.py) and indexes
+it by flow_id and by the participant pair (flow.from_, flow.to). An inbound message is
+matched to its conversation with load_for_message, which rebuilds the flow from the
+compiled flow template:
+
+    store = SQLiteStateStore("conversations.sqlite3")
+    flow = store.load_for_message(message)
+    store.run_flow(flow, message.content)   # flow.run_flow and store.save
+
+The stores also index the wait_deadline of the flows waiting on a send_and_reply block
+with a reply_timeout, so the pending timeouts can be loaded without reading every
+flow (see timers.py).
+
+Available stores: InMemoryStateStore, SQLiteStateStore and FileStateStore. Any of them
+can be put behind the write-ahead journal of journal.py (JournaledStateStore).
+"""
+
+
+class FlowStateStore:
+    """Base class of the state stores. Subclasses store and fetch the encoded snapshots"""
+
+    def save(self, flow: BasicFlow):
+        """Save the current state of the flow"""
+        self.put_snapshot(flow.flow_id, flow.from_, flow.to, dumps_flow(flow), flow.wait_deadline)
+
+    def run_flow(self, flow: BasicFlow, event=None):
+        """Run the flow with an inbound event and save it"""
+        flow.run_flow(event)
+        self.save(flow)
+
+    async def arun_flow(self, flow: BasicFlow, event=None):
+        """Same as run_flow, inside an event loop"""
+        await flow.arun_flow(event)
+        await self.asave(flow)
+
+    async def asave(self, flow: BasicFlow):
+        """Save the flow without blocking the event loop: the store is written in a worker thread"""
+        import asyncio
+
+        await asyncio.to_thread(self.save, flow)
+
+    def load(self, flow_id: str) -> Optional[BasicFlow]:
+        """Return the flow with the given id, or None if it is not stored"""
+        data = self.get_snapshot(flow_id)
+        return self.decode_flow(data)
+
+    def find(self, from_: str, to: str) -> Optional[BasicFlow]:
+        """Return the last saved flow between the two participants, or None"""
+        data = self.get_snapshot_by_participants(from_, to)
+        return self.decode_flow(data)
+
+    def load_for_message(self, message: Message) -> Optional[BasicFlow]:
+        """Return the flow an inbound message belongs to. The user is the 'to' of the flow"""
+        return self.find(from_=message.to, to=message.from_)
+
+    def delete(self, flow_id: str):
+        self.delete_snapshot(flow_id)
+
+    def decode_flow(self, data: Optional[bytes]) -> Optional[BasicFlow]:
+        if data is None:
+            return None
+        return loads_flow(data)
+
+    def put_snapshot(self, flow_id: str, from_: str, to: str, data: bytes, wake_at: Optional[float] = None):
+        raise NotImplementedError
+
+    def get_deadlines(self) -> List[Tuple[str, str, str, float]]:
+        """Return (flow_id, from_, to, wake_at) of the flows waiting on a reply timeout"""
+        raise NotImplementedError
+
+    def get_snapshot(self, flow_id: str) -> Optional[bytes]:
+        raise NotImplementedError
+
+    def get_snapshot_by_participants(self, from_: str, to: str) -> Optional[bytes]:
+        raise NotImplementedError
+
+    def delete_snapshot(self, flow_id: str):
+        raise NotImplementedError
+
+
+class InMemoryStateStore(FlowStateStore):
+    """Keeps the snapshots in dicts. Useful for tests and single process workers"""
+
+    def __init__(self):
+        self._snapshots: Dict[str, Tuple[str, str, bytes]] = {}
+        self._by_participants: Dict[Tuple[str, str], str] = {}
+        self._deadlines: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def put_snapshot(self, flow_id, from_, to, data, wake_at=None):
+        with self._lock:
+            self._snapshots[flow_id] = (from_, to, data)
+            self._by_participants[(from_, to)] = flow_id
+            if wake_at is not None:
+                self._deadlines[flow_id] = wake_at
+            else:
+                self._deadlines.pop(flow_id, None)
+
+    async def asave(self, flow: BasicFlow):
+        # a dict write doesn't block, no need for a thread
+        self.save(flow)
+
+    def get_snapshot(self, flow_id):
+        stored = self._snapshots.get(flow_id)
+        return stored[2] if stored is not None else None
+
+    def get_snapshot_by_participants(self, from_, to):
+        flow_id = self._by_participants.get((from_, to))
+        return self.get_snapshot(flow_id) if flow_id is not None else None
+
+    def get_deadlines(self):
+        with self._lock:
+            return [
+                (flow_id, *self._snapshots[flow_id][:2], wake_at)
+                for flow_id, wake_at in self._deadlines.items()
+            ]
+
+    def delete_snapshot(self, flow_id):
+        with self._lock:
+            self._deadlines.pop(flow_id, None)
+            stored = self._snapshots.pop(flow_id, None)
+            if stored is not None and self._by_participants.get(stored[:2]) == flow_id:
+                del self._by_participants[stored[:2]]
+
+    def __len__(self):
+        return len(self._snapshots)
+
+
+class SQLiteStateStore(FlowStateStore):
+    """Keeps the snapshots in a sqlite database, indexed by flow_id and by participants"""
+
+    def __init__(self, path: str = "flow_states.sqlite3"):
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        # the router workers open the same database at the same time: the schema is
+        # created by one of them, the others wait for the write lock
+        self._connection.execute("BEGIN IMMEDIATE")
+        try:
+            self._create_schema()
+        except BaseException:
+            self._connection.execute("ROLLBACK")
+            raise
+        self._connection.execute("COMMIT")
+
+    def _create_schema(self):
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS flow_states ("
+            "flow_id TEXT PRIMARY KEY, from_ TEXT, to_ TEXT, updated_at REAL, data BLOB, wake_at REAL)"
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS flow_states_participants "
+            "ON flow_states (from_, to_, updated_at)"
+        )
+        # partial index: only the flows waiting on a reply timeout are in it
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS flow_states_wake_at "
+            "ON flow_states (wake_at) WHERE wake_at IS NOT NULL"
+        )
+
+    def put_snapshot(self, flow_id, from_, to, data, wake_at=None):
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO flow_states (flow_id, from_, to_, updated_at, data, wake_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (flow_id, from_, to, time.time(), data, wake_at),
+            )
+
+    def get_deadlines(self):
+        with self._lock:
+            return self._connection.execute(
+                "SELECT flow_id, from_, to_, wake_at FROM flow_states WHERE wake_at IS NOT NULL"
+            ).fetchall()
+
+    def get_snapshot(self, flow_id):
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT data FROM flow_states WHERE flow_id = ?", (flow_id,)
+            ).fetchone()
+        return row[0] if row is not None else None
+
+    def get_snapshot_by_participants(self, from_, to):
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT data FROM flow_states WHERE from_ = ? AND to_ = ? "
+                "ORDER BY updated_at DESC LIMIT 1",
+                (from_, to),
+            ).fetchone()
+        return row[0] if row is not None else None
+
+    def delete_snapshot(self, flow_id):
+        with self._lock:
+            self._connection.execute("DELETE FROM flow_states WHERE flow_id = ?", (flow_id,))
+
+    def close(self):
+        self._connection.close()
+
+
+class FileStateStore(FlowStateStore):
+    """
+    Keeps one file per flow inside a directory. The participants index is a small
+    file per participant pair that holds the id of its last saved flow, and the
+    flows waiting on a reply timeout have a small file in the deadlines directory.
+    """
+
+    def __init__(self, directory: str = "flow_states"):
+        self.directory = directory
+        self._flows_dir = os.path.join(directory, "flows")
+        self._participants_dir = os.path.join(directory, "participants")
+        self._deadlines_dir = os.path.join(directory, "deadlines")
+        os.makedirs(self._flows_dir, exist_ok=True)
+        os.makedirs(self._participants_dir, exist_ok=True)
+        os.makedirs(self._deadlines_dir, exist_ok=True)
+
+    def _flow_path(self, flow_id: str) -> str:
+        return os.path.join(self._flows_dir, flow_id)
+
+    def _participants_path(self, from_: str, to: str) -> str:
+        key = hashlib.sha1(f"{from_}\n{to}".encode()).hexdigest()
+        return os.path.join(self._participants_dir, key)
+
+    def _write(self, path: str, data: bytes):
+        """Write the file atomically, so a crash never leaves half a snapshot"""
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as file:
+            file.write(data)
+        os.replace(tmp_path, path)
+
+    def _read(self, path: str) -> Optional[bytes]:
+        try:
+            with open(path, "rb") as file:
+                return file.read()
+        except FileNotFoundError:
+            return None
+
+    def _remove(self, path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def put_snapshot(self, flow_id, from_, to, data, wake_at=None):
+        self._write(self._flow_path(flow_id), data)
+        self._write(self._participants_path(from_, to), flow_id.encode())
+
+        deadline_path = os.path.join(self._deadlines_dir, flow_id)
+        if wake_at is not None:
+            self._write(deadline_path, f"{from_}\n{to}\n{wake_at!r}".encode())
+        else:
+            self._remove(deadline_path)
+
+    def get_deadlines(self):
+        deadlines = []
+        for flow_id in os.listdir(self._deadlines_dir):
+            if flow_id.endswith(".tmp"):
+                continue
+            data = self._read(os.path.join(self._deadlines_dir, flow_id))
+            if data is None:
+                continue
+            from_, to, wake_at = data.decode().split("\n")
+            deadlines.append((flow_id, from_, to, float(wake_at)))
+        return deadlines
+
+    def get_snapshot(self, flow_id):
+        return self._read(self._flow_path(flow_id))
+
+    def get_snapshot_by_participants(self, from_, to):
+        flow_id = self._read(self._participants_path(from_, to))
+        return self.get_snapshot(flow_id.decode()) if flow_id is not None else None
+
+    def delete_snapshot(self, flow_id):
+        self._remove(self._flow_path(flow_id))
+        self._remove(os.path.join(self._deadlines_dir, flow_id))
@@ -0,0 +1,126 @@
+import json
+import re
+from typing import Iterator, List, Optional
+
+from templates import get_path, parse_path
+
+"""
+Helpers for the streaming mode of the http blocks.
+
+A streamed http block reads the response while it arrives (server-sent events, json
+lines or plain text) and forwards the text in chunks to a message block, so the user
+starts reading the answer before the whole response is received:
+
+"llm_call": {
+    "block_type": "http_request",
+    "next_block_name": "answer",
+    "options": {"method": "POST", "url": "https://api.openai.com/v1/chat/completions"},
+    "body": {"model": "gpt-4o-mini", "stream": true, "messages": [...]},
+    "stream": {
+        "format": "sse",                               # "sse", "lines" or "text" (default "sse")
+        "content_path": "choices.0.delta.content",     # where the text is inside each event
+        "forward_to": "answer",                        # message block that sends the chunks
+        "chunk_by": "sentence",                        # "sentence" or "chars" (default "sentence")
+        "min_chars": 40,                               # smallest chunk sent (default 40)
+        "max_chars": 400                               # chunks are cut at this size (default 400)
+    }
+}
+
+The full text is stored in the outbound of the http block, and the message block sends
+nothing else when the flow reaches it. The text it streamed is kept in its state
+(streamed_content), so a saved conversation doesn't send it again. Under arun_flow the
+chunks go through the outbound dispatcher when one is set, one at a time so they arrive
+in order.
+"""
+
+DEFAULT_MIN_CHARS = 40
+DEFAULT_MAX_CHARS = 400
+
+_SENTENCE_END = re.compile(r"[.!?…]+[\"')\]]*\s+|\n+")
+
+
+def iter_stream_text(response, format: str = "sse", content_path: Optional[str] = None) -> Iterator[str]:
+    """Yield the pieces of text of a streamed response as they arrive"""
+
+    path = parse_path(content_path) if content_path else None
+
+    if format == "text":
+        for text in response.iter_content(chunk_size=None, decode_unicode=True):
+            if text:
+                yield text
+        return
+
+    for line in response.iter_lines(decode_unicode=True):
+        if not line:
+            continue
+        if format == "sse":
+            if not line.startswith("data:"):
+                continue
+            line = line[5:].strip()
+            if line == "[DONE]":
+                return
+
+        text = _event_text(line, path)
+        if text:
+            yield text
+
+
+def _event_text(data: str, path) -> Optional[str]:
+    if path is None:
+        return data
+    try:
+        value = get_path(json.loads(data), path)
+    except (ValueError, KeyError, IndexError, TypeError):
+        return None
+    return value if isinstance(value, str) else None
+
+
+class TextChunker:
+    """Groups streamed text into chunks ending on a sentence (or word) boundary"""
+
+    def __init__(
+        self,
+        chunk_by: str = "sentence",
+        min_chars: int = DEFAULT_MIN_CHARS,
+        max_chars: int = DEFAULT_MAX_CHARS,
+    ):
+        if chunk_by not in ("sentence", "chars"):
+            raise ValueError(f"{chunk_by} is not a valid chunk_by. Use 'sentence' or 'chars'")
+        self.chunk_by = chunk_by
+        self.min_chars = min_chars
+        self.max_chars = max(max_chars, min_chars)
+        self._buffer = ""
+
+    def feed(self, text: str) -> List[str]:
+        """Add text and return the chunks that are ready to be sent"""
+
+        self._buffer += text
+        chunks = []
+        while True:
+            end = self._chunk_end()
+            if end is None:
+                return chunks
+            chunks.append(self._buffer[:end])
+            self._buffer = self._buffer[end:]
+
+    def flush(self) -> Optional[str]:
+        """Return the text left in the buffer"""
+        chunk, self._buffer = self._buffer, ""
+        return chunk if chunk.strip() else None
+
+    def _chunk_end(self) -> Optional[int]:
+        buffer = self._buffer
+        if len(buffer) < self.min_chars:
+            return None
+
+        if self.chunk_by == "sentence":
+            match = _SENTENCE_END.search(buffer, self.min_chars - 1)
+            if match is not None and match.end() <= self.max_chars:
+                return match.end()
+
+        if self.chunk_by == "chars" or len(buffer) >= self.max_chars:
+            limit = self.min_chars if self.chunk_by == "chars" else self.max_chars
+            space = buffer.rfind(" ", 0, limit + 1)
+            return space + 1 if space > 0 else limit
+
+        return None
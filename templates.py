@@ -0,0 +1,236 @@
+import ast
+import json
+import re
+from string import Formatter
+from typing import Any, Callable, List, Tuple
+
+"""
+Template compiler for the dynamic values of the blocks.
+
+Templates are parsed once, when the block is created, into small immutable objects
+that render the value for a conversation without touching the source template.
+
+Block references, used by the set_variables block:
+    "{{block_name.outbound}}"
+    "{{block_name.outbound.address.city}}"      any depth
+    "{{llm_call.outbound.choices[0].message.content}}"   list indexing (also choices.0)
+    "{{block_name.outbound.name|unknown}}"      default value when the path doesn't exist
+A string that is a single reference renders to the referenced value itself (a dict,
+a number...). References inside a longer text are rendered as text.
+
+A string that is a single "{{= expr }}" is an expression (see expressions.py), compiled
+into an Expression instead: "{{= price * quantity }}". Expressions can't be mixed with
+text.
+
+Flow variables, used by the http_request block, follow str.format:
+    "https://api.example.com/users/{user_id}"
+"""
+
+_REFERENCE = re.compile(r"\{\{\s*(.*?)\s*\}\}")
+_EXPRESSION = re.compile(r"\{\{=(.*?)\}\}", re.DOTALL)
+_SEGMENT = re.compile(r"([^.\[\]]+)|\[\s*(-?\d+)\s*\]")
+_MISSING = object()
+_formatter = Formatter()
+
+
+class _Immutable:
+    """Compiled templates never change, so copies of a block can share them"""
+
+    __slots__ = ()
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+def parse_path(path: str) -> Tuple:
+    """Split 'a.b[0].c' into ('a', 'b', 0, 'c')"""
+
+    segments = []
+    for match in _SEGMENT.finditer(path):
+        key, index = match.groups()
+        segments.append(int(index) if index is not None else key.strip())
+    return tuple(segments)
+
+
+def get_path(value: Any, path: Tuple) -> Any:
+    """Follow the path inside dicts, lists and json strings"""
+
+    for segment in path:
+        if isinstance(value, str):
+            value = _parse_structure(value)
+
+        if isinstance(value, (list, tuple)):
+            value = value[int(segment)]
+        elif isinstance(segment, int) and isinstance(value, dict) and segment not in value:
+            value = value[str(segment)]
+        else:
+            value = value[segment]
+    return value
+
+
+def _parse_structure(value: str) -> Any:
+    """Turn a json (or python literal) string into a dict/list, so it can be indexed"""
+    try:
+        return json.loads(value)
+    except ValueError:
+        return ast.literal_eval(value)
+
+
+def _parse_default(default: str) -> Any:
+    try:
+        return json.loads(default)
+    except ValueError:
+        return default
+
+
+class Constant(_Immutable):
+    """A value without references"""
+
+    __slots__ = ("value",)
+
+    def __init__(self, value: Any):
+        self.value = value
+
+    def render(self, lookup: Callable) -> Any:
+        return self.value
+
+    def references(self) -> tuple:
+        """The block references used by the template"""
+        return ()
+
+
+class Reference(_Immutable):
+    """A compiled '{{block_name.attribute.path|default}}' reference"""
+
+    __slots__ = ("block_name", "attribute", "path", "default")
+
+    def __init__(self, expression: str):
+        expression, separator, default = expression.partition("|")
+        segments = parse_path(expression)
+        if len(segments) < 2:
+            raise ValueError(f"Invalid reference '{{{{{expression}}}}}'. Expected '{{{{block_name.value}}}}'")
+
+        self.block_name = segments[0]
+        self.attribute = segments[1]
+        self.path = segments[2:]
+        self.default = _parse_default(default.strip()) if separator else _MISSING
+
+    def render(self, lookup: Callable) -> Any:
+        """lookup(block_name, attribute) returns the inbound/outbound value of a block"""
+
+        try:
+            value = lookup(self.block_name, self.attribute)
+            if self.path:
+                value = get_path(value, self.path)
+        except (KeyError, IndexError, TypeError, ValueError, SyntaxError):
+            if self.default is _MISSING:
+                raise
+            return self.default
+
+        if value is None and self.default is not _MISSING:
+            return self.default
+        return value
+
+    def references(self) -> tuple:
+        return (self,)
+
+
+class Interpolation(_Immutable):
+    """A text with references inside it. Renders to a string"""
+
+    __slots__ = ("parts",)
+
+    def __init__(self, parts: List):
+        self.parts = tuple(parts)
+
+    def render(self, lookup: Callable) -> str:
+        return "".join(
+            part if isinstance(part, str) else str(part.render(lookup))
+            for part in self.parts
+        )
+
+    def references(self) -> tuple:
+        return tuple(part for part in self.parts if not isinstance(part, str))
+
+
+class FormatString(_Immutable):
+    """A str.format template parsed once. Renders with the flow variables"""
+
+    __slots__ = ("parts",)
+
+    def __init__(self, template: str):
+        self.parts = tuple(_formatter.parse(template))
+
+    def render(self, variables: dict) -> str:
+        chunks = []
+        for literal, field_name, format_spec, conversion in self.parts:
+            if literal:
+                chunks.append(literal)
+            if field_name is None:
+                continue
+            value, _ = _formatter.get_field(field_name, (), variables)
+            value = _formatter.convert_field(value, conversion)
+            chunks.append(_formatter.format_field(value, format_spec or ""))
+        return "".join(chunks)
+
+
+class CompiledDict(_Immutable):
+    """A dict (or list) whose string values are compiled templates"""
+
+    __slots__ = ("items", "is_list")
+
+    def __init__(self, items, is_list: bool = False):
+        self.items = tuple(items)
+        self.is_list = is_list
+
+    def render(self, context) -> Any:
+        if self.is_list:
+            return [value.render(context) for value in self.items]
+        return {key: value.render(context) for key, value in self.items}
+
+
+def compile_reference_template(value: Any):
+    """Compile a value that may contain '{{block_name.value}}' references, or a '{{= expression }}'"""
+
+    if not isinstance(value, str) or "{{" not in value:
+        return Constant(value)
+
+    if "{{=" in value:
+        expression = _EXPRESSION.fullmatch(value.strip())
+        if expression is None:
+            raise ValueError(f"An expression must be the whole value: {value!r}")
+        from expressions import compile_expression
+        return compile_expression(expression.group(1))
+
+    single = _REFERENCE.fullmatch(value.strip())
+    # "{{a.b}} and {{c.d}}" matches too, with "a.b}} and {{c.d" inside
+    if single is not None and "{{" not in single.group(1):
+        return Reference(single.group(1))
+
+    parts = []
+    position = 0
+    for match in _REFERENCE.finditer(value):
+        if match.start() > position:
+            parts.append(value[position:match.start()])
+        parts.append(Reference(match.group(1)))
+        position = match.end()
+    if position < len(value):
+        parts.append(value[position:])
+    return Interpolation(parts)
+
+
+def compile_format_template(value: Any):
+    """Compile a value (str, dict or list, at any depth) that uses str.format placeholders"""
+
+    if isinstance(value, str):
+        if "{" not in value and "}" not in value:
+            return Constant(value)
+        return FormatString(value)
+    if isinstance(value, dict):
+        return CompiledDict((key, compile_format_template(item)) for key, item in value.items())
+    if isinstance(value, list):
+        return CompiledDict((compile_format_template(item) for item in value), is_list=True)
+    return Constant(value)
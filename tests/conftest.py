@@ -0,0 +1,60 @@
+import json
+import os
+import sys
+
+import pytest
+
+# the modules of the package are imported by their flat names (from schemas import ...)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# asks the order number, saves it and thanks
+ORDER = {
+    "ask": {"block_type": "send_and_reply", "sending_content": "Order number?", "next_block_name": "save",
+            "reply_timeout": 60},
+    "save": {"block_type": "set_variables", "next_block_name": "thanks",
+             "variables": {"order": "{{ask.inbound}}", "question": "{{ask.outbound}}"}},
+    "thanks": {"block_type": "single_message", "sending_content": "Thanks", "next_block_name": "end", "is_final_block": True},
+}
+
+
+@pytest.fixture
+def write_flow(tmp_path):
+    """Write a flow (dict of blocks) to a json file of the test and return its path"""
+
+    def write(blocks: dict, name: str = "flow.json") -> str:
+        path = tmp_path / name
+        path.write_text(json.dumps(blocks))
+        return str(path)
+    return write
+
+
+@pytest.fixture
+def order_flow(write_flow):
+    """
+    Start a conversation of the order flow, or of the given blocks, from bot to ana
+    through the mock channel: order_flow(), order_flow(to="bia"), order_flow({...})
+    """
+
+    from flows import BasicFlow
+    from schemas import MessageChannels
+
+    paths = {}
+
+    def new_flow(blocks: dict = ORDER, **fields):
+        key = json.dumps(blocks, sort_keys=True)
+        if key not in paths:
+            paths[key] = write_flow(blocks, f"flow_{len(paths)}.json")
+        fields = {"flow_name": "order", "curr_channel": MessageChannels.mock, "from_": "bot", "to": "ana", **fields}
+        return BasicFlow(flow_file=paths[key], **fields)
+    return new_flow
+
+
+@pytest.fixture
+def sent(monkeypatch):
+    """The contents sent through the mock channel"""
+
+    from message_channels.mock_channel import MockChannel
+
+    messages = []
+    monkeypatch.setattr(MockChannel, "send_message", lambda self, message, **kwargs: messages.append(message.content))
+    return messages
@@ -0,0 +1,35 @@
+import asyncio
+import time
+
+from message_channels.mock_channel import MockChannel
+from schemas import BlockStatus
+
+
+def test_arun_flow_runs_like_run_flow(order_flow, sent):
+    flow = order_flow()
+
+    asyncio.run(flow.arun_flow())
+    assert flow.get_block_by_name("ask").status == BlockStatus.running
+    asyncio.run(flow.arun_flow("42"))
+
+    assert flow.flow_status == BlockStatus.success
+    assert flow.variables == {"order": "42", "question": "Order number?"}
+    assert sent == ["Order number?", "Thanks"]
+
+
+def test_conversations_wait_on_the_network_concurrently(order_flow, monkeypatch):
+    async def slow_send(self, message, **kwargs):
+        await asyncio.sleep(0.1)
+
+    monkeypatch.setattr(MockChannel, "asend_message", slow_send)
+    flows = [order_flow(to=str(number)) for number in range(20)]
+
+    async def run_all():
+        await asyncio.gather(*(flow.arun_flow() for flow in flows))
+
+    started = time.perf_counter()
+    asyncio.run(run_all())
+
+    # 20 sends of 0.1s one after the other would take 2s
+    assert time.perf_counter() - started < 1
+    assert all(flow.get_block_by_name("ask").status == BlockStatus.running for flow in flows)
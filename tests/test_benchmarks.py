@@ -0,0 +1,38 @@
+import json
+import tempfile
+
+import pytest
+
+from benchmarks import run_benchmarks, synthetic
+from flow_registry import FlowTemplate
+
+
+@pytest.mark.parametrize("make_flow", [
+    lambda: synthetic.linear_flow(5),
+    lambda: synthetic.wide_split_flow(5),
+    lambda: synthetic.set_variables_flow(3),
+    lambda: synthetic.http_flow(2, "http://127.0.0.1:1"),
+])
+def test_synthetic_flows_are_valid(make_flow):
+    flow, _ = make_flow()
+    assert FlowTemplate("synthetic", "", flow).issues == ()
+
+
+def test_small_run_reports_every_metric(tmp_path, capsys, monkeypatch):
+    flow_files = tmp_path / "tmp"
+    flow_files.mkdir()
+    monkeypatch.setattr(tempfile, "tempdir", str(flow_files))
+    output = tmp_path / "results.json"
+    report = run_benchmarks.main(["--size", "4", "--conversations", "5", "--live", "5", "--output", str(output)])
+
+    assert set(report["results"]) == set(run_benchmarks.SCENARIOS)
+    for metrics in report["results"].values():
+        assert metrics["conversations_per_second"] > 0
+        assert metrics["step_p99_us"] >= metrics["step_p50_us"] > 0
+
+    # a second run compared with the first one
+    run_benchmarks.main(["--size", "4", "--conversations", "5", "--live", "5", "--scenarios", "linear", "--compare", str(output)])
+    assert json.loads(output.read_text())["meta"]["size"] == 4
+    assert "%" in capsys.readouterr().out
+    # the flow files of the runs are removed
+    assert list(flow_files.iterdir()) == []
@@ -0,0 +1,32 @@
+from flow_registry import BlockState
+from schemas import BlockStatus
+
+
+def test_new_conversation_shares_the_initial_states(order_flow):
+    first, second = order_flow(), order_flow()
+
+    assert first.block_states() == list(first._template.initial_states)
+    assert all(mine is theirs for mine, theirs in zip(first.block_states(), second.block_states()))
+    assert first.changed_block_states() == []
+
+
+def test_materialized_blocks_share_the_static_fields(order_flow):
+    flow = order_flow()
+    prototype = flow._template.prototypes[flow._block_index["save"]]
+
+    block = flow.get_block_by_name("save")
+    assert block is not prototype
+    assert block._templates is prototype._templates
+    assert block.variables is prototype.variables
+
+
+def test_only_the_changed_blocks_keep_a_state(order_flow, sent):
+    flow = order_flow()
+    flow.run_flow()
+
+    changed = flow.changed_block_states()
+    assert [state.name_in_flow for state in changed] == ["ask"]
+    assert isinstance(changed[0], BlockState)
+    assert (changed[0].status, changed[0].outbound) == (BlockStatus.running, "Order number?")
+    # the blocks are dropped at the end of the run, the states stay
+    assert flow._live_blocks == {}
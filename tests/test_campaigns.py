@@ -0,0 +1,63 @@
+import json
+
+import pytest
+
+from campaigns import Campaign, read_recipients
+from schemas import MessageChannels
+from state_store import InMemoryStateStore
+
+PROMO = {
+    "offer": {"block_type": "send_and_reply", "sending_content": "20% off today!", "next_block_name": "thanks"},
+    "thanks": {"block_type": "single_message", "sending_content": "Thanks", "next_block_name": "end", "is_final_block": True},
+}
+
+
+def campaign(path: str, **fields) -> Campaign:
+    return Campaign(flow_file=path, from_="shop", channel=MessageChannels.mock, concurrency=4, **fields)
+
+
+def test_recipient_formats(tmp_path):
+    csv_file = tmp_path / "recipients.csv"
+    csv_file.write_text("to,name\nana,Ana\nbia,Bia\n")
+    jsonl_file = tmp_path / "recipients.jsonl"
+    jsonl_file.write_text('{"to": "ana", "variables": {"name": "Ana"}}\n\n{"to": "bia", "name": "Bia"}\n')
+
+    for source in (str(csv_file), str(jsonl_file), [{"to": "ana", "name": "Ana"}, {"to": "bia", "name": "Bia"}]):
+        recipients = [(recipient.to, recipient.variables) for recipient in read_recipients(source)]
+        assert recipients == [("ana", {"name": "Ana"}), ("bia", {"name": "Bia"})]
+
+    assert [recipient.to for recipient in read_recipients(["ana", "bia"])] == ["ana", "bia"]
+
+
+def test_invalid_record_raises_without_on_error():
+    with pytest.raises(ValueError):
+        list(read_recipients([{"name": "nobody"}]))
+
+
+def test_campaign_starts_every_conversation(write_flow, sent):
+    store = InMemoryStateStore()
+    progress = []
+    report = campaign(write_flow(PROMO), store=store, on_progress=lambda report: progress.append(report.started),
+                      progress_every=10).run(f"user{number}" for number in range(25))
+
+    assert (report.recipients, report.started, report.waiting, report.failed) == (25, 25, 25, 0)
+    assert sent == ["20% off today!"] * 25
+    assert len(store) == 25
+    assert store.find("shop", "user7").get_block_by_name("offer").outbound == "20% off today!"
+    assert progress[-1] == 25
+
+
+def test_invalid_records_are_counted_and_skipped(write_flow, tmp_path, sent):
+    recipients = tmp_path / "recipients.jsonl"
+    recipients.write_text("\n".join([
+        json.dumps({"to": "ana"}),
+        "{not json",
+        json.dumps({"name": "without to"}),
+        json.dumps({"to": "bia"}),
+    ]))
+
+    report = campaign(write_flow(PROMO)).run(str(recipients))
+
+    assert (report.recipients, report.started, report.failed) == (4, 2, 2)
+    assert [recipient for recipient, _ in report.errors] == ["record 2", "record 3"]
+    assert len(sent) == 2
@@ -0,0 +1,59 @@
+import functools
+
+import pytest
+
+from message_channels import channels_factory
+from message_channels.base_channel import BaseChannel
+from message_channels.channels_factory import close_channels, get_channel, register_channel
+from schemas import MessageChannels
+
+
+class CountingChannel(BaseChannel):
+    token: str = ""
+    opened: int = 0
+    closed: int = 0
+
+    def open(self):
+        self.opened += 1
+
+    def close(self):
+        self.closed += 1
+
+    def send_message(self, message, **kwargs):
+        pass
+
+
+@pytest.fixture
+def counting_channel(monkeypatch):
+    monkeypatch.setattr(channels_factory, "_channel_classes", dict(channels_factory._channel_classes))
+    monkeypatch.setattr(channels_factory, "_channels", {})
+    register_channel("counting", CountingChannel)
+    yield
+    close_channels()
+
+
+def test_channel_objects_are_reused():
+    assert get_channel(MessageChannels.mock) is get_channel("mock")
+
+
+def test_accounts_are_registered_as_channels(counting_channel):
+    register_channel("counting_sales", functools.partial(CountingChannel, token="sales"))
+    first = get_channel("counting")
+
+    assert get_channel("counting") is first
+    assert get_channel("counting_sales") is not first
+    assert (get_channel("counting_sales").token, first.opened) == ("sales", 1)
+
+
+def test_closed_channels_are_opened_again(counting_channel):
+    first = get_channel("counting")
+    close_channels()
+
+    assert first.closed == 1
+    second = get_channel("counting")
+    assert second is not first and second.opened == 1
+
+
+def test_unknown_channel():
+    with pytest.raises(ValueError):
+        get_channel("carrier_pigeon")
@@ -0,0 +1,30 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from benchmarks import bench_import_time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(autouse=True)
+def repository_root(monkeypatch):
+    # the benchmark runs fresh interpreters that import the package from the working directory
+    monkeypatch.chdir(ROOT)
+
+
+def test_mock_flow_loads_no_lazy_module():
+    assert bench_import_time.loaded_lazy_modules() == []
+
+
+@pytest.mark.parametrize("module, lazy", [
+    ("flows", "asyncio"),
+    ("blocks.http_request_block", "requests"),
+    ("message_channels.channels_factory", "twilio"),
+])
+def test_modules_import_their_heavy_dependencies_lazily(module, lazy):
+    code = f"import sys, {module}; print({lazy!r} in sys.modules)"
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == "False"
@@ -0,0 +1,128 @@
+import asyncio
+import time
+
+from dispatcher import OutboundDispatcher, TokenBucket, set_dispatcher
+from flows import BasicFlow
+from message_channels.mock_channel import MockChannel
+from schemas import Message, MessageChannels
+
+
+def message(number: int) -> Message:
+    return Message(to=str(number), from_="bot", content=f"message {number}")
+
+
+def test_token_bucket_limits_the_rate():
+    async def take(count):
+        bucket = TokenBucket(rate=100, capacity=1)
+        for _ in range(count):
+            await bucket.acquire()
+
+    started = time.perf_counter()
+    asyncio.run(take(11))
+    # the first token is there, the other 10 come at 100 per second
+    assert time.perf_counter() - started >= 0.09
+
+
+def test_messages_are_sent_in_batches(monkeypatch):
+    batches = []
+
+    async def send_batch(self, messages, **kwargs):
+        batches.append(len(messages))
+        return [None] * len(messages)
+
+    monkeypatch.setattr(MockChannel, "asend_batch", send_batch)
+
+    async def send_all():
+        dispatcher = OutboundDispatcher(batch_size=10)
+        futures = [await dispatcher.submit(MessageChannels.mock, message(number)) for number in range(25)]
+        results = await asyncio.gather(*futures)
+        await dispatcher.stop()
+        return dispatcher, results
+
+    dispatcher, results = asyncio.run(send_all())
+    assert all(result.success for result in results)
+    assert dispatcher.sent == 25
+    assert sum(batches) == 25 and max(batches) <= 10
+
+
+def test_failed_deliveries_are_reported(monkeypatch):
+    async def fail(self, message, **kwargs):
+        raise ConnectionError("provider down")
+
+    monkeypatch.setattr(MockChannel, "asend_message", fail)
+
+    async def send_one():
+        dispatcher = OutboundDispatcher(batch_size=1)
+        result = await dispatcher.send(MessageChannels.mock, message(1))
+        await dispatcher.stop()
+        return dispatcher, result
+
+    dispatcher, result = asyncio.run(send_one())
+    assert not result.success
+    assert result.error == "provider down"
+    assert dispatcher.failed == 1
+
+
+def test_message_blocks_queue_on_the_dispatcher(write_flow, sent):
+    path = write_flow({
+        "hello": {"block_type": "single_message", "sending_content": "Hello!", "next_block_name": "end", "is_final_block": True},
+    })
+    flow = BasicFlow(flow_file=path, flow_name="hello", curr_channel=MessageChannels.mock, from_="bot", to="ana")
+
+    async def run():
+        dispatcher = OutboundDispatcher()
+        set_dispatcher(dispatcher)
+        try:
+            await flow.arun_flow()
+            await dispatcher.stop()
+        finally:
+            set_dispatcher(None)
+
+    asyncio.run(run())
+    assert sent == ["Hello!"]
+    assert flow.get_block_by_name("hello").delivery_status == "sent"
+
+
+def test_messages_of_a_recipient_keep_their_order(monkeypatch):
+    delivered = []
+
+    async def send(self, message, **kwargs):
+        if message.content == "first":
+            await asyncio.sleep(0.05)
+        delivered.append(message.content)
+
+    monkeypatch.setattr(MockChannel, "asend_message", send)
+
+    async def send_all():
+        # a channel without batches, like twilio
+        dispatcher = OutboundDispatcher(batch_size=1)
+        for content, to in (("first", "ana"), ("second", "ana"), ("other", "bia")):
+            await dispatcher.submit(MessageChannels.mock, Message(to=to, from_="bot", content=content))
+        await dispatcher.stop()
+
+    asyncio.run(send_all())
+    # bia doesn't wait for ana, the second message of ana waits for the first
+    assert delivered == ["other", "first", "second"]
+
+
+def test_batches_hold_one_message_per_recipient(monkeypatch):
+    batches = []
+
+    async def send_batch(self, messages, **kwargs):
+        batches.append([message.content for message in messages])
+        return [None] * len(messages)
+
+    async def send(self, message, **kwargs):
+        batches.append([message.content])
+
+    monkeypatch.setattr(MockChannel, "asend_batch", send_batch)
+    monkeypatch.setattr(MockChannel, "asend_message", send)
+
+    async def send_all():
+        dispatcher = OutboundDispatcher(batch_size=10)
+        for content, to in (("1", "ana"), ("2", "ana"), ("3", "bia"), ("4", "ana")):
+            await dispatcher.submit(MessageChannels.mock, Message(to=to, from_="bot", content=content))
+        await dispatcher.stop()
+
+    asyncio.run(send_all())
+    assert batches == [["1", "3"], ["2"], ["4"]]
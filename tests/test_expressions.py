@@ -0,0 +1,153 @@
+import pytest
+
+from blocks.split_based_on_variable_block import SplitVariableBlock
+from exceptions import InvalidFlowException
+from expressions import FUNCTIONS, Expression, ExpressionError, compile_expression, register_function
+from flow_registry import FlowTemplate
+from flows import BasicFlow
+from schemas import BlockStatus, MessageChannels
+from templates import Constant, compile_reference_template
+
+
+def evaluate(source, **scope):
+    return compile_expression(source).evaluate(scope)
+
+
+@pytest.mark.parametrize("source", ["len(x)", "upper(x)", "round(x)", "min(x, 1)", "x + 1", "-x", "x.y.z"])
+def test_null_in_null_out(source):
+    assert evaluate(source) is None
+
+
+def test_null_tolerant_functions():
+    assert evaluate("coalesce(x, 1)") == 1
+    assert evaluate("contains(x, 'a')") is False
+    assert evaluate("bool(x)") is False
+
+
+@pytest.mark.parametrize("source, expected", [
+    ("'10' > '9'", True),
+    ("x > 9", True),
+    ("x == 10", True),
+    ("x == '10.0'", True),
+    ("x + 1", 11),
+    ("x * '2'", 20),
+    ("x + '2'", "102"),
+    ("'abc' < 'abd'", True),
+    ("int('abc')", None),
+    ("x == 'nan'", False),
+    ("round(x + '.56', 1)", 10.6),
+    ("min(x, '9')", 9),
+    ("max([x, '9', 2])", 10),
+    ("x / (x - 10)", None),
+    ("x % int('0')", None),
+    ("str(x == '10')", "true"),
+])
+def test_numeric_strings(source, expected):
+    assert evaluate(source, x="10") == expected
+
+
+@pytest.mark.parametrize("source", ["1 / 0", "2 + (1 % 0)", "price *", "len(", "unknown_function(1)"])
+def test_invalid_expressions_fail_when_compiled(source):
+    with pytest.raises(ExpressionError):
+        compile_expression(source)
+
+
+def test_expression_marker():
+    assert isinstance(compile_reference_template("{{= price * 2 }}"), Expression)
+    assert isinstance(compile_reference_template("= not an expression"), Constant)
+    with pytest.raises(ValueError):
+        compile_reference_template("total: {{= price * 2 }}")
+
+
+def test_references_are_the_blocks_used():
+    references = compile_expression("lower(ask.inbound) + lookup.outbound.city + order.total").references()
+    assert [(reference.block_name, reference.attribute) for reference in references] == [("ask", "inbound"), ("lookup", "outbound")]
+
+
+def test_linter_checks_the_expression_references():
+    flow = {
+        "calc": {"block_type": "set_variables", "next_block_name": "calc", "is_final_block": True,
+                 "variables": {"answer": "{{= lower(missing.inbound) }}"}},
+    }
+    with pytest.raises(InvalidFlowException) as error:
+        FlowTemplate("references", "", flow)
+    assert [issue.code for issue in error.value.issues] == ["unknown_reference"]
+
+
+@pytest.mark.parametrize("source, expected", [
+    ("2 + 3 * 4 == 14", True),
+    ("'premium' if total > 1000 else 'standard'", "standard"),
+    ("not total > 1000 and tier not in ['gold', 'silver']", True),
+    ("order.items[1]", "pen"),
+    ("len(order.items) >= 2 or tier.level", True),
+    ("-total", -250),
+    ("'it\\'s' + ' ok'", "it's ok"),
+    ("matches(tier, '^(bronze|gold)$')", True),
+    ("coalesce(missing, tier)", "bronze"),
+])
+def test_evaluation(source, expected):
+    assert evaluate(source, total="250", tier="bronze", order='{"items": ["book", "pen"]}') == expected
+
+
+def test_type_errors_raise_when_evaluated():
+    expression = compile_expression("word * 2.5")
+    assert expression.evaluate({"word": "2"}) == 5.0
+    with pytest.raises(TypeError):
+        expression.evaluate({"word": "abc"})
+
+
+def test_only_the_block_attributes_are_read():
+    class Block:
+        inbound = "yes"
+        secret = "hidden"
+
+    assert evaluate("ask.inbound", ask=Block()) == "yes"
+    assert evaluate("ask.secret", ask=Block()) is None
+    with pytest.raises(ExpressionError):
+        compile_expression("ask.__class__")
+
+
+def test_register_function(monkeypatch):
+    # registered through monkeypatch first, so the test functions are dropped at the end
+    monkeypatch.setitem(FUNCTIONS, "double", None)
+    monkeypatch.setitem(FUNCTIONS, "or_zero", None)
+    register_function("double", lambda value: value * 2)
+    register_function("or_zero", lambda value: 0 if value is None else value, null_safe=False)
+
+    double = compile_expression("double(x)")
+    assert double.evaluate({"x": 4}) == 8
+    assert double.evaluate({}) is None
+    assert evaluate("or_zero(x)") == 0
+
+    # the compiled expressions keep the function they were compiled with
+    register_function("double", lambda value: value * 3)
+    assert double.evaluate({"x": 4}) == 8
+
+
+def test_split_condition_that_raises_follows_on_error():
+    block = SplitVariableBlock(name_in_flow="route", match_mode="expression",
+                               branches={"score * 2.5 > 1": "hot", "default": "menu", "on_error": "sorry"})
+
+    block.variables = {"score": "abc"}
+    assert block.run_block(None)["next_block_name"] == "sorry"
+    assert block.status == BlockStatus.failed
+
+
+def test_set_variables_expressions(write_flow, sent):
+    path = write_flow({
+        "ask": {"block_type": "send_and_reply", "sending_content": "How many?", "next_block_name": "save"},
+        "save": {"block_type": "set_variables", "next_block_name": "thanks", "variables": {
+            "quantity": "{{ask.inbound}}",
+            "total": "{{= quantity * price }}",
+            "tier": "{{= 'premium' if total > 1000 else 'standard' }}",
+            "answer": "{{= upper(strip(ask.inbound)) }}",
+        }},
+        "thanks": {"block_type": "single_message", "sending_content": "Thanks", "next_block_name": "end", "is_final_block": True},
+    })
+    flow = BasicFlow(flow_file=path, flow_name="order", curr_channel=MessageChannels.mock, from_="bot", to="ana",
+                     variables={"price": 300})
+    flow.run_flow()
+    flow.run_flow(" 4 ")
+
+    assert {key: flow.variables[key] for key in ("total", "tier", "answer")} == {"total": 1200, "tier": "premium", "answer": "4"}
+    assert sent == ["How many?", "Thanks"]
@@ -0,0 +1,85 @@
+import pytest
+
+from exceptions import InvalidFlowException
+from flow_registry import FlowTemplate
+
+
+def ask(next_block_name):
+    return {"block_type": "send_and_reply", "sending_content": "?", "next_block_name": next_block_name}
+
+
+def test_busy_loop_inside_a_cycle_with_a_send_and_reply_is_an_error():
+    # ask -> b -> c, c goes back to b ("1") or to ask (default). b <-> c never waits
+    flow = {
+        "ask": ask("b"),
+        "b": {"block_type": "set_variables", "next_block_name": "c", "variables": {"x": "1"}},
+        "c": {"block_type": "split_variable", "variable": "x", "branches": {"1": "b", "default": "ask"}},
+    }
+    with pytest.raises(InvalidFlowException) as error:
+        FlowTemplate("busy", "", flow)
+
+    codes = [issue.code for issue in error.value.issues]
+    assert codes == ["non_yielding_cycle"]
+
+
+def test_loop_through_a_send_and_reply_is_valid():
+    flow = {
+        "ask": ask("b"),
+        "b": {"block_type": "set_variables", "next_block_name": "c", "variables": {"x": "1"}},
+        "c": {"block_type": "split_variable", "variable": "x", "branches": {"1": "ask", "default": "ask"}},
+    }
+    assert FlowTemplate("loop", "", flow).issues == ()
+
+
+def issue_codes(flow: dict) -> list:
+    try:
+        return [issue.code for issue in FlowTemplate("lint", "", flow).issues]
+    except InvalidFlowException as error:
+        return [issue.code for issue in error.issues]
+
+
+def test_missing_blocks_are_errors():
+    flow = {
+        "ask": {**ask("route"), "reply_timeout": 10, "on_timeout": "nudge"},
+        "route": {"block_type": "split_variable", "variable": "x", "branches": {"1": "sales", "default": "ask"}},
+    }
+    assert issue_codes(flow) == ["missing_block", "missing_block"]
+
+
+def test_self_loop_without_a_send_and_reply_is_an_error():
+    flow = {"again": {"block_type": "set_variables", "next_block_name": "again", "variables": {"x": "1"}}}
+    assert issue_codes(flow) == ["non_yielding_cycle"]
+
+
+def test_warnings_do_not_stop_the_load():
+    flow = {
+        "save": {"block_type": "set_variables", "next_block_name": "ask", "variables": {"answer": "{{ask.inbound}}"}},
+        "ask": {**ask("end"), "is_final_block": True},
+        "orphan": {"block_type": "single_message", "sending_content": "never", "next_block_name": "ask"},
+    }
+    assert sorted(issue_codes(flow)) == ["reference_not_before", "unreachable"]
+
+
+def test_unknown_attribute_and_stream_target_are_errors():
+    flow = {
+        "llm": {"block_type": "http_request", "next_block_name": "save", "options": {"url": "http://llm"},
+                "stream": {"forward_to": "save"}},
+        "save": {"block_type": "set_variables", "next_block_name": "end", "is_final_block": True,
+                 "variables": {"answer": "{{llm.answer}}"}},
+    }
+    assert sorted(issue_codes(flow)) == ["invalid_stream_target", "unknown_reference"]
+
+
+def test_command_line_lints_the_files(tmp_path, capsys):
+    import json
+
+    from flow_graph import main
+
+    valid = tmp_path / "valid.json"
+    valid.write_text(json.dumps({"ask": {**ask("end"), "is_final_block": True}}))
+    broken = tmp_path / "broken.json"
+    broken.write_text(json.dumps({"ask": ask("nowhere")}))
+
+    assert main([str(valid)]) == 0
+    assert main([str(valid), str(broken)]) == 1
+    assert "[missing_block]" in capsys.readouterr().out
@@ -0,0 +1,144 @@
+import os
+
+import pytest
+
+from flow_registry import FlowRegistry
+from flows import BasicFlow
+from schemas import BlockStatus, MessageChannels
+from state_store import InMemoryStateStore
+
+GREETING = {
+    "hello": {"block_type": "single_message", "sending_content": "Hello!", "next_block_name": "ask"},
+    "ask": {"block_type": "send_and_reply", "sending_content": "Your name?", "next_block_name": "bye"},
+    "bye": {"block_type": "single_message", "sending_content": "Bye", "next_block_name": "end", "is_final_block": True},
+}
+
+
+def touch(path: str, step: int = 1):
+    """Move the mtime forward, the file systems of the tests can be too fast for it to change"""
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + step * 1_000_000_000))
+
+
+def test_flow_file_is_compiled_once(write_flow):
+    registry = FlowRegistry()
+    path = write_flow(GREETING)
+
+    template = registry.get(path)
+    assert registry.get(path) is template
+
+    # same content, new mtime: the hash says it's the same version
+    touch(path)
+    assert registry.get(path) is template
+
+
+def test_changed_flow_file_is_compiled_again(write_flow):
+    registry = FlowRegistry()
+    path = write_flow(GREETING)
+    template = registry.get(path)
+
+    write_flow({**GREETING, "hello": {**GREETING["hello"], "sending_content": "Hi!"}})
+    touch(path)
+    new_template = registry.get(path)
+
+    assert new_template is not template
+    assert new_template.version != template.version
+    assert registry.versions(path) == [template.version, new_template.version]
+
+
+def test_conversations_share_the_prototypes_but_not_the_state(write_flow, sent):
+    path = write_flow(GREETING)
+    first = BasicFlow(flow_file=path, flow_name="greeting", curr_channel=MessageChannels.mock, from_="bot", to="ana")
+    second = BasicFlow(flow_file=path, flow_name="greeting", curr_channel=MessageChannels.mock, from_="bot", to="bia")
+
+    first.run_flow()
+
+    assert first._template is second._template
+    assert first.get_block_by_name("ask").status == BlockStatus.running
+    assert second.get_block_by_name("ask").status == BlockStatus.ready
+    assert second.get_block_by_name("ask").to == "bia"
+    assert sent == ["Hello!", "Your name?"]
+
+
+def test_invalid_new_version_keeps_the_current_one(write_flow):
+    registry = FlowRegistry()
+    path = write_flow(GREETING)
+    template = registry.get(path)
+
+    write_flow({**GREETING, "hello": {**GREETING["hello"], "next_block_name": "missing"}})
+    touch(path)
+    assert registry.reload(path) is False
+    assert registry.get(path) is template
+
+
+def test_watcher_swaps_the_new_version_in(write_flow):
+    registry = FlowRegistry()
+    path = write_flow(GREETING)
+    template = registry.get(path)
+    watcher = registry.watch(interval=3600)
+    try:
+        write_flow({**GREETING, "hello": {**GREETING["hello"], "sending_content": "Hi!"}})
+        touch(path)
+        # the lookups don't check the file while the watcher runs
+        assert registry.get(path) is template
+        assert watcher.check() == [path]
+        assert registry.get(path).prototypes[0].sending_content == "Hi!"
+        assert watcher.check() == []
+    finally:
+        registry.stop_watching()
+
+
+def test_conversations_keep_their_version_and_migrate(write_flow, sent):
+    # BasicFlow compiles its flows in the shared registry
+    from flow_registry import registry
+
+    path = write_flow(GREETING)
+    store = InMemoryStateStore()
+    flow = BasicFlow(flow_file=path, flow_name="greeting", curr_channel=MessageChannels.mock, from_="bot", to="ana")
+    store.run_flow(flow)
+    old_version = flow.flow_version
+
+    renamed = {name: blocks for name, blocks in GREETING.items() if name != "ask"}
+    renamed["hello"] = {**GREETING["hello"], "next_block_name": "name"}
+    renamed["name"] = GREETING["ask"]
+    write_flow(renamed)
+    touch(path)
+    assert registry.reload(path)
+
+    # the saved conversation is still on its version, the new ones start on the current one
+    flow = store.find("bot", "ana")
+    assert flow.flow_version == old_version
+    assert BasicFlow(flow_file=path, flow_name="greeting", curr_channel=MessageChannels.mock,
+                     from_="bot", to="bia").flow_version != old_version
+
+    flow.migrate({"ask": "name"})
+    assert flow.curr_block_name == "name"
+    assert flow.get_block_by_name("name").status == BlockStatus.running
+    store.run_flow(flow, "Ana")
+    assert flow.get_block_by_name("name").inbound == "Ana"
+    assert sent == ["Hello!", "Your name?", "Bye"]
+
+
+def test_lost_versions_move_to_the_current_one_or_refuse(write_flow, sent, caplog):
+    from flow_registry import registry
+
+    path = write_flow(GREETING)
+    store = InMemoryStateStore()
+    flow = BasicFlow(flow_file=path, flow_name="greeting", curr_channel=MessageChannels.mock, from_="bot", to="ana")
+    store.run_flow(flow)
+
+    # a restart: the registry only knows the current version of the file
+    write_flow({**GREETING, "bye": {**GREETING["bye"], "sending_content": "See you"}})
+    touch(path)
+    registry.invalidate(path)
+    moved = store.find("bot", "ana")
+    assert moved.flow_version != flow.flow_version
+    assert moved.get_block_by_name("ask").status == BlockStatus.running
+    assert "is not available" in caplog.text
+
+    renamed = {name: blocks for name, blocks in GREETING.items() if name != "ask"}
+    write_flow({**renamed, "hello": {**GREETING["hello"], "next_block_name": "bye"}})
+    touch(path, 2)
+    registry.invalidate(path)
+    with pytest.raises(ValueError):
+        store.find("bot", "ana")
@@ -0,0 +1,47 @@
+import msgpack
+import pytest
+
+from flow_serialization import FORMAT_VERSION, dumps_flow, loads_flow
+from schemas import BlockStatus
+
+
+@pytest.fixture
+def flow(order_flow, sent):
+    return order_flow(variables={"name": "Ana"})
+
+
+def test_round_trip(flow):
+    flow.run_flow()
+    loaded = loads_flow(dumps_flow(flow))
+
+    assert loaded.snapshot() == flow.snapshot()
+    assert loaded.get_block_by_name("ask").status == BlockStatus.running
+    loaded.run_flow("42")
+    assert loaded.variables == {"name": "Ana", "order": "42", "question": "Order number?"}
+
+
+def test_only_the_changed_blocks_are_written(flow):
+    record = msgpack.unpackb(dumps_flow(flow))
+    assert record[0] == FORMAT_VERSION
+    assert record[13] == []
+
+    flow.run_flow()
+    record = msgpack.unpackb(dumps_flow(flow))
+    # name, status, inbound, outbound: no streamed text
+    assert [(block[0], block[2:]) for block in record[13]] == [("ask", [None, "Order number?"])]
+
+
+def test_streamed_text_is_written_only_when_there_is_some(flow):
+    flow.run_flow()
+    flow.set_block_state("ask", BlockStatus.running, None, "Order", "Order")
+    record = msgpack.unpackb(dumps_flow(flow))
+
+    assert [(block[0], block[2:]) for block in record[13]] == [("ask", [None, "Order", "Order"])]
+    assert loads_flow(dumps_flow(flow)).get_block_by_name("ask").streamed_content == "Order"
+
+
+def test_unknown_version_is_refused(flow):
+    record = msgpack.unpackb(dumps_flow(flow))
+    record[0] = FORMAT_VERSION + 1
+    with pytest.raises(ValueError):
+        loads_flow(msgpack.packb(record))
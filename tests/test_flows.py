@@ -0,0 +1,30 @@
+import pytest
+
+from flows import CompletedBlocks
+from schemas import BlockStatus
+
+
+def test_block_lookup_by_name(order_flow):
+    flow = order_flow()
+
+    block = flow.get_block_by_name("save")
+    assert block.name_in_flow == "save"
+    # the block is materialized once per run
+    assert flow.get_block_by_name("save") is block
+    with pytest.raises(ValueError):
+        flow.get_block_by_name("missing")
+
+
+def test_completed_blocks_are_the_successful_ones(order_flow, sent):
+    flow = order_flow()
+    flow.run_flow()
+    assert list(CompletedBlocks(flow)) == []
+
+    flow.run_flow("1234")
+
+    completed = CompletedBlocks(flow)
+    assert list(completed) == ["ask", "save", "thanks"]
+    assert completed["ask"].inbound == "1234"
+    assert "missing" not in completed
+    assert flow.variables == {"order": "1234", "question": "Order number?"}
+    assert flow.flow_status == BlockStatus.success
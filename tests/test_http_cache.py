@@ -0,0 +1,114 @@
+import pytest
+
+from blocks import http_request_block
+from blocks.http_request_block import HTTPBlock
+from http_cache import ResponseCache, MemoryCacheBackend
+
+
+class FakeResponse:
+    def __init__(self, status_code: int, body):
+        self.status_code = status_code
+        self.ok = status_code < 400
+        self.body = body
+
+    def json(self):
+        return self.body
+
+
+@pytest.fixture
+def responses(monkeypatch):
+    """Queue of the responses the pool returns, and the number of requests sent"""
+
+    queue = []
+    sent = []
+
+    def request(**kwargs):
+        sent.append(kwargs)
+        return queue.pop(0)
+
+    monkeypatch.setattr(http_request_block.http_pool, "request", request)
+    return queue, sent
+
+
+def cached_block(url: str) -> HTTPBlock:
+    # a max_entries of its own gives the test a cache no other test shares
+    return HTTPBlock(
+        name_in_flow="lookup",
+        next_block_name="next",
+        options={"method": "GET", "url": url},
+        cache={"ttl": 60, "max_entries": 7},
+    )
+
+
+def test_successful_json_responses_are_cached(responses):
+    queue, sent = responses
+    queue.append(FakeResponse(200, {"city": "Recife"}))
+    block = cached_block("https://api.test/ok")
+
+    assert block.send_request(block.build_request()) == {"city": "Recife"}
+    assert block.send_request(block.build_request()) == {"city": "Recife"}
+    assert len(sent) == 1
+
+
+def test_error_responses_are_not_cached(responses):
+    queue, sent = responses
+    queue.append(FakeResponse(503, {"error": "unavailable"}))
+    queue.append(FakeResponse(200, {"city": "Recife"}))
+    block = cached_block("https://api.test/flaky")
+
+    assert block.send_request(block.build_request()) == {"error": "unavailable"}
+    assert block.send_request(block.build_request()) == {"city": "Recife"}
+    assert block.send_request(block.build_request()) == {"city": "Recife"}
+    assert len(sent) == 2
+
+
+def test_cached_values_are_copies():
+    cache = ResponseCache(MemoryCacheBackend())
+    request = {"method": "GET", "url": "https://api.test/copy"}
+    cache.set(request, {"items": [1]})
+
+    hit, value = cache.get(request)
+    value["items"].append(2)
+    assert hit
+    assert cache.get(request) == (True, {"items": [1]})
+
+
+def test_expired_responses_are_dropped(monkeypatch):
+    import http_cache
+
+    now = [1000.0]
+    monkeypatch.setattr(http_cache.time, "time", lambda: now[0])
+    cache = ResponseCache(MemoryCacheBackend())
+    request = {"method": "GET", "url": "https://api.test/ttl"}
+    cache.set(request, {"ok": True}, ttl=60)
+
+    now[0] += 59
+    assert cache.get(request) == (True, {"ok": True})
+    now[0] += 2
+    assert cache.get(request) == (False, None)
+    assert len(cache.backend) == 0
+
+
+def test_least_recently_used_responses_are_evicted():
+    backend = MemoryCacheBackend(max_entries=2)
+    cache = ResponseCache(backend)
+    first, second, third = ({"url": f"https://api.test/{number}"} for number in range(3))
+    cache.set(first, 1)
+    cache.set(second, 2)
+
+    cache.get(first)
+    cache.set(third, 3)
+
+    assert cache.get(first) == (True, 1)
+    assert cache.get(second) == (False, None)
+    assert cache.get(third) == (True, 3)
+
+
+def test_disk_backend_keeps_the_responses(tmp_path):
+    from http_cache import DiskCacheBackend
+
+    path = str(tmp_path / "cache.sqlite3")
+    request = {"url": "https://api.test/disk"}
+    ResponseCache(DiskCacheBackend(path=path)).set(request, {"city": "Recife"})
+
+    assert ResponseCache(DiskCacheBackend(path=path)).get(request) == (True, {"city": "Recife"})
@@ -0,0 +1,76 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from blocks.http_request_block import HTTPBlock
+from http_client import DEFAULT_TIMEOUT, HTTPClientPool
+
+
+class JsonHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        body = json.dumps({"path": self.path}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def server_url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), JsonHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_one_session_per_host_and_settings():
+    pool = HTTPClientPool()
+
+    session = pool.get_session("https://api.example.com/users")
+    assert pool.get_session("https://api.example.com/orders?id=1") is session
+    assert pool.get_session("https://other.example.com/users") is not session
+    assert pool.get_session("https://api.example.com/users", retries=2) is not session
+
+
+def test_requests_reuse_the_connection(server_url):
+    pool = HTTPClientPool()
+    try:
+        for number in range(3):
+            assert pool.request("GET", f"{server_url}/{number}").json() == {"path": f"/{number}"}
+        assert pool.stats()[server_url] == {"requests": 3, "connections": 1, "reused": 2}
+    finally:
+        pool.close()
+
+
+def test_block_options_reach_the_pool():
+    block = HTTPBlock(
+        name_in_flow="lookup",
+        next_block_name="next",
+        options={"url": "https://api.example.com/{user_id}", "timeout": 5, "retries": 2},
+        variables={"user_id": 7},
+    )
+    request = block.build_request()
+
+    assert request["url"] == "https://api.example.com/7"
+    assert (request["method"], request["timeout"], request["retries"]) == ("GET", 5, 2)
+    assert HTTPBlock(name_in_flow="x", next_block_name="y").build_request()["timeout"] == DEFAULT_TIMEOUT
+
+
+def test_exhausted_pool_does_not_wait_for_a_connection(server_url):
+    pool = HTTPClientPool()
+    try:
+        # the streamed response keeps the only pooled connection checked out
+        with pool.request("GET", f"{server_url}/held", stream=True, max_connections=1):
+            response = pool.request("GET", f"{server_url}/other", timeout=5, max_connections=1)
+            assert response.json() == {"path": "/other"}
+    finally:
+        pool.close()
@@ -0,0 +1,92 @@
+from flows import BasicFlow
+from inbound import Coalescer, DedupeIndex, InboundProcessor
+from schemas import Message, MessageChannels
+from state_store import InMemoryStateStore
+
+
+def reply(content: str, message_id=None, from_: str = "ana") -> Message:
+    return Message(content=content, to="bot", from_=from_, message_id=message_id)
+
+
+def test_dedupe_forgets_the_ids_after_the_ttl():
+    dedupe = DedupeIndex(ttl=10)
+    assert not dedupe.seen("SM1", now=0)
+    assert dedupe.seen("SM1", now=5)
+    assert not dedupe.seen("SM1", now=11)
+
+
+def test_dedupe_keeps_at_most_max_entries():
+    dedupe = DedupeIndex(max_entries=2)
+    for message_id in ("SM1", "SM2", "SM3"):
+        dedupe.seen(message_id, now=0)
+
+    assert len(dedupe) == 2
+    assert "SM1" not in dedupe and "SM3" in dedupe
+
+
+def test_burst_is_released_when_the_conversation_is_quiet():
+    coalescer = Coalescer(window=2, max_wait=10)
+    coalescer.add(reply("hi", "SM1"), now=0)
+    coalescer.add(reply("I need help", "SM2"), now=1)
+    coalescer.add(reply("hello", from_="bia"), now=1)
+
+    assert coalescer.pop_due(now=2.5) == []
+    assert coalescer.seconds_to_next(now=2.5) == 0.5
+    [ana, bia] = coalescer.pop_due(now=3)
+    assert (ana.content, ana.message_id) == ("hi\nI need help", "SM2")
+    assert bia.content == "hello"
+    assert len(coalescer) == 0
+
+
+def test_burst_waits_at_most_max_wait():
+    coalescer = Coalescer(window=2, max_wait=5)
+    for second in range(5):
+        coalescer.add(reply(str(second)), now=second)
+
+    [joined] = coalescer.pop_due(now=5)
+    assert joined.content == "0\n1\n2\n3\n4"
+
+
+def test_processor_drops_duplicates_and_joins_the_burst():
+    handled = []
+    processor = InboundProcessor(handled.append, dedupe=DedupeIndex(), coalescer=Coalescer(window=2))
+
+    assert processor.receive(reply("hi", "SM1"), now=0)
+    assert not processor.receive(reply("hi", "SM1"), now=0.5)
+    assert processor.receive(reply("with my order", "SM2"), now=1)
+    assert processor.run_due(now=2) == 0
+    assert processor.run_due(now=3) == 1
+
+    assert [message.content for message in handled] == ["hi\nwith my order"]
+    assert processor.stats() == {"received": 3, "duplicates": 1, "handled": 1, "held": 0}
+
+
+def test_flush_handles_the_held_messages_and_handler_errors_are_logged():
+    def fail(message):
+        raise RuntimeError("flow failed")
+    processor = InboundProcessor(fail, coalescer=Coalescer(window=60))
+    processor.receive(reply("hi"))
+
+    assert processor.flush() == 1
+    assert processor.stats()["handled"] == 1
+
+
+def test_waiting_block_gets_the_whole_answer(write_flow, sent):
+    path = write_flow({
+        "ask": {"block_type": "send_and_reply", "sending_content": "What do you need?", "next_block_name": "thanks"},
+        "thanks": {"block_type": "single_message", "sending_content": "Thanks", "next_block_name": "end", "is_final_block": True},
+    })
+    store = InMemoryStateStore()
+    store.run_flow(BasicFlow(flow_file=path, flow_name="help", curr_channel=MessageChannels.mock, from_="bot", to="ana"))
+
+    processor = InboundProcessor(
+        handler=lambda message: store.run_flow(store.load_for_message(message), message.content),
+        coalescer=Coalescer(window=2),
+    )
+    processor.receive(reply("hi"), now=0)
+    processor.receive(reply("with my order"), now=1)
+    processor.run_due(now=10)
+
+    # the flow ran once, with the whole answer
+    assert sent == ["What do you need?", "Thanks"]
+    assert store.find("bot", "ana").get_block_by_name("ask").inbound == "hi\nwith my order"
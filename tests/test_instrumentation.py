@@ -0,0 +1,66 @@
+import pytest
+
+from instrumentation import FlowStats, Histogram, add_hook, remove_hook
+
+# the split has no variable to read and no on_error
+BROKEN_ROUTE = {
+    "ask": {"block_type": "send_and_reply", "sending_content": "Order number?", "next_block_name": "route"},
+    "route": {"block_type": "split_variable", "variable": "missing", "branches": {"default": "ask"}},
+}
+
+
+@pytest.fixture
+def stats():
+    stats = FlowStats()
+    add_hook(stats)
+    yield stats
+    remove_hook(stats)
+
+
+def test_histogram_quantiles():
+    histogram = Histogram(buckets=(0.1, 1, 10))
+    for value in (0.05, 0.05, 0.5, 5, 50):
+        histogram.observe(value)
+
+    assert histogram.quantile(0.4) == 0.1
+    assert histogram.quantile(0.6) == 1
+    assert histogram.quantile(1) == float("inf")
+    assert histogram.to_dict()["buckets"] == [(0.1, 2), (1, 3), (10, 4), (float("inf"), 5)]
+
+
+def test_flow_stats_count_runs_continues_and_failures(stats, order_flow, sent):
+    flow = order_flow(BROKEN_ROUTE)
+    flow.run_flow()
+    flow.run_flow("42")
+
+    snapshot = stats.snapshot()
+    assert snapshot["SendReplyBlock"]["runs"] == 1
+    assert snapshot["SendReplyBlock"]["continues"] == 1
+    assert snapshot["SendReplyBlock"]["duration"]["count"] == 2
+    # the split has no variable and no on_error: the flow stops there
+    assert snapshot["SplitVariableBlock"]["failures"] == 1
+
+    text = stats.export_prometheus()
+    assert 'flow_block_executions_total{block_type="SendReplyBlock",kind="continue"} 1' in text
+    assert 'flow_block_duration_seconds_count{block_type="SplitVariableBlock"} 1' in text
+
+
+def test_hooks_see_the_block_errors(order_flow):
+    errors = []
+
+    class Hook:
+        def on_block_start(self, flow, block, action):
+            pass
+
+        def on_block_end(self, flow, block, action, duration, error):
+            errors.append(error)
+
+    flow = order_flow(BROKEN_ROUTE, curr_channel=None)
+    hook = Hook()
+    add_hook(hook)
+    try:
+        with pytest.raises(Exception):
+            flow.run_flow()
+    finally:
+        remove_hook(hook)
+    assert len(errors) == 1 and errors[0] is not None
@@ -0,0 +1,200 @@
+import asyncio
+import logging
+import os
+import subprocess
+import sys
+
+import pytest
+
+from dispatcher import OutboundDispatcher, set_dispatcher
+from journal import SEGMENT_SUFFIX, SENT, STATE, Journal, JournaledStateStore
+from message_channels.mock_channel import MockChannel
+from schemas import BlockStatus
+from state_store import FileStateStore, InMemoryStateStore
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+GREETING = {
+    "hello": {"block_type": "single_message", "sending_content": "Hello", "next_block_name": "menu"},
+    "menu": {"block_type": "single_message", "sending_content": "Menu", "next_block_name": "bye"},
+    "bye": {"block_type": "single_message", "sending_content": "Bye", "next_block_name": "end", "is_final_block": True},
+}
+
+# runs the greeting through a journaled store and stops the process (no cleanup, like a
+# crash) on the message number `crash_at`, or right after the run when it is 0
+CRASH = """
+import os, sys
+from flows import BasicFlow
+from journal import JournaledStateStore
+from message_channels.mock_channel import MockChannel
+from schemas import MessageChannels
+from state_store import FileStateStore
+
+flow_file, directory, crash_at = sys.argv[1], sys.argv[2], int(sys.argv[3])
+sent = []
+
+def send_message(self, message, **kwargs):
+    if len(sent) + 1 == crash_at:
+        os._exit(3)
+    sent.append(message.content)
+    print(message.content, flush=True)
+
+MockChannel.send_message = send_message
+store = JournaledStateStore(FileStateStore(os.path.join(directory, "states")), os.path.join(directory, "journal"), checkpoint_every=0)
+store.run_flow(BasicFlow(flow_file=flow_file, flow_name="greeting", curr_channel=MessageChannels.mock, from_="bot", to="ana"))
+os._exit(3)
+"""
+
+
+def crash(path: str, directory, crash_at: int) -> list:
+    """Messages delivered by a process that crashed"""
+    result = subprocess.run([sys.executable, "-c", CRASH, path, str(directory), str(crash_at)],
+                            cwd=ROOT, capture_output=True, text=True)
+    assert result.returncode == 3, result.stderr
+    return result.stdout.split()
+
+
+@pytest.fixture
+def open_store(tmp_path):
+    """Open a journaled store of the test, closed at the end"""
+
+    stores = []
+
+    def open_(directory=tmp_path, **options) -> JournaledStateStore:
+        options.setdefault("checkpoint_every", 0)
+        store = JournaledStateStore(FileStateStore(os.path.join(directory, "states")),
+                                    os.path.join(directory, "journal"), **options)
+        stores.append(store)
+        return store
+    yield open_
+    for store in stores:
+        store.close()
+
+
+def test_journal_survives_a_torn_record(tmp_path):
+    journal = Journal(str(tmp_path))
+    journal.commit(journal.append(STATE, "flow", ["bot", "ana", b"state", None]))
+    journal.close()
+
+    [segment] = [name for name in os.listdir(tmp_path) if name.endswith(SEGMENT_SUFFIX)]
+    with open(tmp_path / segment, "ab") as file:
+        file.write(b"\x20\x00\x00\x00torn")
+
+    journal = Journal(str(tmp_path))
+    assert [(record.lsn, record.kind) for record in journal.read()] == [(1, STATE)]
+    # the torn tail is overwritten by the next record
+    journal.commit(journal.append(STATE, "flow", ["bot", "ana", b"newer", None]))
+    assert [record.lsn for record in journal.read()] == [1, 2]
+    journal.close()
+
+
+def test_crash_in_a_send_resends_only_the_message_in_doubt(write_flow, tmp_path, open_store, sent, caplog):
+    path = write_flow(GREETING)
+    assert crash(path, tmp_path, crash_at=2) == ["Hello"]
+
+    with caplog.at_level(logging.WARNING):
+        [resumed] = open_store().recover()
+
+    # Hello was delivered before the crash, Menu may or may not have been
+    assert sent == ["Menu", "Bye"]
+    assert resumed.flow_status == BlockStatus.success
+    assert "was being sent when the process stopped" in caplog.text
+
+
+def test_crash_after_the_run_replays_the_saved_state(write_flow, tmp_path, open_store, sent):
+    path = write_flow(GREETING)
+    assert crash(path, tmp_path, crash_at=0) == ["Hello", "Menu", "Bye"]
+
+    store = open_store()
+    assert store.recover() == []
+    assert sent == []
+    # the state was only in the journal, the recovery checkpoint wrote it to the inner store
+    assert store.store.find("bot", "ana").flow_status == BlockStatus.success
+
+
+def test_failed_run_is_not_run_again(order_flow, open_store, monkeypatch):
+    def fail(self, message, **kwargs):
+        raise ConnectionError("channel down")
+    monkeypatch.setattr(MockChannel, "send_message", fail)
+
+    store = open_store()
+    flow = order_flow(GREETING)
+    with pytest.raises(ConnectionError):
+        store.run_flow(flow)
+    store.close()
+
+    assert open_store().recover() == []
+
+
+def test_stores_journal_only_their_own_runs(order_flow, tmp_path, open_store, sent):
+    first, second = open_store(tmp_path / "first"), open_store(tmp_path / "second")
+
+    first.run_flow(order_flow(GREETING))
+    assert sent == ["Hello", "Menu", "Bye"]
+    assert [record.kind for record in first.journal.read() if record.kind == SENT] == [SENT] * 3
+    assert list(second.journal.read()) == []
+
+
+def test_states_are_read_from_memory_until_the_checkpoint(order_flow, tmp_path, sent):
+    inner = InMemoryStateStore()
+    store = JournaledStateStore(inner, str(tmp_path / "journal"), checkpoint_every=2)
+    try:
+        flow = order_flow(GREETING)
+        store.run_flow(flow)
+        assert len(inner) == 0
+        assert store.load(flow.flow_id).flow_status == BlockStatus.success
+
+        store.run_flow(order_flow(GREETING, to="bia"))
+        assert len(inner) == 2
+    finally:
+        store.close()
+
+
+def run_with_dispatcher(store, flow, stop_timeout=None):
+    """Run the flow through the store, its messages queued on an outbound dispatcher"""
+
+    async def run():
+        dispatcher = OutboundDispatcher(batch_size=1)
+        set_dispatcher(dispatcher)
+        try:
+            await store.arun_flow(flow)
+            await asyncio.wait_for(dispatcher.stop(), stop_timeout)
+        finally:
+            set_dispatcher(None)
+
+    asyncio.run(run())
+
+
+def test_queued_messages_are_journaled_when_delivered(order_flow, open_store, sent):
+    store = open_store()
+    run_with_dispatcher(store, order_flow(GREETING))
+
+    assert sent == ["Hello", "Menu", "Bye"]
+    assert store._queued == {}
+    store.close()
+    sent.clear()
+    assert open_store().recover() == [] and sent == []
+
+
+def test_undelivered_queued_messages_are_sent_again(order_flow, open_store, sent, caplog, monkeypatch):
+    async def no_answer(self, message, **kwargs):
+        await asyncio.sleep(3600)
+
+    with monkeypatch.context() as patch:
+        patch.setattr(MockChannel, "asend_message", no_answer)
+        store = open_store()
+        # the provider never answers: the run ends with its messages queued, and
+        # the deliveries are cancelled with the loop, like in a crash
+        with pytest.raises(asyncio.TimeoutError):
+            run_with_dispatcher(store, order_flow(GREETING), stop_timeout=0.2)
+    assert sent == []
+    # the run is over, the checkpoint keeps the messages waiting for their delivery
+    store.close()
+
+    with caplog.at_level(logging.WARNING):
+        assert open_store().recover() == []
+    assert sent == ["Hello", "Menu", "Bye"]
+    assert "was queued and not delivered" in caplog.text
+
+    sent.clear()
+    assert open_store().recover() == [] and sent == []
@@ -0,0 +1,117 @@
+import threading
+
+import pytest
+
+from blocks import http_request_block
+from blocks.parallel_http_block import ParallelHTTPBlock
+from schemas import BlockStatus
+
+
+class FakeResponse:
+    ok = True
+
+    def __init__(self, body):
+        self.body = body
+
+    def json(self):
+        return self.body
+
+
+@pytest.fixture
+def slow_pool(monkeypatch):
+    """The pool answers /slow only after the event is set. Returns the event and the requests sent"""
+
+    release = threading.Event()
+    sent = []
+
+    def request(**kwargs):
+        sent.append(kwargs)
+        if "slow" in kwargs["url"]:
+            release.wait(5)
+        return FakeResponse({"url": kwargs["url"]})
+
+    monkeypatch.setattr(http_request_block.http_pool, "request", request)
+    yield release, sent
+    release.set()
+
+
+def parallel_block(urls, **fields) -> ParallelHTTPBlock:
+    return ParallelHTTPBlock(
+        name_in_flow="lookups",
+        next_block_name="next",
+        on_error="failed",
+        requests={name: {"options": {"url": url}} for name, url in urls.items()},
+        **fields,
+    )
+
+
+def test_quorum_must_be_reachable():
+    with pytest.raises(ValueError):
+        parallel_block({"a": "http://a", "b": "http://b"}, policy="quorum", quorum=3)
+
+
+def test_any_policy_continues_with_the_first_answer(slow_pool):
+    block = parallel_block({"fast": "http://fast", "slow": "http://slow"}, policy="any")
+
+    assert block.run_block()["next_block_name"] == "next"
+    assert block.outbound == {"fast": {"url": "http://fast"}, "slow": None}
+
+
+def test_request_timeout_is_capped_by_the_block_timeout(slow_pool):
+    _, sent = slow_pool
+    block = parallel_block({"fast": "http://fast"}, timeout=2)
+    block.run_block()
+    assert sent[0]["timeout"] == 2
+
+
+def test_abandoned_requests_are_capped_by_max_in_flight(slow_pool):
+    release, _ = slow_pool
+    prototype = parallel_block({"slow": "http://slow", "other": "http://slow/other"}, timeout=0.05, max_in_flight=2)
+
+    first = prototype.model_copy()
+    first.run_block()
+    assert first.status == BlockStatus.failed
+
+    # the first conversation's requests are still running: the block fails right away
+    second = prototype.model_copy()
+    second.run_block()
+    assert all(isinstance(result, RuntimeError) for result in second.outbound.values())
+
+    # once they finish the slots are free again
+    release.set()
+    for _ in range(2):
+        assert prototype._in_flight.acquire(timeout=5)
+    for _ in range(2):
+        prototype._in_flight.release()
+    third = prototype.model_copy()
+    third.run_block()
+    assert third.status == BlockStatus.success
+
+
+def test_failed_policy_goes_to_on_error(monkeypatch):
+    def request(**kwargs):
+        if "down" in kwargs["url"]:
+            raise ConnectionError("down")
+        return FakeResponse({"url": kwargs["url"]})
+
+    monkeypatch.setattr(http_request_block.http_pool, "request", request)
+    block = parallel_block({"up": "http://up", "down": "http://down"})
+
+    assert block.run_block()["next_block_name"] == "failed"
+    assert block.status == BlockStatus.failed
+    assert isinstance(block.outbound["down"], ConnectionError)
+
+    quorum = parallel_block({"up": "http://up", "down": "http://down"}, policy="quorum", quorum=1)
+    assert quorum.run_block()["next_block_name"] == "next"
+
+
+def test_async_run_waits_for_every_request(slow_pool):
+    import asyncio
+
+    release, sent = slow_pool
+    release.set()
+    block = parallel_block({"a": "http://a", "b": "http://slow/b"})
+
+    assert asyncio.run(block.arun_block())["next_block_name"] == "next"
+    assert block.outbound == {"a": {"url": "http://a"}, "b": {"url": "http://slow/b"}}
+    assert len(sent) == 2
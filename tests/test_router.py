@@ -0,0 +1,61 @@
+import functools
+
+import pytest
+
+from router import InboundRouter, conversation_worker, handle_message
+from schemas import BlockStatus, Message, MessageChannels
+from state_store import InMemoryStateStore, SQLiteStateStore
+
+ECHO = {
+    "ask": {"block_type": "send_and_reply", "sending_content": "Say something", "next_block_name": "save"},
+    "save": {"block_type": "set_variables", "next_block_name": "end", "is_final_block": True,
+             "variables": {"said": "{{ask.inbound}}"}},
+}
+
+
+def inbound(user: str, content: str) -> Message:
+    return Message(from_=user, to="bot", content=content)
+
+
+def test_a_conversation_always_goes_to_the_same_worker():
+    workers = [conversation_worker("bot", f"user{number}", 4) for number in range(100)]
+
+    assert workers == [conversation_worker("bot", f"user{number}", 4) for number in range(100)]
+    assert set(workers) == {0, 1, 2, 3}
+
+
+def test_handle_message_starts_and_resumes_the_conversation(write_flow, sent):
+    store = InMemoryStateStore()
+    path = write_flow(ECHO)
+
+    first = handle_message(store, inbound("ana", "hi"), path, "echo", MessageChannels.mock)
+    second = handle_message(store, inbound("ana", "hello"), path, "echo", MessageChannels.mock)
+
+    assert second.flow_id == first.flow_id
+    assert second.flow_status == BlockStatus.success
+    assert second.variables == {"said": "hello"}
+
+    # a finished conversation starts again
+    third = handle_message(store, inbound("ana", "again"), path, "echo", MessageChannels.mock)
+    assert third.flow_id != first.flow_id
+
+
+def test_router_runs_the_conversations_on_the_workers(write_flow, tmp_path):
+    path = write_flow(ECHO)
+    database = str(tmp_path / "states.sqlite3")
+    router = InboundRouter(path, functools.partial(SQLiteStateStore, database), channel=MessageChannels.mock, workers=2)
+
+    with pytest.raises(RuntimeError):
+        router.submit(inbound("ana", "hi"))
+
+    router.start()
+    users = [f"user{number}" for number in range(6)]
+    for user in users:
+        router.submit(inbound(user, "hi"))
+    for user in users:
+        router.submit(inbound(user, f"I am {user}"))
+    router.stop(timeout=30)
+
+    store = SQLiteStateStore(database)
+    for user in users:
+        assert store.find("bot", user).variables == {"said": f"I am {user}"}
@@ -0,0 +1,60 @@
+import pytest
+
+from blocks.split_based_on_variable_block import SplitVariableBlock
+from schemas import BlockStatus
+
+
+def split(match_mode: str, branches: dict, variable="answer") -> SplitVariableBlock:
+    return SplitVariableBlock(
+        name_in_flow="route",
+        variable=variable,
+        match_mode=match_mode,
+        branches={**branches, "default": "menu", "on_error": "sorry"},
+    )
+
+
+def route(block: SplitVariableBlock, **variables) -> str:
+    block.variables = variables
+    return block.run_block(None)["next_block_name"]
+
+
+@pytest.mark.parametrize("match_mode, branches, value, expected", [
+    ("exact", {"1": "support", "2": "sales"}, "2", "sales"),
+    ("exact", {"1": "support", "2": "sales"}, 2, "sales"),
+    ("exact", {"1": "support"}, " 1", "menu"),
+    ("normalized", {"Sales Team": "sales"}, "  sales   TEAM ", "sales"),
+    ("regex", {"^(yes|sim)$": "confirm", "no": "cancel"}, "sim", "confirm"),
+    ("regex", {"^(yes|sim)$": "confirm", "no": "cancel"}, "I said no", "cancel"),
+    ("range", {"..18": "minor", "18..65": "adult", "65..": "senior"}, "17.5", "minor"),
+    ("range", {"..18": "minor", "18..65": "adult", "65..": "senior"}, 18, "adult"),
+    ("range", {"..18": "minor", "18..65": "adult", "65..": "senior"}, "65", "senior"),
+    ("range", {"..18": "minor"}, "old", "menu"),
+])
+def test_match_modes(match_mode, branches, value, expected):
+    assert route(split(match_mode, branches), answer=value) == expected
+
+
+def test_missing_variable_follows_on_error():
+    block = split("exact", {"1": "support"})
+    assert route(block) == "sorry"
+    assert block.status == BlockStatus.failed
+
+
+def test_expression_conditions_in_file_order():
+    block = split("expression", {"score > 0.8 and intent == 'sales'": "hot", "score > 0.5": "warm"}, variable=None)
+
+    assert route(block, score="0.9", intent="sales") == "hot"
+    assert route(block, score=0.9, intent="support") == "warm"
+    assert route(block, score=0.1) == "menu"
+    assert route(block) == "menu"
+
+
+@pytest.mark.parametrize("fields", [
+    {"match_mode": "fuzzy", "variable": "x"},
+    {"match_mode": "range", "variable": "x", "branches": {"18-65": "adult"}},
+    {"match_mode": "regex"},
+    {"match_mode": "expression", "branches": {"score >": "hot"}},
+])
+def test_invalid_blocks_fail_when_created(fields):
+    with pytest.raises(ValueError):
+        SplitVariableBlock(**{"name_in_flow": "route", "branches": {"1": "a"}, **fields})
@@ -0,0 +1,50 @@
+import asyncio
+
+import pytest
+
+from schemas import BlockStatus, Message
+from state_store import FileStateStore, InMemoryStateStore, SQLiteStateStore
+
+
+@pytest.fixture(params=["memory", "sqlite", "file"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return InMemoryStateStore()
+    if request.param == "sqlite":
+        return SQLiteStateStore(str(tmp_path / "states.sqlite3"))
+    return FileStateStore(str(tmp_path / "states"))
+
+
+def test_conversation_resumes_from_the_inbound_message(store, order_flow, sent):
+    flow = order_flow()
+    store.run_flow(flow)
+    store.run_flow(order_flow(to="bia"))
+
+    resumed = store.load_for_message(Message(from_="ana", to="bot", content="42"))
+    assert resumed.flow_id == flow.flow_id
+    assert resumed.get_block_by_name("ask").status == BlockStatus.running
+
+    store.run_flow(resumed, "42")
+    assert store.load(flow.flow_id).variables == {"order": "42", "question": "Order number?"}
+    assert store.load_for_message(Message(from_="nobody", to="bot", content="hi")) is None
+
+
+def test_waiting_flows_are_indexed_by_deadline(store, order_flow, sent):
+    flow = order_flow()
+    asyncio.run(store.arun_flow(flow))
+
+    [(flow_id, from_, to, wake_at)] = store.get_deadlines()
+    assert (flow_id, from_, to) == (flow.flow_id, "bot", "ana")
+    assert wake_at == flow.wait_deadline
+
+    store.run_flow(flow, "42")
+    assert store.get_deadlines() == []
+
+
+def test_deleted_flows_are_gone(store, order_flow, sent):
+    flow = order_flow()
+    store.run_flow(flow)
+    store.delete(flow.flow_id)
+
+    assert store.load(flow.flow_id) is None
+    assert store.find("bot", "ana") is None
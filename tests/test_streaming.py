@@ -0,0 +1,102 @@
+import asyncio
+import json
+
+import pytest
+
+from blocks import http_request_block
+from dispatcher import OutboundDispatcher, set_dispatcher
+from flow_serialization import dumps_flow, loads_flow
+from flows import BasicFlow
+from schemas import MessageChannels
+from streaming import TextChunker, iter_stream_text
+
+STREAM = {
+    "llm": {"block_type": "http_request", "next_block_name": "answer",
+            "options": {"url": "http://llm"}, "stream": {"forward_to": "answer", "content_path": "choices.0.delta.content", "min_chars": 10}},
+    "answer": {"block_type": "single_message", "sending_content": "unused", "next_block_name": "end",
+               "is_final_block": True},
+}
+
+
+class FakeStream:
+    """A server-sent events response"""
+
+    def __init__(self, words):
+        self.lines = ["data: " + json.dumps({"choices": [{"delta": {"content": word}}]}) for word in words]
+        self.lines += ["", ": keep-alive", "data: [DONE]", "data: ignored"]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def raise_for_status(self):
+        pass
+
+    def iter_lines(self, decode_unicode=False):
+        return iter(self.lines)
+
+
+@pytest.fixture
+def flow(write_flow):
+    return BasicFlow(flow_file=write_flow(STREAM), flow_name="stream", curr_channel=MessageChannels.mock, from_="bot", to="user")
+
+
+def test_chunks_end_on_sentences():
+    chunker = TextChunker(min_chars=10, max_chars=30)
+    chunks = []
+    for piece in ("Hello there", " friend. How are", " you doing today? A very long sentence without an end"):
+        chunks += chunker.feed(piece)
+
+    assert chunks == ["Hello there friend. ", "How are you doing today? ", "A very long sentence without "]
+    assert chunker.flush() == "an end"
+
+
+def test_sse_text_stops_at_done():
+    texts = iter_stream_text(FakeStream(["Hel", "lo"]), format="sse", content_path="choices.0.delta.content")
+    assert list(texts) == ["Hel", "lo"]
+
+
+def test_streamed_answer_is_sent_once(flow, sent, monkeypatch):
+    words = "The answer is streamed. It arrives in chunks. Bye.".split(" ")
+    monkeypatch.setattr(http_request_block.http_pool, "request", lambda **kwargs: FakeStream(word + " " for word in words))
+
+    flow.run_flow()
+
+    assert sent == ["The answer is streamed.", "It arrives in chunks.", "Bye."]
+    assert flow.get_block_by_name("answer").outbound == "The answer is streamed. It arrives in chunks. Bye."
+
+
+def test_streamed_text_is_saved_with_the_conversation(flow, sent):
+    flow.get_block_by_name("answer").send_chunk("Hello there. ")
+    flow._release_blocks()
+
+    loaded = loads_flow(dumps_flow(flow))
+    loaded.curr_block_name = "answer"
+    loaded.run_flow()
+
+    # the chunk went out once, before the save, and the block didn't send its own message
+    assert sent == ["Hello there."]
+    assert loaded.get_block_by_name("answer").outbound == "Hello there."
+
+
+def test_chunks_go_through_the_dispatcher_in_order(flow, sent):
+    answer = flow.get_block_by_name("answer")
+
+    async def stream():
+        dispatcher = OutboundDispatcher()
+        set_dispatcher(dispatcher)
+        try:
+            send = answer.chunk_sender(asyncio.get_running_loop())
+            # the http block reads the stream in a worker thread
+            await asyncio.to_thread(lambda: [send(chunk) for chunk in ("One. ", "Two. ", "Three.")])
+            await dispatcher.stop()
+        finally:
+            set_dispatcher(None)
+        return dispatcher.stats()
+
+    stats = asyncio.run(stream())
+    assert sent == ["One.", "Two.", "Three."]
+    assert stats["sent"] == 3
+    assert answer.pop_streamed_content() == "One. Two. Three."
@@ -0,0 +1,56 @@
+import pytest
+
+from templates import Constant, Interpolation, Reference, compile_format_template, compile_reference_template
+
+BLOCKS = {
+    ("cep", "outbound"): {"city": "Recife", "streets": [{"name": "Rua A"}]},
+    ("llm", "outbound"): '{"choices": [{"message": {"content": "hi"}}]}',
+    ("ask", "inbound"): "Ana",
+}
+
+
+def lookup(block_name, attribute):
+    return BLOCKS[(block_name, attribute)]
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("{{cep.outbound.city}}", "Recife"),
+    ("{{ cep.outbound.streets[0].name }}", "Rua A"),
+    ("{{cep.outbound.streets.0.name}}", "Rua A"),
+    ("{{llm.outbound.choices[0].message.content}}", "hi"),
+    ("{{cep.outbound}}", BLOCKS[("cep", "outbound")]),
+    ("{{cep.outbound.state|PE}}", "PE"),
+    ("{{cep.outbound.zip|0}}", 0),
+    ("Hello {{ask.inbound}} from {{cep.outbound.city}}!", "Hello Ana from Recife!"),
+    ("no references", "no references"),
+])
+def test_reference_templates(value, expected):
+    assert compile_reference_template(value).render(lookup) == expected
+
+
+def test_missing_path_without_default_raises():
+    with pytest.raises(KeyError):
+        compile_reference_template("{{cep.outbound.state}}").render(lookup)
+
+
+def test_compiled_types_and_references():
+    assert isinstance(compile_reference_template(12), Constant)
+    assert isinstance(compile_reference_template("{{ask.inbound}}"), Reference)
+    interpolation = compile_reference_template("{{ask.inbound}} in {{cep.outbound.city}}")
+    assert isinstance(interpolation, Interpolation)
+    assert [(reference.block_name, reference.attribute) for reference in interpolation.references()] == [
+        ("ask", "inbound"), ("cep", "outbound"),
+    ]
+    with pytest.raises(ValueError):
+        compile_reference_template("{{ask}}")
+
+
+def test_format_templates_leave_the_source_alone():
+    source = {"url": "https://api.test/users/{user_id}", "body": [{"name": "{name!r}"}], "size": 2}
+    template = compile_format_template(source)
+
+    assert template.render({"user_id": 7, "name": "Ana"}) == {
+        "url": "https://api.test/users/7", "body": [{"name": "'Ana'"}], "size": 2,
+    }
+    assert template.render({"user_id": 8, "name": "Bia"})["url"] == "https://api.test/users/8"
+    assert source["url"] == "https://api.test/users/{user_id}"
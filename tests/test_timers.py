@@ -0,0 +1,100 @@
+from schemas import BlockStatus
+from state_store import InMemoryStateStore, SQLiteStateStore
+from timers import ReplyTimeouts, TimerHeap
+
+# asks again after a reminder when the order number doesn't come in time
+NUDGE = {
+    "ask": {"block_type": "send_and_reply", "sending_content": "Order number?", "next_block_name": "thanks",
+            "reply_timeout": 60, "on_timeout": "nudge"},
+    "nudge": {"block_type": "single_message", "sending_content": "Still there?", "next_block_name": "ask"},
+    "thanks": {"block_type": "single_message", "sending_content": "Thanks", "next_block_name": "end", "is_final_block": True},
+}
+
+
+def test_timer_heap_keeps_the_last_deadline_of_each_key():
+    timers = TimerHeap()
+    timers.schedule("a", 30)
+    timers.schedule("b", 10)
+    timers.schedule("a", 5)
+    timers.schedule("c", 20)
+    timers.cancel("c")
+
+    assert timers.next_deadline() == 5
+    assert timers.pop_due(15) == ["a", "b"]
+    assert timers.pop_due(100) == []
+    assert len(timers) == 0
+
+
+def test_expired_reply_runs_the_on_timeout_block(order_flow, sent):
+    store = InMemoryStateStore()
+    timeouts = ReplyTimeouts(store)
+    flow = order_flow(NUDGE)
+    store.run_flow(flow)
+    timeouts.track(flow)
+
+    assert timeouts.run_due(flow.wait_deadline - 1) == []
+    [resumed] = timeouts.run_due(flow.wait_deadline + 1)
+
+    # the nudge points back to the question, which waits again
+    assert sent == ["Order number?", "Still there?", "Order number?"]
+    assert resumed.get_block_by_name("ask").status == BlockStatus.running
+    assert len(timeouts) == 1
+
+
+def test_expired_reply_without_on_timeout_fails_the_flow(order_flow, sent):
+    store = InMemoryStateStore()
+    timeouts = ReplyTimeouts(store)
+    flow = order_flow()
+    store.run_flow(flow)
+    timeouts.track(flow)
+
+    [expired] = timeouts.run_due(flow.wait_deadline + 1)
+    assert expired.flow_status == BlockStatus.failed
+    assert store.get_deadlines() == []
+
+
+def test_answered_flows_are_not_resumed(order_flow, sent):
+    store = InMemoryStateStore()
+    timeouts = ReplyTimeouts(store)
+    flow = order_flow()
+    store.run_flow(flow)
+    timeouts.track(flow)
+    deadline = flow.wait_deadline
+
+    store.run_flow(flow, "42")
+    timeouts.track(flow)
+    assert timeouts.run_due(deadline + 1) == []
+    assert sent == ["Order number?", "Thanks"]
+
+
+def test_deadlines_are_restored_from_the_store(order_flow, tmp_path, sent):
+    store = SQLiteStateStore(str(tmp_path / "states.sqlite3"))
+    for user in ("ana", "bia"):
+        store.run_flow(order_flow(to=user))
+
+    timeouts = ReplyTimeouts(store, owns=lambda from_, to: to == "ana")
+    assert timeouts.restore() == 1
+
+
+def test_reply_after_a_timeout_follows_the_block_with_a_dispatcher(order_flow, sent):
+    import asyncio
+
+    from dispatcher import OutboundDispatcher, set_dispatcher
+
+    flow = order_flow(NUDGE)
+
+    async def run():
+        dispatcher = OutboundDispatcher()
+        set_dispatcher(dispatcher)
+        try:
+            # the message blocks stay live while their messages are queued
+            await flow.arun_flow()
+            await flow.ahandle_timeout(flow.wait_deadline + 1)
+            await flow.arun_flow("42")
+            await dispatcher.stop()
+        finally:
+            set_dispatcher(None)
+
+    asyncio.run(run())
+    assert sent == ["Order number?", "Still there?", "Order number?", "Thanks"]
+    assert flow.flow_status == BlockStatus.success
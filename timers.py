@@ -0,0 +1,217 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+
+"""
+Reply timeouts of the send_and_reply blocks.
+
+A send_and_reply block can stop waiting for the answer after some time:
+
+"ask_order": {
+    "block_type": "send_and_reply",
+    "sending_content": "What is your order number?",
+    "next_block_name": "lookup_order",
+    "reply_timeout": 600,
+    "on_timeout": "still_there"
+}
+
+When the block starts waiting, the flow sets its wait_deadline. ReplyTimeouts keeps
+the deadlines of the stored conversations in a TimerHeap and, when one expires, loads
+that conversation from the store and resumes it from the on_timeout block (a nudge
+like "are you still there?", which can point back to the question). Without on_timeout
+the conversation expires: the flow status becomes failed.
+
+    timeouts = ReplyTimeouts(store)
+    timeouts.restore()              # deadlines saved in the store, after a restart
+
+    flow.run_flow(message.content)  # for every inbound message
+    store.save(flow)
+    timeouts.track(flow)
+
+    timeouts.run_due()              # call it periodically, or timeouts.start()
+
+Only the expired conversations are read from the store, nothing is scanned.
+The InboundRouter workers do all of this on their own.
+"""
+
+
+class TimerHeap:
+    """
+    Deadlines by key in a binary heap. Scheduling a key again or cancelling it doesn't
+    touch the heap: the old entry is skipped when it reaches the top. The heap is
+    rebuilt when it holds too many of those stale entries.
+    """
+
+    def __init__(self):
+        self._heap: List[Tuple[float, int, Hashable]] = []
+        self._entries: Dict[Hashable, Tuple[float, int]] = {}
+        self._counter = itertools.count()
+
+    def schedule(self, key: Hashable, deadline: float):
+        """Set the deadline of the key, replacing the previous one"""
+
+        entry = (deadline, next(self._counter))
+        self._entries[key] = entry
+        heapq.heappush(self._heap, (*entry, key))
+        if len(self._heap) > 2 * len(self._entries) + 1024:
+            self._compact()
+
+    def cancel(self, key: Hashable):
+        self._entries.pop(key, None)
+
+    def deadline(self, key: Hashable) -> Optional[float]:
+        entry = self._entries.get(key)
+        return entry[0] if entry is not None else None
+
+    def next_deadline(self) -> Optional[float]:
+        """The earliest deadline, or None if there isn't any"""
+
+        self._drop_stale()
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now: float) -> List[Hashable]:
+        """Remove and return the keys whose deadline is not after now, earliest first"""
+
+        due = []
+        while True:
+            self._drop_stale()
+            if not self._heap or self._heap[0][0] > now:
+                return due
+            _, _, key = heapq.heappop(self._heap)
+            del self._entries[key]
+            due.append(key)
+
+    def _drop_stale(self):
+        heap = self._heap
+        while heap and self._entries.get(heap[0][2]) != heap[0][:2]:
+            heapq.heappop(heap)
+
+    def _compact(self):
+        self._heap = [(deadline, seq, key) for key, (deadline, seq) in self._entries.items()]
+        heapq.heapify(self._heap)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+
+class ReplyTimeouts:
+    """Resumes the stored conversations whose reply timeout expired"""
+
+    def __init__(
+        self,
+        store,
+        owns: Optional[Callable[[str, str], bool]] = None,
+        on_resumed: Optional[Callable] = None,
+    ):
+        """
+        store: the FlowStateStore of the conversations.
+        owns(from_, to): whether this instance handles the conversation, used by restore()
+            when several workers share a store.
+        on_resumed(flow): called after a conversation was resumed and saved.
+        """
+        self.store = store
+        self.owns = owns
+        self.on_resumed = on_resumed
+        self._timers = TimerHeap()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+
+    def restore(self) -> int:
+        """Load the pending deadlines saved in the store. Returns how many were loaded"""
+
+        count = 0
+        with self._lock:
+            for flow_id, from_, to, wake_at in self.store.get_deadlines():
+                if self.owns is None or self.owns(from_, to):
+                    self._timers.schedule(flow_id, wake_at)
+                    count += 1
+            self._wakeup.notify()
+        return count
+
+    def track(self, flow):
+        """Schedule (or cancel) the timeout of a flow after it ran. Call it after saving the flow"""
+
+        with self._lock:
+            if flow.wait_deadline is None:
+                self._timers.cancel(flow.flow_id)
+                return
+            self._timers.schedule(flow.flow_id, flow.wait_deadline)
+            if self._timers.next_deadline() == flow.wait_deadline:
+                self._wakeup.notify()
+
+    def seconds_to_next(self, now: Optional[float] = None) -> Optional[float]:
+        """Seconds until the next deadline, or None if no conversation is waiting"""
+
+        with self._lock:
+            deadline = self._timers.next_deadline()
+        if deadline is None:
+            return None
+        return max(deadline - (now if now is not None else time.time()), 0)
+
+    def run_due(self, now: Optional[float] = None) -> list:
+        """Resume the conversations whose deadline passed. Returns the resumed flows"""
+
+        now = now if now is not None else time.time()
+        with self._lock:
+            flow_ids = self._timers.pop_due(now)
+
+        resumed = []
+        for flow_id in flow_ids:
+            try:
+                flow = self.store.load(flow_id)
+                # the flow may have moved on since it was scheduled. handle_timeout checks it
+                if flow is None or not flow.handle_timeout(now):
+                    if flow is not None:
+                        self.track(flow)
+                    continue
+                self.store.save(flow)
+                self.track(flow)
+                resumed.append(flow)
+                if self.on_resumed is not None:
+                    self.on_resumed(flow)
+            except Exception as e:
+                logging.error(f"Error resuming flow {flow_id} after its reply timeout: {e}")
+        return resumed
+
+    def __len__(self):
+        return len(self._timers)
+
+    def start(self):
+        """
+        Run the timeouts in a background thread. The inbound messages of the same store
+        must not be processed at the same time by other threads (use run_due from the
+        thread that handles them instead)
+        """
+
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="reply_timeouts", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None):
+        with self._lock:
+            self._stopping = True
+            self._wakeup.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._stopping:
+                    deadline = self._timers.next_deadline()
+                    wait = None if deadline is None else deadline - time.time()
+                    if wait is not None and wait <= 0:
+                        break
+                    self._wakeup.wait(wait)
+                if self._stopping:
+                    return
+            self.run_due()